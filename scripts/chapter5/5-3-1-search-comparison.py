@@ -11,12 +11,15 @@
 
 import os
 import numpy as np
-from rank_bm25 import BM25Okapi
 from langchain_openai import OpenAIEmbeddings
 from typing import List, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 
+from bm25_index import BM25Index
+from embedding_cache import CachedEmbeddings
+from vector_store import MatrixVectorStore
+
 
 def prepare_documents() -> Tuple[List[str], str]:
     """サンプル文書とクエリを準備"""
@@ -69,7 +72,12 @@ def save_result(filename: str, content: str):
     print(f"\n結果を保存しました: {filepath}")
 
 
-def demo_keyword_search(documents: List[str], query: str):
+def build_keyword_index(documents: List[str]) -> BM25Index:
+    """文書集合からBM25インデックスを一度だけ構築"""
+    return BM25Index.from_tokens([simple_tokenizer(doc) for doc in documents])
+
+
+def demo_keyword_search(documents: List[str], query: str, index: BM25Index):
     """キーワード検索（BM25）のデモ"""
     print("=" * 60)
     print("【キーワード検索（BM25）】")
@@ -80,15 +88,13 @@ def demo_keyword_search(documents: List[str], query: str):
     for i, doc in enumerate(documents, 1):
         print(f"  文書{i}: {doc[:30]}...")
 
-    # 単語に分割（簡略版）
-    tokenized_docs = [simple_tokenizer(doc) for doc in documents]
+    # クエリを単語に分割（簡略版）
     tokenized_query = simple_tokenizer(query)
 
     print(f"\nクエリのトークン: {tokenized_query}")
 
-    # BM25でスコア計算
-    bm25 = BM25Okapi(tokenized_docs)
-    scores = bm25.get_scores(tokenized_query)
+    # 構築済みのBM25インデックスでスコア計算
+    scores = index.get_scores(tokenized_query)
 
     print("\nキーワード検索の結果:")
     for i, score in enumerate(scores, 1):
@@ -128,23 +134,20 @@ def demo_vector_search(documents: List[str], query: str):
     print(f"\n質問: {query}")
 
     try:
-        embeddings = OpenAIEmbeddings()
+        # 埋め込みはキャッシュ経由（2回目以降はAPIを呼ばない）
+        embeddings = CachedEmbeddings(OpenAIEmbeddings())
 
         print("\n1. 文書とクエリをベクトル化中...")
         # 文書とクエリを数値ベクトルに変換
-        doc_vectors = embeddings.embed_documents(documents)
+        # 文書ベクトルは正規化済みの行列として保持する
+        store = MatrixVectorStore(embeddings.embed_array(documents))
         query_vector = embeddings.embed_query(query)
 
-        print(f"   ベクトルの次元数: {len(doc_vectors[0])}次元")
+        print(f"   ベクトルの次元数: {store.dim}次元")
 
         print("\n2. コサイン類似度を計算中...")
-        # コサイン類似度を計算
-        similarities = []
-        for doc_vec in doc_vectors:
-            similarity = np.dot(query_vector, doc_vec) / (
-                np.linalg.norm(query_vector) * np.linalg.norm(doc_vec)
-            )
-            similarities.append(similarity)
+        # コサイン類似度を計算（全文書分を行列積1回で求める）
+        similarities = store.similarities(query_vector)[0]
 
         print("\nベクトル検索の結果:")
         for i, sim in enumerate(similarities, 1):
@@ -160,7 +163,7 @@ def demo_vector_search(documents: List[str], query: str):
         output.append("ベクトル検索（埋め込み）の結果")
         output.append("=" * 40)
         output.append(f"\n質問: {query}")
-        output.append(f"\nベクトルの次元数: {len(doc_vectors[0])}次元")
+        output.append(f"\nベクトルの次元数: {store.dim}次元")
         output.append("\n各文書の類似度:")
         for i, sim in enumerate(similarities, 1):
             output.append(f"  文書{i}: 類似度 {sim:.2f}")
@@ -184,8 +187,9 @@ def main():
     # サンプル文書とクエリの準備
     documents, query = prepare_documents()
 
-    # キーワード検索のデモ
-    demo_keyword_search(documents, query)
+    # キーワード検索のデモ（インデックスは一度だけ構築）
+    keyword_index = build_keyword_index(documents)
+    demo_keyword_search(documents, query, keyword_index)
 
     # ベクトル検索のデモ
     demo_vector_search(documents, query)
@@ -10,13 +10,15 @@ RRF（Reciprocal Rank Fusion）を使用して結果を統合します。
 """
 
 import os
-import numpy as np
-from rank_bm25 import BM25Okapi
 from langchain_openai import OpenAIEmbeddings
 from typing import List, Dict, Tuple
 from pathlib import Path
 from dotenv import load_dotenv
 
+from bm25_index import BM25Index
+from embedding_cache import CachedEmbeddings
+from vector_store import MatrixVectorStore
+
 def prepare_documents() -> Tuple[List[str], str]:
     """サンプル文書とクエリを準備"""
     documents = [
@@ -56,18 +58,21 @@ def simple_tokenizer(text: str) -> List[str]:
     return tokens
 
 
-def keyword_search(query: str, documents: List[str]) -> List[Tuple[int, float]]:
+def build_keyword_index(documents: List[str]) -> BM25Index:
+    """文書集合からBM25インデックスを一度だけ構築"""
+    return BM25Index.from_tokens([simple_tokenizer(doc) for doc in documents])
+
+
+def keyword_search(query: str, index: BM25Index) -> List[Tuple[int, float]]:
     """キーワード検索（BM25）を実行"""
-    # 単語に分割
-    tokenized_docs = [simple_tokenizer(doc) for doc in documents]
+    # クエリを単語に分割
     tokenized_query = simple_tokenizer(query)
 
-    # BM25でスコア計算
-    bm25 = BM25Okapi(tokenized_docs)
-    scores = bm25.get_scores(tokenized_query)
+    # 構築済みのインデックスでスコア計算
+    scores = index.get_scores(tokenized_query)
 
     # (文書インデックス, スコア)のリストを返す
-    results = [(i, score) for i, score in enumerate(scores)]
+    results = [(i, float(score)) for i, score in enumerate(scores)]
     # スコアの降順でソート
     results.sort(key=lambda x: x[1], reverse=True)
 
@@ -82,36 +87,28 @@ def vector_search(query: str, documents: List[str]) -> List[Tuple[int, float]]:
         return [(0, 0.90), (2, 0.89), (1, 0.84)]
 
     try:
-        embeddings = OpenAIEmbeddings()
+        # 埋め込みはキャッシュ経由（2回目以降はAPIを呼ばない）
+        embeddings = CachedEmbeddings(OpenAIEmbeddings())
 
         # 文書とクエリを数値ベクトルに変換
-        doc_vectors = embeddings.embed_documents(documents)
+        # 文書ベクトルは正規化済みの行列として保持する
+        store = MatrixVectorStore(embeddings.embed_array(documents))
         query_vector = embeddings.embed_query(query)
 
-        # コサイン類似度を計算
-        similarities = []
-        for doc_vec in doc_vectors:
-            similarity = np.dot(query_vector, doc_vec) / (
-                np.linalg.norm(query_vector) * np.linalg.norm(doc_vec)
-            )
-            similarities.append(similarity)
-
-        # (文書インデックス, 類似度)のリストを返す
-        results = [(i, sim) for i, sim in enumerate(similarities)]
-        # 類似度の降順でソート
-        results.sort(key=lambda x: x[1], reverse=True)
-
-        return results
+        # コサイン類似度を行列積1回で計算し、
+        # (文書インデックス, 類似度)のリストを類似度の降順で返す
+        return store.search(query_vector, k=len(documents))
 
     except Exception as e:
         print(f"エラー: {e}")
         return []
 
 
-def hybrid_search(query: str, documents: List[str]) -> List[Tuple[int, float]]:
+def hybrid_search(query: str, documents: List[str],
+                  keyword_index: BM25Index) -> List[Tuple[int, float]]:
     """ハイブリッド検索（簡略版）"""
     # キーワード検索の結果
-    keyword_results = keyword_search(query, documents)
+    keyword_results = keyword_search(query, keyword_index)
     print("\nキーワード検索の結果（順位）:")
     for rank, (doc_idx, score) in enumerate(keyword_results, 1):
         print(f"  {rank}位: 文書{doc_idx + 1}（スコア: {score:.2f}）")
@@ -171,8 +168,9 @@ def main():
     print("【ハイブリッド検索の実行】")
     print("=" * 60)
 
-    # ハイブリッド検索を実行
-    hybrid_results = hybrid_search(query, documents)
+    # ハイブリッド検索を実行（BM25インデックスは一度だけ構築）
+    keyword_index = build_keyword_index(documents)
+    hybrid_results = hybrid_search(query, documents, keyword_index)
 
     print("\n" + "=" * 60)
     print("【最終結果（RRFで統合）】")
@@ -9,12 +9,11 @@ LCELを使用してChromaとOpenAIを組み合わせた最小構成のRAGシス
 import os
 import sys
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Optional
 from dotenv import load_dotenv
 
 # LangChain関連のインポート
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
 from langchain_community.document_loaders import TextLoader, DirectoryLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.prompts import ChatPromptTemplate
@@ -22,52 +21,44 @@ from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.documents import Document
 
+from context_packer import ContextPacker
+from document_loader import list_files, read_text_document, stream_documents
+from embedding_cache import CachedEmbeddings
+from persistent_store import create_vectorstore, startup_latency
 
-def load_faq_documents(data_dir: str = "sample_data") -> List[Document]:
-    """FAQドキュメントを読み込む"""
+
+def load_faq_documents(data_dir: str = "sample_data") -> Optional[Iterator[Document]]:
+    """
+    FAQドキュメントを読み込みながら1件ずつ返す（全文書をリストにしない）
+
+    ディレクトリやファイルがない場合は None を返します。
+    """
     data_path = Path(data_dir)
 
     if not data_path.exists():
         print(f"エラー: {data_dir}ディレクトリが存在しません")
-        return []
-
-    documents = []
+        return None
 
-    # FAQファイルを読み込み
-    faq_files = sorted(data_path.glob("faq_*.txt"))
+    # FAQファイルを列挙（中身はまだ読まない）
+    faq_files = list_files(data_path, "faq_*.txt")
 
     if not faq_files:
         print(f"警告: {data_dir}にFAQファイルが見つかりません")
-        return []
+        return None
 
     print(f"{len(faq_files)}個のFAQファイルを読み込み中...")
 
-    for file_path in faq_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                doc = Document(
-                    page_content=content,
-                    metadata={
-                        "source": file_path.name,
-                        "id": file_path.stem
-                    }
-                )
-                documents.append(doc)
-        except Exception as e:
-            print(f"エラー: {file_path}の読み込みに失敗: {e}")
+    # スレッドプールで並列に読み込み（結果はファイル名順）
+    return stream_documents(faq_files, read_text_document)
 
-    return documents
+
+# 文脈の組み立て（同じ出典の重複をまとめ、トークン数の上限まで詰める）
+context_packer = ContextPacker(max_tokens=2000)
 
 
 def format_docs(docs: List[Document]) -> str:
-    """検索結果を出典付きでフォーマット"""
-    formatted = []
-    for i, doc in enumerate(docs):
-        source = doc.metadata.get('source', 'unknown')
-        content = doc.page_content
-        formatted.append(f"【出典{i+1}】{source}\n内容: {content}")
-    return "\n\n".join(formatted)
+    """検索結果を出典付きでフォーマット（検索順に2000トークンまで）"""
+    return context_packer.format(docs)
 
 
 def demo_vector_search():
@@ -79,19 +70,17 @@ def demo_vector_search():
     # FAQドキュメントを読み込み
     documents = load_faq_documents()
 
-    if not documents:
+    if documents is None:
         print("ドキュメントが読み込めませんでした")
         return None
 
-    print(f"\n{len(documents)}個のドキュメントを読み込みました")
-
-    # 埋め込みとベクトルストアの作成
+    # 埋め込みとベクトルストアの作成（読み込みながら取り込む）
     print("\nベクトルストアを作成中...")
-    embeddings = OpenAIEmbeddings()
-    vectorstore = Chroma.from_documents(
-        documents=documents,
-        embedding=embeddings,
-        collection_name="faq_demo"
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    vectorstore, persistent = create_vectorstore(
+        documents,
+        embeddings,
+        collection_name="faq_demo",
     )
 
     print("ベクトルストアの作成が完了しました")
@@ -104,6 +93,7 @@ def demo_vector_search():
     query = "VPN繋がらない"
     print(f"\n検索クエリ: {query}")
     results = vectorstore.similarity_search(query, k=3)
+    startup_latency.report_first_query("永続化モード" if persistent else "一時コレクション")
 
     print("\n検索結果（上位3件）:")
     for i, doc in enumerate(results):
@@ -119,15 +109,15 @@ def create_rag_pipeline(vectorstore=None):
     if vectorstore is None:
         # ベクトルストアがない場合は作成
         documents = load_faq_documents()
-        if not documents:
+        if documents is None:
             print("エラー: ドキュメントが読み込めませんでした")
             return None
 
-        embeddings = OpenAIEmbeddings()
-        vectorstore = Chroma.from_documents(
-            documents=documents,
-            embedding=embeddings,
-            collection_name="faq_demo"
+        embeddings = CachedEmbeddings(OpenAIEmbeddings())
+        vectorstore, _ = create_vectorstore(
+            documents,
+            embeddings,
+            collection_name="faq_demo",
         )
 
     # Retrieverの作成（上位4件を取得）
@@ -207,6 +197,7 @@ def main():
         except Exception as e:
             print(f"エラーが発生しました: {e}")
         print("-" * 40)
+    print(context_packer.stats())
 
     # インタラクティブモード
     print("\n" + "=" * 60)
@@ -3,62 +3,55 @@
 ハイブリッド検索デモ（BM25＋ベクトル＋RRF）
 
 第5章5.5節のサンプルコード
-LangChainのEnsembleRetrieverを使用したハイブリッド検索の実装
+EnsembleRetrieverと同じ重み付きRRFで、BM25とベクトル検索を並行実行するハイブリッド検索の実装
 """
 
 import os
 import sys
-import re
-from typing import List
+import time
+from typing import Iterator, List
 from pathlib import Path
+import numpy as np
 from dotenv import load_dotenv
 
 # LangChain関連のインポート
-from langchain_community.retrievers import BM25Retriever
-from langchain_classic.retrievers import EnsembleRetriever
-from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from document_loader import batched, list_files, read_text_document, stream_documents
+from embedding_cache import CachedEmbeddings
+from hybrid_retriever import HybridRetriever, grid_search_weights
+from inverted_index import PersistentBM25Retriever
+from japanese_tokenizer import tokenize
+from offset_splitter import OffsetTextSplitter
+from persistent_store import create_vectorstore, startup_latency
 
-def load_documents_from_files() -> List[Document]:
-    """hybrid_sample_data/ディレクトリからドキュメントを読み込み"""
+# BM25の転置インデックスの保存先（2回目以降はメモリマップで開くだけ）
+BM25_INDEX_DIR = Path(__file__).parent / ".cache" / "bm25_hybrid"
+
+
+def load_documents_from_files() -> Iterator[Document]:
+    """hybrid_sample_data/ディレクトリからドキュメントを読み込みながら1件ずつ返す（全文書をリストにしない）"""
     current_dir = Path(__file__).parent
     data_dir = current_dir / "hybrid_sample_data"
 
     if not data_dir.exists():
         raise FileNotFoundError(f"データディレクトリが見つかりません: {data_dir}")
 
-    documents = []
-
-    # .txtファイルを番号順にソート
-    txt_files = sorted(data_dir.glob("hybrid_doc_*.txt"))
-
-    for i, file_path in enumerate(txt_files):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-
-            document = Document(
-                page_content=content,
-                metadata={
-                    "source": file_path.name,
-                    "id": i + 1,
-                    "file_path": str(file_path)
-                }
-            )
-            documents.append(document)
+    # .txtファイルを番号順に列挙し、スレッドプールで並列に読み込む（結果はファイル名順）
+    txt_files = list_files(data_dir, "hybrid_doc_*.txt")
 
-        except Exception as e:
-            print(f"ファイル読み込みエラー {file_path}: {e}")
-            continue
-
-    if not documents:
+    if not txt_files:
         raise ValueError("読み込めるドキュメントファイルがありません")
 
-    return documents
+    for i, document in enumerate(stream_documents(txt_files, read_text_document)):
+        document.metadata = {
+            "source": document.metadata["source"],
+            "id": i + 1,
+            "file_path": str(data_dir / document.metadata["source"])
+        }
+        yield document
 
 
 def tokenize_for_bm25(text: str) -> list[str]:
@@ -66,18 +59,9 @@ def tokenize_for_bm25(text: str) -> list[str]:
     日本語を含むテキストを軽量にトークナイズする。
     - 英数字はそのまま1トークン。
     - 漢字・ひらがな・カタカナの連続部分は文字bi-gramに分解し、部分一致しやすくする。
+    （japanese_tokenizer.tokenize による1パスの実装。結果は従来の re.findall + re.fullmatch 版と同じ）
     """
-    tokens: list[str] = []
-    for chunk in re.findall(r"[A-Za-z0-9]+|[一-龥ぁ-んァ-ンー]+", text):
-        if re.fullmatch(r"[A-Za-z0-9]+", chunk):
-            tokens.append(chunk)
-        else:
-            # 日本語部分は bi-gram で分割して BM25 のヒット率を上げる
-            if len(chunk) == 1:
-                tokens.append(chunk)
-            else:
-                tokens.extend(chunk[i: i + 2] for i in range(len(chunk) - 1))
-    return tokens
+    return tokenize(text)
 
 
 def save_result(filename: str, content: str):
@@ -97,19 +81,20 @@ def compare_retrieval_methods(splits: List[Document]):
     output.append("\n=== 検索手法の比較 ===\n")
     print(output[-1])
 
-    # 1. BM25 Retrieverの構築
-    bm25_retriever = BM25Retriever.from_documents(
+    # 1. BM25 Retrieverの構築（保存済みインデックスがあれば再利用）
+    bm25_retriever = PersistentBM25Retriever.from_documents(
         splits,
+        index_dir=BM25_INDEX_DIR,
         preprocess_func=tokenize_for_bm25,
     )
     bm25_retriever.k = 3
 
     # 2. ベクトル検索 Retrieverの構築
-    embeddings = OpenAIEmbeddings()
-    vectorstore = Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        collection_name="hybrid_demo"
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    vectorstore, persistent = create_vectorstore(
+        splits,
+        embeddings,
+        collection_name="hybrid_demo",
     )
     dense_retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
 
@@ -138,6 +123,7 @@ def compare_retrieval_methods(splits: List[Document]):
         output.append("\n【ベクトル検索結果】")
         print("\n【ベクトル検索結果】")
         vector_results = dense_retriever.invoke(query)
+        startup_latency.report_first_query("永続化モード" if persistent else "一時コレクション")
         for i, doc in enumerate(vector_results):
             title = doc.page_content.splitlines()[0]
             output.append(f"  {i+1}. {doc.metadata['source']}: {title}")
@@ -148,8 +134,9 @@ def compare_retrieval_methods(splits: List[Document]):
 
     save_result("5-4-1-hybrid-search-comparison.txt", "\n".join(output))
 
-    # クリーンアップ
-    vectorstore.delete_collection()
+    # クリーンアップ（永続化モードでは次回の起動で再利用するため残す）
+    if not persistent:
+        vectorstore.delete_collection()
 
 
 def demonstrate_ensemble_retriever(splits: List[Document]):
@@ -159,28 +146,31 @@ def demonstrate_ensemble_retriever(splits: List[Document]):
     output.append("\n=== EnsembleRetriever（ハイブリッド検索）のデモ ===\n")
     print(output[-1])
 
-    # BM25 Retrieverの構築
-    bm25_retriever = BM25Retriever.from_documents(
+    # BM25 Retrieverの構築（保存済みインデックスがあれば再利用）
+    bm25_retriever = PersistentBM25Retriever.from_documents(
         splits,
+        index_dir=BM25_INDEX_DIR,
         preprocess_func=tokenize_for_bm25,
     )
     bm25_retriever.k = 12  # 多めに候補を取得
 
     # ベクトル検索 Retrieverの構築
-    embeddings = OpenAIEmbeddings()
-    vectorstore = Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        collection_name="ensemble_demo"
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    vectorstore, persistent = create_vectorstore(
+        splits,
+        embeddings,
+        collection_name="ensemble_demo",
     )
     dense_retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
 
-    # EnsembleRetrieverでハイブリッド検索を構築（内部でRRF）
+    # ハイブリッド検索を構築（EnsembleRetrieverと同じ重み付きRRF）
+    # BM25とベクトル検索を同時に実行するため、待ち時間は遅い方の検索だけになる
     # weights: 各Retrieverの重み付け（合計1でなくてよい）
-    hybrid_retriever = EnsembleRetriever(
+    hybrid_retriever = HybridRetriever(
         retrievers=[bm25_retriever, dense_retriever],
         weights=[0.6, 1.0],  # BM25を少し抑えめ、ベクトルを重視
         c=60,               # RRFのk（高順位をどれだけ強調するか）
+        branch_names=["BM25", "ベクトル"],
     )
 
     # テストクエリ（ハイブリッドデモ用）
@@ -195,8 +185,11 @@ def demonstrate_ensemble_retriever(splits: List[Document]):
         print(f"クエリ: '{query}'")
         print("-" * 50)
 
-        # ハイブリッド検索の実行
-        results = hybrid_retriever.invoke(query)
+        # ハイブリッド検索の実行（ブランチごとの所要時間も記録される）
+        hybrid_result = hybrid_retriever.search(query)
+        results = hybrid_result.documents
+        output.append(hybrid_result.timing_summary())
+        print(hybrid_result.timing_summary())
 
         # 上位4件を表示（ファイル名＋タイトル）
         output.append("ハイブリッド検索結果（上位4件）:")
@@ -225,30 +218,55 @@ def demonstrate_ensemble_retriever(splits: List[Document]):
 
     query = "セマンティック検索のメリット"  # 重みで1位が揺れやすいクエリ
 
+    # 検索は1回だけ行い、各ブランチの順位リストを重みを変えて融合し直す
+    hybrid_result = hybrid_retriever.search(query)
+
     for bm25_w, vec_w, desc in weight_configs:
         output2.append(f"\n設定: {desc} (BM25={bm25_w}, Vector={vec_w})")
         output2.append("-" * 40)
         print(f"\n設定: {desc} (BM25={bm25_w}, Vector={vec_w})")
         print("-" * 40)
 
-        # 異なる重み付けでEnsembleRetrieverを構築
-        weighted_hybrid = EnsembleRetriever(
-            retrievers=[bm25_retriever, dense_retriever],
-            weights=[bm25_w, vec_w],
-            c=60,
-        )
-
-        results = weighted_hybrid.invoke(query)
+        # 異なる重み付けで再融合（BM25・埋め込み・ベクトル検索の呼び出しなし）
+        results = hybrid_result.refuse([bm25_w, vec_w], c=60)
         output2.append("上位3件の結果:")
         print("上位3件の結果:")
         for i, doc in enumerate(results[:3]):
             output2.append(f"  {i+1}. {doc.metadata['source']}")
             print(f"  {i+1}. {doc.metadata['source']}")
 
+    # 重みとcのグリッドサーチ（検索結果を使い回すので、数千通りでも一瞬で終わる）
+    output2.append("\n=== 重みとcのグリッドサーチ ===")
+    print(output2[-1])
+    evaluation_set = {
+        "X-Pack monitoring の設定方法": {"hybrid_doc_02.txt"},
+        "セマンティック検索のメリット": {"hybrid_doc_03.txt"},
+    }
+    eval_results = [hybrid_retriever.search(q) for q in evaluation_set]
+    bm25_weights = np.linspace(0.0, 1.0, 51)
+    weight_grid = np.column_stack([bm25_weights, 1.0 - bm25_weights])
+    c_values = [1, 10, 30, 60, 100]
+
+    start = time.perf_counter()
+    ranking = grid_search_weights(
+        eval_results, list(evaluation_set.values()), weight_grid, c_values=c_values, k=1
+    )
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    output2.append(f"{len(ranking)}通りの設定を{elapsed_ms:.2f}msで評価（上位3件）:")
+    print(output2[-1])
+    for row in ranking[:3]:
+        bm25_w, vec_w = row["weights"]
+        output2.append(
+            f"  BM25={bm25_w:.2f}, Vector={vec_w:.2f}, c={row['c']}: "
+            f"recall@1={row['recall']:.2f}, MRR={row['mrr']:.2f}"
+        )
+        print(output2[-1])
+
     save_result("5-4-1-weight-comparison.txt", "\n".join(output2))
 
-    # クリーンアップ
-    vectorstore.delete_collection()
+    # クリーンアップ（永続化モードでは次回の起動で再利用するため残す）
+    if not persistent:
+        vectorstore.delete_collection()
 
 
 def main():
@@ -256,17 +274,19 @@ def main():
     # .envファイルから環境変数を読み込み
     load_dotenv()
 
-    # サンプル文書の読み込み
-    documents = load_documents_from_files()
-    print(f"サンプル文書を{len(documents)}件読み込みました。")
-
-    # テキストの分割
-    text_splitter = RecursiveCharacterTextSplitter(
+    # テキストの分割（サンプル文書は読み込みながら少しずつ分割し、チャンクだけを保持する）
+    # RecursiveCharacterTextSplitter と同じ境界を、文字位置だけで求めるスプリッター
+    text_splitter = OffsetTextSplitter(
         chunk_size=800,
         chunk_overlap=160,
         separators=["\n\n", "\n", "。", "、", " ", ""]
     )
-    splits = text_splitter.split_documents(documents)
+    splits: List[Document] = []
+    n_documents = 0
+    for batch in batched(load_documents_from_files(), 64):
+        n_documents += len(batch)
+        splits.extend(text_splitter.split_documents(batch))
+    print(f"サンプル文書を{n_documents}件読み込みました。")
     print(f"文書を{len(splits)}個のチャンクに分割しました。")
 
     # 検索手法の比較
@@ -6,197 +6,650 @@
 社内規定文書を使った完全なRAGシステムの実装
 """
 
+import argparse
+import json
 import os
+import shutil
 import sys
-import yaml
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 
 # LangChain関連のインポート
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_community.retrievers import BM25Retriever
-from langchain_classic.retrievers import EnsembleRetriever
+from langchain_community.retrievers.bm25 import default_preprocessing_func
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from answer_cache import AnswerCache, prompt_version
+from batch_rag import BatchRAGPipeline
+from context_packer import ContextPacker
+from embedding_cache import CachedEmbeddings
+from document_loader import ingest_stream, list_files, stream_documents
+from front_matter import FrontMatterCache, read_front_matter_file
+from hybrid_retriever import HybridRetriever
+from incremental_index import CorpusManifest, IncrementalIndexer
+from inverted_index import InvertedIndex, PersistentBM25Retriever
+from metadata_index import create_prefiltered_retrievers, parse_where
+from offset_splitter import OffsetTextSplitter
+from persistent_store import persist_dir_from_env, startup_latency
+from prompt_cache import PromptCacheUsage, create_cache_friendly_prompt
+from quantized_store import QUANTIZATION_MODES
+from streaming_rag import StreamEvent, StreamingRAG
+
+# 差分更新用のインデックス（マニフェスト・Chroma・BM25）の保存先
+# RAG_PERSIST_DIR が設定されている場合はその下の company_index/ を使う
+INDEX_DIR = persist_dir_from_env("company_index") or Path(__file__).parent / ".cache" / "company_index"
+
+# 回答キャッシュ（SQLite）のファイル名（インデックスと同じディレクトリに置き、差分同期で無効化する）
+ANSWER_CACHE_NAME = "answer_cache.sqlite3"
+
+# フロントマターの解析結果のキャッシュ（ファイル内容の SHA-256 がキー）
+# 一時コレクションではメモリ上だけで使い、差分同期（sync_company_index）ではインデックスと同じ場所に保存する
+front_matter_cache = FrontMatterCache(None)
+
+# プロンプトに入れる参考文書のトークン数の上限
+CONTEXT_MAX_TOKENS = 3000
+
+# 回答の生成に使うモデル（第5章で使用しているモデル）
+LLM_MODEL = "gpt-5-nano"
+
+# 回答ルール（出典必須・ガードレール付き、質問によらず固定）
+RAG_RULES = """=== 回答ルール ===
+1. 必ず参考文書の内容に基づいて回答してください
+2. 参考文書にない情報は推測せず、「文書に記載がありません」と回答してください
+3. 可能な場合は、具体的な章・節番号を含めて回答してください
+   例: 「勤怠規定第3章第1節によると...」
+4. 回答の最後に、参照した出典情報を【出典: 章節名】の形で明記してください
+   例: 【出典: 勤怠規定 第3章第1節】"""
 
-def load_company_documents(data_dir: str = "company_docs") -> List[Document]:
-    """YAMLフロントマター付き社内規定文書を読み込む"""
+# プロンプトテンプレート（出典必須・ガードレール付き）
+RAG_TEMPLATE = """以下の参考文書を基に質問に回答してください。
+
+=== 参考文書 ===
+{context}
+
+=== 質問 ===
+{question}
+
+""" + RAG_RULES + """
+
+回答："""
+
+# プロンプトキャッシュ向けの並び: 固定の指示を先頭に置き、参考文書と質問は最後のメッセージに入れる
+RAG_INSTRUCTIONS = "以下の参考文書を基に質問に回答してください。\n\n" + RAG_RULES
+
+# LLM の呼び出しごとのトークン数（キャッシュ済みの入力を含む）の記録
+prompt_cache_usage = PromptCacheUsage(model=LLM_MODEL)
+
+
+def load_company_document(file_path: Path) -> Optional[Document]:
+    """YAMLフロントマター付きの社内規定文書を1件読み込む"""
+    try:
+        # YAMLフロントマターの解析（内容が変わっていないファイルはキャッシュを使う）
+        metadata, text_content, _ = read_front_matter_file(file_path, front_matter_cache)
+
+        # デフォルトメタデータを追加
+        metadata.setdefault('source', file_path.name)
+        metadata.setdefault('id', file_path.stem)
+
+        return Document(
+            page_content=text_content,
+            metadata=metadata
+        )
+    except Exception as e:
+        print(f"エラー: {file_path}の読み込みに失敗: {e}")
+        return None
+
+
+def stream_company_documents(data_dir: str = "company_docs") -> Optional[Iterator[Document]]:
+    """
+    YAMLフロントマター付き社内規定文書を並列に読み込み、ファイル名順に1件ずつ返す
+
+    全文書をリストにせず、分割・埋め込みへそのまま流せるジェネレータを返します。
+    ディレクトリやファイルがない場合は None を返します。
+    """
     data_path = Path(data_dir)
 
     if not data_path.exists():
         print(f"エラー: {data_dir}ディレクトリが存在しません")
-        return []
+        return None
 
-    documents = []
-
-    # .txtファイルを読み込み
-    txt_files = sorted(data_path.glob("*.txt"))
+    # .txtファイルを列挙（中身はまだ読まない）
+    txt_files = list_files(data_path, "*.txt")
 
     if not txt_files:
         print(f"警告: {data_dir}に文書ファイルが見つかりません")
-        return []
+        return None
 
     print(f"{len(txt_files)}個の社内規定ファイルを読み込み中...")
+    return stream_documents(txt_files, load_company_document)
 
-    for file_path in txt_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
 
-            # YAMLフロントマターの解析
-            if content.startswith('---'):
-                parts = content.split('---', 2)
-                metadata = yaml.safe_load(parts[1])
-                text_content = parts[2].strip()
-            else:
-                metadata = {}
-                text_content = content.strip()
+def load_company_documents(data_dir: str = "company_docs") -> List[Document]:
+    """YAMLフロントマター付き社内規定文書を読み込む"""
+    documents = stream_company_documents(data_dir)
+    if documents is None:
+        return []
+    documents = list(documents)
+    front_matter_cache.save()
+    return documents
 
-            # デフォルトメタデータを追加
-            metadata.setdefault('source', file_path.name)
-            metadata.setdefault('id', file_path.stem)
 
-            doc = Document(
-                page_content=text_content,
-                metadata=metadata
-            )
-            documents.append(doc)
-        except Exception as e:
-            print(f"エラー: {file_path}の読み込みに失敗: {e}")
+def create_text_splitter() -> OffsetTextSplitter:
+    """
+    RAGパイプライン共通のテキスト分割設定
 
-    return documents
+    RecursiveCharacterTextSplitter と同じ境界のチャンクを文字位置だけで求めるため、
+    既存のインデックス・チャンクIDはそのまま使えます。
+    start_index（チャンクの開始位置）は、文脈の組み立てで重なるチャンクをまとめるのに使います。
+    """
+    return OffsetTextSplitter(
+        chunk_size=800,
+        chunk_overlap=160,
+        separators=["\n\n", "\n", "。", "、", " ", ""],
+        add_start_index=True
+    )
 
 
-def format_docs(docs: List[Document]) -> str:
-    """ドキュメントを出典付きでフォーマット（章節情報を含む）"""
-    formatted = []
-    for i, doc in enumerate(docs):
-        source = doc.metadata.get('source', 'unknown')
-        reference = doc.metadata.get('reference', '')
-        content = doc.page_content
+def sync_company_index(
+    data_dir: str = "company_docs",
+    index_dir: Path = INDEX_DIR
+) -> IncrementalIndexer:
+    """社内規定文書の変更分だけを Chroma と BM25 インデックスに反映する"""
+    global front_matter_cache
+    front_matter_cache = FrontMatterCache(index_dir / "front_matter.json")
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    answer_cache = AnswerCache(index_dir / ANSWER_CACHE_NAME)
+    manifest = CorpusManifest(index_dir / "manifest.json")
+    vectorstore = Chroma(
+        collection_name="company_docs",
+        embedding_function=embeddings,
+        persist_directory=str(index_dir / "chroma"),
+    )
 
-        # referenceがある場合は章節情報を優先表示
-        if reference:
-            formatted.append(f"【出典{i+1}】{reference} ({source})\n内容: {content}")
-        else:
-            formatted.append(f"【出典{i+1}】{source}\n内容: {content}")
-    return "\n\n".join(formatted)
+    # コレクションに記録したバージョンがマニフェストと食い違う場合
+    # （同期の中断やマニフェストの削除など）は、インデックスを作り直す
+    recorded_version = (vectorstore._collection.metadata or {}).get("corpus_version")
+    expected_version = manifest.version() if manifest.path.exists() else None
+    if recorded_version != expected_version:
+        print("  - インデックスとマニフェストのバージョンが一致しないため作り直します")
+        vectorstore.delete_collection()
+        shutil.rmtree(index_dir / "bm25", ignore_errors=True)
+        manifest.path.unlink(missing_ok=True)
+        manifest = CorpusManifest(manifest.path)
+        vectorstore = Chroma(
+            collection_name="company_docs",
+            embedding_function=embeddings,
+            persist_directory=str(index_dir / "chroma"),
+        )
 
+    indexer = IncrementalIndexer(
+        data_dir=Path(data_dir),
+        manifest=manifest,
+        load_file=load_company_document,
+        text_splitter=create_text_splitter(),
+        vectorstore=vectorstore,
+        embeddings=embeddings,
+        bm25_index=InvertedIndex(index_dir / "bm25"),
+        preprocess_func=default_preprocessing_func,
+        parse_cache=front_matter_cache,
+        # 更新・削除されたチャンクを引用している回答はキャッシュから削除する
+        on_chunks_deleted=answer_cache.invalidate_chunks,
+    )
+
+    stats = indexer.sync()
+    vectorstore._collection.modify(metadata={"corpus_version": manifest.version()})
+    print(
+        f"✓ 差分同期: 追加{stats['added']}件 / 更新{stats['updated']}件 / "
+        f"削除{stats['deleted']}件 / 変更なし{stats['unchanged']}件"
+    )
+    print(
+        f"  - チャンク追加{stats['chunks_added']}件 / チャンク削除{stats['chunks_deleted']}件"
+        f"（{stats['seconds']:.2f}秒）"
+    )
+    if stats["failed"]:
+        print(f"  - 読み込めなかったファイル（次回の同期で再試行）: {', '.join(stats['failed'])}")
+    print(f"  - {front_matter_cache.stats()}")
+    if answer_cache.invalidated:
+        print(f"  - 回答キャッシュ: 更新・削除されたチャンクを引用する{answer_cache.invalidated}件を無効化")
+    return indexer
+
+
+def format_block(number: int, doc: Document) -> str:
+    """1件のドキュメントを出典付きでフォーマット（章節情報を含む）"""
+    source = doc.metadata.get('source', 'unknown')
+    reference = doc.metadata.get('reference', '')
+    content = doc.page_content
+
+    # referenceがある場合は章節情報を優先表示
+    if reference:
+        return f"【出典{number}】{reference} ({source})\n内容: {content}"
+    return f"【出典{number}】{source}\n内容: {content}"
+
+
+# 文脈の組み立て（重なるチャンクをまとめ、トークン数の上限まで詰める）
+context_packer = ContextPacker(max_tokens=CONTEXT_MAX_TOKENS, format_block=format_block)
 
-def create_rag_pipeline(
-    documents: Optional[List[Document]] = None,
-    use_hybrid: bool = False
-) -> Tuple:
-    """統合RAGパイプラインの構築"""
 
-    # ドキュメントが渡されない場合はロード
+def format_docs(docs: List[Document], scores: Optional[List[float]] = None) -> str:
+    """
+    ドキュメントを出典付きでフォーマット（章節情報を含む）
+
+    同じファイルの重なるチャンクは1つにまとめ、スコア（なければ検索順）の高い順に
+    CONTEXT_MAX_TOKENS トークンまで詰めます。
+    """
+    return context_packer.format(docs, scores)
+
+
+def create_generation_chain(cache_friendly_prompt: bool = False):
+    """
+    文脈と質問（{"context", "question"}）から回答を生成するチェーン（プロンプト → LLM → 文字列）
+
+    cache_friendly_prompt=True では固定の回答ルールを先頭に置き、参考文書と質問を最後に置きます。
+    呼び出しごとのトークン数（キャッシュ済みの入力を含む）は prompt_cache_usage に記録します。
+    """
+    if cache_friendly_prompt:
+        prompt = create_cache_friendly_prompt(RAG_INSTRUCTIONS)
+    else:
+        prompt = ChatPromptTemplate.from_template(RAG_TEMPLATE)
+
+    # LLMの設定（ストリーミングでも使用量を受け取る）
+    llm = ChatOpenAI(
+        model=LLM_MODEL,
+        temperature=0,
+        stream_usage=True,
+        callbacks=[prompt_cache_usage]
+    )
+    return prompt | llm | StrOutputParser()
+
+
+def prepare_index(
+    documents: Optional[Iterable[Document]] = None,
+    index_dir: Optional[Path] = None
+) -> Optional[Tuple[CachedEmbeddings, Chroma, Optional[IncrementalIndexer], List[Document]]]:
+    """
+    検索用のインデックスを用意する
+
+    Returns:
+        (埋め込みモデル, ベクトルストア, 差分同期のインデクサー, チャンク) または None（文書がない場合）
+        永続化モードではチャンクは空で、インデクサーの BM25 インデックスから取り出す（indexed_chunks）
+    """
+    if index_dir is not None:
+        # 永続化モード: 保存済みのインデックスを開き、変更分だけ反映する
+        indexer = sync_company_index(index_dir=index_dir)
+        print("  - 永続化済みのChromaベクトルストアを使用")
+        return indexer.embeddings, indexer.vectorstore, indexer, []
+
+    # ドキュメントが渡されない場合は、読み込みながら分割・埋め込みへ流す
     if documents is None:
-        documents = load_company_documents()
-        if not documents:
+        documents = stream_company_documents()
+        if documents is None:
             print("エラー: ドキュメントが読み込めませんでした")
-            return None, None
+            return None
+
+    # 埋め込みモデル（同じチャンクはキャッシュから取得し、再計算しない）
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+
+    # 読み込み → 分割 → 埋め込み → Vector Store への登録をバッチごとに進める
+    vectorstore = Chroma(collection_name="rag_pipeline", embedding_function=embeddings)
+    splits: List[Document] = []
+    stats = ingest_stream(
+        documents,
+        create_text_splitter(),
+        embeddings,
+        vectorstore,
+        on_chunks=splits.extend,  # BM25 用にチャンクを保持
+    )
+    front_matter_cache.save()
+    if not stats["documents"]:
+        print("エラー: ドキュメントが読み込めませんでした")
+        return None
+    print(
+        f"✓ {stats['documents']}個のドキュメントを{stats['chunks']}個のチャンクに分割して登録しました"
+        f"（{stats['seconds']:.2f}秒）"
+    )
+    print("  - Chromaベクトルストアを使用")
+    return embeddings, vectorstore, None, splits
 
-    print(f"✓ {len(documents)}個のドキュメントを処理中...")
 
-    # テキストの分割
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,
-        chunk_overlap=160,
-        separators=["\n\n", "\n", "。", "、", " ", ""]
-    )
-    splits = text_splitter.split_documents(documents)
-    print(f"✓ {len(splits)}個のチャンクに分割しました")
+def indexed_chunks(indexer: Optional[IncrementalIndexer], splits: List[Document]) -> List[Document]:
+    """検索対象のチャンク（永続化モードでは BM25 インデックスの削除されていない文書）"""
+    if indexer is None:
+        return splits
+    bm25_index = indexer.bm25_index
+    deleted = bm25_index.deleted_mask()
+    return [bm25_index.get_document(i) for i in range(len(bm25_index)) if not deleted[i]]
 
-    # 埋め込みモデル
-    embeddings = OpenAIEmbeddings()
 
-    # Retrieverの構築
-    if use_hybrid:
-        print("✓ ハイブリッド検索モードを使用")
+def vector_store_dir(index_dir: Optional[Path], vector_storage: str) -> Optional[Path]:
+    """量子化したベクトルストアの保存先（永続化モードではインデックスの下、それ以外は一時ディレクトリ）"""
+    if index_dir is None or vector_storage == "float32":
+        return None
+    return index_dir / f"vectors_{vector_storage}"
 
-        # BM25 Retriever
-        bm25_retriever = BM25Retriever.from_documents(splits)
-        bm25_retriever.k = 8
 
-        # Vector Store Retriever
-        vectorstore = Chroma.from_documents(
-            splits,
+def create_retrieval_runnable(
+    documents: Optional[Iterable[Document]] = None,
+    use_hybrid: bool = False,
+    index_dir: Optional[Path] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    vector_storage: str = "float32"
+) -> Tuple:
+    """
+    質問から (検索したチャンク, スコア) を返す Runnable とベクトルストアの構築
+
+    スコアはハイブリッド検索の融合スコア（ベクトル検索のみでは None、検索順がスコアの順）です。
+
+    index_dir を指定すると永続化モードになり、company_docs/ の変更分だけを同期した
+    既存のインデックスを開きます（読み込み・分割・埋め込みは変更のあったファイルのみ）。
+
+    metadata_filter（例: {"document_type": "経費規定"}）を指定すると、フロントマターの
+    メタデータで候補のチャンクを先に絞り込み、BM25・ベクトル検索は候補だけを採点します。
+    絞り込み用のベクトル検索は vector_storage（"float32" / "int8" / "binary"）の形式で保持します。
+    """
+
+    prepared = prepare_index(documents, index_dir)
+    if prepared is None:
+        return None, None
+    embeddings, vectorstore, indexer, splits = prepared
+
+    # メタデータの条件がある場合は、チャンク番号を共有する絞り込み用の索引を作る
+    prefiltered = None
+    if metadata_filter:
+        prefiltered = create_prefiltered_retrievers(
+            indexed_chunks(indexer, splits),
             embeddings,
-            collection_name="rag_pipeline"
+            default_preprocessing_func,
+            where=metadata_filter,
+            k=8 if use_hybrid else 4,
+            vector_storage=vector_storage,
+            vector_store_dir=vector_store_dir(index_dir, vector_storage),
+        )
+        metadata_index = prefiltered[0].metadata_index
+        print(
+            f"✓ メタデータで絞り込み: {metadata_filter} → "
+            f"{len(metadata_index.candidates(metadata_filter))}/{len(metadata_index)}チャンク"
         )
-        print("  - Chromaベクトルストアを使用")
 
-        dense_retriever = vectorstore.as_retriever(search_kwargs={"k": 8})
+    # Retrieverの構築
+    if use_hybrid:
+        print("✓ ハイブリッド検索モードを使用")
+
+        if prefiltered is not None:
+            bm25_retriever, dense_retriever = prefiltered
+        else:
+            # BM25 Retriever（永続化モードでは保存済みの転置インデックスを開く）
+            if index_dir is not None:
+                bm25_retriever = PersistentBM25Retriever.from_index(
+                    indexer.bm25_index, default_preprocessing_func
+                )
+            else:
+                bm25_retriever = BM25Retriever.from_documents(splits)
+            bm25_retriever.k = 8
+
+            dense_retriever = vectorstore.as_retriever(search_kwargs={"k": 8})
 
-        hybrid_retriever = EnsembleRetriever(
+        # BM25とベクトル検索を同時に実行し、重み付きRRFで融合
+        hybrid_retriever = HybridRetriever(
             retrievers=[bm25_retriever, dense_retriever],
             weights=[0.6, 1.0],
             c=60,
+            branch_names=["BM25", "ベクトル"],
         )
 
-        context_runnable = RunnableLambda(
-            lambda question: format_docs(hybrid_retriever.invoke(question))
-        )
+        def retrieve_hybrid(question: str) -> Tuple[List[Document], List[float]]:
+            result = hybrid_retriever.search(question)
+            print(f"  - {result.timing_summary()}")
+            return result.documents, list(result.scores)
+
+        retrieval_runnable = RunnableLambda(retrieve_hybrid)
     else:
         print("✓ ベクトル検索モードを使用")
 
-        # Vector Store only
-        vectorstore = Chroma.from_documents(
-            splits,
-            embeddings,
-            collection_name="rag_pipeline"
-        )
-        print("  - Chromaベクトルストアを使用")
-
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-        context_runnable = retriever | format_docs
-
-    # プロンプトテンプレート（出典必須・ガードレール付き）
-    template = """以下の参考文書を基に質問に回答してください。
+        if prefiltered is not None:
+            retriever = prefiltered[1]
+        else:
+            retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
+        retrieval_runnable = retriever | RunnableLambda(lambda docs: (docs, None))
 
-=== 参考文書 ===
-{context}
+    print(f"  - {embeddings.stats()}")
+    print(f"  - 文脈の上限: {CONTEXT_MAX_TOKENS}トークン（重なるチャンクはまとめる）")
+    return retrieval_runnable, vectorstore
 
-=== 質問 ===
-{question}
-
-=== 回答ルール ===
-1. 必ず参考文書の内容に基づいて回答してください
-2. 参考文書にない情報は推測せず、「文書に記載がありません」と回答してください
-3. 可能な場合は、具体的な章・節番号を含めて回答してください
-   例: 「勤怠規定第3章第1節によると...」
-4. 回答の最後に、参照した出典情報を【出典: 章節名】の形で明記してください
-   例: 【出典: 勤怠規定 第3章第1節】
 
-回答："""
+def create_context_runnable(
+    documents: Optional[Iterable[Document]] = None,
+    use_hybrid: bool = False,
+    index_dir: Optional[Path] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    vector_storage: str = "float32"
+) -> Tuple:
+    """質問から出典付きの文脈を作る Runnable（検索 → format_docs）とベクトルストアの構築"""
+    retrieval_runnable, vectorstore = create_retrieval_runnable(
+        documents, use_hybrid, index_dir, metadata_filter, vector_storage
+    )
+    if retrieval_runnable is None:
+        return None, None
+    return retrieval_runnable | RunnableLambda(lambda result: format_docs(*result)), vectorstore
+
+
+def create_answer_cache(cache_friendly_prompt: bool = False, index_dir: Optional[Path] = None) -> AnswerCache:
+    """
+    回答キャッシュ（モデル・プロンプト・文脈の上限が変われば別のキーになる）
+
+    index_dir を指定した永続化モードでは index_dir に保存し、差分同期で更新・削除された
+    チャンクを引用する回答は sync_company_index が無効化します。index_dir が None の場合は
+    無効化する仕組みがないため、メモリ上だけで使います（実行のたびに空から始まる）。
+    """
+    return AnswerCache(
+        index_dir / ANSWER_CACHE_NAME if index_dir is not None else None,
+        model=LLM_MODEL,
+        prompt_version=prompt_version(
+            RAG_INSTRUCTIONS if cache_friendly_prompt else RAG_TEMPLATE,
+            cache_friendly_prompt,
+            CONTEXT_MAX_TOKENS,
+        ),
+    )
 
-    prompt = ChatPromptTemplate.from_template(template)
 
-    # LLMの設定
-    llm = ChatOpenAI(
-        model="gpt-5-nano",  # 第5章で使用しているモデル
-        temperature=0
+def create_rag_pipeline(
+    documents: Optional[Iterable[Document]] = None,
+    use_hybrid: bool = False,
+    index_dir: Optional[Path] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    cache_friendly_prompt: bool = False,
+    answer_cache: Optional[AnswerCache] = None,
+    vector_storage: str = "float32"
+) -> Tuple:
+    """
+    統合RAGパイプラインの構築（先頭の4つの引数と vector_storage は create_context_runnable と同じ）
+
+    cache_friendly_prompt=True では固定の回答ルールを先頭に置いたプロンプトを使います。
+    answer_cache を指定すると、質問と検索したチャンクが同じなら回答の生成を省略します。
+    """
+    retrieval_runnable, vectorstore = create_retrieval_runnable(
+        documents, use_hybrid, index_dir, metadata_filter, vector_storage
     )
-
-    # LCELでパイプラインを構築
-    rag_chain = (
-        {"context": context_runnable, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
+    if retrieval_runnable is None:
+        return None, None
+    generation_chain = create_generation_chain(cache_friendly_prompt)
+
+    if answer_cache is None:
+        # LCELでパイプラインを構築
+        rag_chain = (
+            {
+                "context": retrieval_runnable | RunnableLambda(lambda result: format_docs(*result)),
+                "question": RunnablePassthrough(),
+            }
+            | generation_chain
+        )
+        return rag_chain, vectorstore
+
+    def answer_with_cache(question: str) -> str:
+        # 検索は毎回行い、質問と検索したチャンクが同じ回答があれば生成しない
+        docs, scores = retrieval_runnable.invoke(question)
+        answer = answer_cache.get(question, docs)
+        if answer is None:
+            answer = generation_chain.invoke({"context": format_docs(docs, scores), "question": question})
+            answer_cache.put(question, docs, answer)
+        return answer
+
+    return RunnableLambda(answer_with_cache), vectorstore
+
+
+def create_streaming_pipeline(
+    documents: Optional[Iterable[Document]] = None,
+    use_hybrid: bool = False,
+    index_dir: Optional[Path] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    cache_friendly_prompt: bool = False,
+    vector_storage: str = "float32"
+) -> Tuple[Optional[StreamingRAG], Optional[Chroma]]:
+    """
+    回答をトークンごとに返すRAGパイプラインの構築（引数は create_rag_pipeline と同じ）
+
+    文脈ができた時点で回答の生成を始め、検索完了・最初のトークン・最後のトークンの時刻を記録します。
+    """
+    context_runnable, vectorstore = create_context_runnable(
+        documents, use_hybrid, index_dir, metadata_filter, vector_storage
     )
+    if context_runnable is None:
+        return None, None
+    return StreamingRAG(context_runnable, create_generation_chain(cache_friendly_prompt)), vectorstore
+
+
+def create_batch_pipeline(
+    documents: Optional[Iterable[Document]] = None,
+    use_hybrid: bool = False,
+    index_dir: Optional[Path] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    max_concurrency: int = 8,
+    cache_friendly_prompt: bool = False,
+    vector_storage: str = "float32"
+) -> Tuple[Optional[BatchRAGPipeline], Optional[Chroma]]:
+    """
+    大量の質問をまとめて処理するバッチ用のRAGパイプラインの構築
+
+    create_rag_pipeline と同じインデックス・プロンプト・LLMを使い、全質問の埋め込みを1回で求めて
+    行列積で検索し、同じ文脈は共有して、回答の生成を max_concurrency 件ずつ並行に行います。
+    チャンクの埋め込みは vector_storage（"float32" / "int8" / "binary"）の形式で保持します。
+    """
+    prepared = prepare_index(documents, index_dir)
+    if prepared is None:
+        return None, None
+    embeddings, vectorstore, indexer, splits = prepared
+
+    # チャンクの埋め込み行列（埋め込みはキャッシュ済みのため再計算しない）
+    bm25_retriever, vector_retriever = create_prefiltered_retrievers(
+        indexed_chunks(indexer, splits),
+        embeddings,
+        default_preprocessing_func,
+        where=metadata_filter,
+        k=8 if use_hybrid else 4,
+        vector_storage=vector_storage,
+        vector_store_dir=vector_store_dir(index_dir, vector_storage),
+    )
+    if metadata_filter:
+        metadata_index = vector_retriever.metadata_index
+        print(
+            f"✓ メタデータで絞り込み: {metadata_filter} → "
+            f"{len(metadata_index.candidates(metadata_filter))}/{len(metadata_index)}チャンク"
+        )
+    print(
+        f"✓ バッチモード（{'ハイブリッド検索' if use_hybrid else 'ベクトル検索'}・"
+        f"埋め込み {vector_storage}・同時実行数 {max_concurrency}）"
+    )
+    print(f"  - {embeddings.stats()}")
+
+    pipeline = BatchRAGPipeline(
+        bm25_retriever,
+        vector_retriever,
+        create_generation_chain(cache_friendly_prompt),
+        format_docs,
+        use_hybrid=use_hybrid,
+        weights=[0.6, 1.0],
+        c=60,
+        max_concurrency=max_concurrency,
+    )
+    return pipeline, vectorstore
+
+
+def run_batch(
+    questions_file: Path,
+    output_file: Optional[Path] = None,
+    use_hybrid: bool = False,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    max_concurrency: int = 8,
+    cache_friendly_prompt: bool = False,
+    vector_storage: str = "float32"
+):
+    """質問ファイル（1行1問）の全質問に回答し、スループットと段階ごとの所要時間を表示する"""
+    questions = [
+        line.strip() for line in questions_file.read_text(encoding="utf-8").splitlines() if line.strip()
+    ]
+    if not questions:
+        print(f"エラー: {questions_file}に質問がありません")
+        return
 
-    return rag_chain, vectorstore
-
+    index_dir = persist_dir_from_env("company_index")
+    pipeline, vectorstore = create_batch_pipeline(
+        use_hybrid=use_hybrid,
+        index_dir=index_dir,
+        metadata_filter=metadata_filter,
+        max_concurrency=max_concurrency,
+        cache_friendly_prompt=cache_friendly_prompt,
+        vector_storage=vector_storage,
+    )
+    if pipeline is None:
+        return
 
-def main():
+    print(f"\n{len(questions)}問をバッチ処理中...")
+    result = pipeline.run(questions)
+
+    if output_file is not None:
+        with open(output_file, "w", encoding="utf-8") as f:
+            for question, answer in zip(result.questions, result.answers):
+                record = {"question": question}
+                if isinstance(answer, Exception):
+                    record["error"] = str(answer)
+                else:
+                    record["answer"] = answer
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"✓ 回答を{output_file}に保存しました")
+    else:
+        for question, answer in zip(result.questions, result.answers):
+            print(f"\n質問: {question}")
+            if isinstance(answer, Exception):
+                print(f"エラーが発生しました: {answer}")
+            else:
+                print(f"回答: {answer}")
+    print(f"\n✓ {result.summary()}")
+    print(f"  - {context_packer.stats()}")
+    print(f"  - {prompt_cache_usage.summary()}")
+
+    # クリーンアップ（永続化モードでは次回の起動で再利用するため残す）
+    if vectorstore and index_dir is None:
+        vectorstore.delete_collection()
+
+
+def main(
+    sync_only: bool = False,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    batch_file: Optional[Path] = None,
+    output_file: Optional[Path] = None,
+    use_hybrid: bool = False,
+    max_concurrency: int = 8,
+    stream: bool = False,
+    cache_friendly_prompt: bool = False,
+    use_answer_cache: bool = True,
+    vector_storage: str = "float32"
+):
     """メインの実行関数"""
     # .envファイルから環境変数を読み込み
     load_dotenv()
@@ -206,22 +659,32 @@ def main():
         print("エラー: OPENAI_API_KEY環境変数が設定されていません")
         sys.exit(1)
 
-    # 社内規定文書を読み込み
-    print("\n" + "=" * 60)
-    print("社内規定文書を読み込み中...")
-    print("=" * 60)
-
-    documents = load_company_documents()
+    if sync_only:
+        # 差分同期のみ実行（夜間の規定更新などを想定）
+        sync_company_index()
+        return
 
-    if not documents:
-        print("エラー: 文書が読み込めませんでした")
+    if batch_file is not None:
+        # オフラインQAなど、大量の質問をまとめて処理する
+        run_batch(
+            batch_file, output_file, use_hybrid, metadata_filter, max_concurrency, cache_friendly_prompt,
+            vector_storage,
+        )
         return
 
-    # RAGパイプラインの構築
+    # RAG_PERSIST_DIR が設定されていれば永続化モード（保存済みインデックスを再利用）
+    index_dir = persist_dir_from_env("company_index")
+
+    # RAGパイプラインの構築（一時コレクションでは社内規定文書を読み込みながら分割・埋め込みへ流す）
     print("\n" + "=" * 60)
     print("RAGパイプラインを構築中...")
     print("=" * 60)
 
+    # 回答キャッシュ（ストリーミングでは使わない。永続化モード以外ではメモリ上だけ）
+    answer_cache = (
+        create_answer_cache(cache_friendly_prompt, index_dir) if use_answer_cache and not stream else None
+    )
+
     # ベクトル検索のみとハイブリッド検索の両方をデモ
     for use_hybrid in [False, True]:
         mode_name = "ハイブリッド検索" if use_hybrid else "ベクトル検索"
@@ -229,13 +692,28 @@ def main():
         print(f"\n\n### {mode_name}モード ###")
         print("-" * 60)
 
-        rag_chain, vectorstore = create_rag_pipeline(
-            documents=documents,
-            use_hybrid=use_hybrid
-        )
+        # --stream の場合はトークンを届いた順に表示する
+        if stream:
+            rag_chain, vectorstore = create_streaming_pipeline(
+                use_hybrid=use_hybrid,
+                index_dir=index_dir,
+                metadata_filter=metadata_filter,
+                cache_friendly_prompt=cache_friendly_prompt,
+                vector_storage=vector_storage
+            )
+        else:
+            rag_chain, vectorstore = create_rag_pipeline(
+                use_hybrid=use_hybrid,
+                index_dir=index_dir,
+                metadata_filter=metadata_filter,
+                cache_friendly_prompt=cache_friendly_prompt,
+                answer_cache=answer_cache,
+                vector_storage=vector_storage
+            )
 
         if rag_chain is None:
-            continue
+            # 文書が読み込めなかった（エラーは prepare_index が表示済み）
+            return
 
         # テスト質問
         test_questions = [
@@ -248,21 +726,99 @@ def main():
             print(f"\n質問: {question}")
 
             try:
-                response = rag_chain.invoke(question)
-                print(f"回答: {response}")
+                if stream:
+                    for event in rag_chain.stream_events(question):
+                        if event.kind == StreamEvent.RETRIEVAL_DONE:
+                            print("回答: ", end="", flush=True)
+                        elif event.kind == StreamEvent.TOKEN:
+                            print(event.text, end="", flush=True)
+                    print(f"\n  - {rag_chain.last_timings.summary()}")
+                    startup_latency.report_first_query(
+                        "永続化モード・回答生成を含む" if index_dir else "一時コレクション・回答生成を含む"
+                    )
+                else:
+                    response = rag_chain.invoke(question)
+                    startup_latency.report_first_query(
+                        "永続化モード・回答生成を含む" if index_dir else "一時コレクション・回答生成を含む"
+                    )
+                    print(f"回答: {response}")
             except Exception as e:
                 print(f"エラーが発生しました: {e}")
 
             print("-" * 40)
 
-        # クリーンアップ
-        if vectorstore:
+        if stream:
+            print(rag_chain.summary())
+
+        # クリーンアップ（永続化モードでは次回の起動で再利用するため残す）
+        if vectorstore and index_dir is None:
             vectorstore.delete_collection()
 
+    # 実行全体の文脈のトークン数とプロンプトキャッシュの利用状況
+    print(f"\n{context_packer.stats()}")
+    print(prompt_cache_usage.summary())
+    if answer_cache is not None:
+        print(answer_cache.stats())
+
     print("\n" + "=" * 60)
     print("✓ すべての処理が完了しました")
     print("=" * 60)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="統合RAGパイプライン（出典付き回答）")
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help=f"company_docs/ の変更分だけを {INDEX_DIR} のインデックスに反映して終了",
+    )
+    parser.add_argument(
+        "--filter",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="フロントマターのメタデータで検索対象を絞り込む（例: --filter document_type=経費規定、複数指定可）",
+    )
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        metavar="FILE",
+        help="質問ファイル（1行1問）の全質問をバッチモードで処理する",
+    )
+    parser.add_argument("--output", type=Path, metavar="FILE", help="バッチモードの回答をJSON Lines で保存する")
+    parser.add_argument("--hybrid", action="store_true", help="バッチモードでハイブリッド検索を使う")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="バッチモードで同時に実行する生成リクエスト数")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="回答をトークンごとに表示し、検索完了・最初のトークン・最後のトークンの時刻を表示する",
+    )
+    parser.add_argument(
+        "--cache-friendly-prompt",
+        action="store_true",
+        help="固定の回答ルールを先頭、参考文書と質問を最後に置く（プロンプトキャッシュが効く並び）",
+    )
+    parser.add_argument(
+        "--no-answer-cache",
+        action="store_true",
+        help="回答キャッシュを使わず、毎回回答を生成する",
+    )
+    parser.add_argument(
+        "--vector-storage",
+        choices=("float32",) + QUANTIZATION_MODES,
+        default="float32",
+        help="メタデータの絞り込みとバッチモードのベクトル検索で埋め込みを保持する形式（int8・binary は量子化して省メモリ）",
+    )
+    args = parser.parse_args()
+    main(
+        sync_only=args.sync,
+        metadata_filter=parse_where(args.filter) or None,
+        batch_file=args.batch,
+        output_file=args.output,
+        use_hybrid=args.hybrid,
+        max_concurrency=args.max_concurrency,
+        stream=args.stream,
+        cache_friendly_prompt=args.cache_friendly_prompt,
+        use_answer_cache=not args.no_answer_cache,
+        vector_storage=args.vector_storage,
+    )
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+RAGの回答キャッシュ（質問・検索したチャンク・プロンプト・モデルをキーに、SQLiteへ保存）
+
+有給休暇・パスワード・経費精算のような同じ質問が問い合わせの大半を占めても、
+rag_chain.invoke は毎回検索と回答の生成をやり直します。AnswerCache は次の組をキーに回答を再利用します。
+
+- 正規化した質問（query_cache.normalize_query: 全角半角・大文字小文字・空白・末尾の句読点をそろえたもの）
+- 検索したチャンクのIDと本文のハッシュ（IDの順に並べたもの。検索順が変わっても同じキー）
+- プロンプトのバージョン（テンプレートの内容などから prompt_version で作る）
+- モデル名
+
+検索は毎回行うため、文書が更新されてチャンクの本文が変わればキーも変わり、古い回答は使われません。
+さらに差分同期（IncrementalIndexer の on_chunks_deleted）から invalidate_chunks を呼ぶと、
+削除・更新されたチャンクを引用している回答をすぐに削除します。
+
+- 件数の上限を超えたら、最も長く使われていないものから捨てる（LRU）
+- 保存から ttl_seconds を過ぎたものは使わない（TTL）
+
+保存形式（SQLite）:
+    answers        キー・正規化した質問・モデル・プロンプトのバージョン・回答・保存時刻・最終利用時刻
+    answer_chunks  キーと引用したチャンクIDの対応（チャンクIDで回答を無効化するための索引）
+
+使用例:
+    cache = AnswerCache(DEFAULT_CACHE_PATH, model="gpt-5-nano", prompt_version=prompt_version(RAG_TEMPLATE))
+    answer = cache.get(question, docs)
+    if answer is None:
+        answer = generation_chain.invoke({"context": format_docs(docs), "question": question})
+        cache.put(question, docs, answer)
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from query_cache import normalize_query
+
+DEFAULT_CACHE_PATH = Path(__file__).parent / ".cache" / "answer_cache.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+CREATE TABLE IF NOT EXISTS answer_chunks (
+    key TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    PRIMARY KEY (chunk_id, key)
+);
+CREATE INDEX IF NOT EXISTS answer_chunks_key ON answer_chunks (key);
+"""
+
+
+def prompt_version(*parts: object) -> str:
+    """プロンプトのテンプレートや文脈の設定から作るバージョン（内容が変われば変わる）"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def chunk_id(doc: Document) -> str:
+    """
+    チャンクのID（差分同期で付けた chunk_id、なければ出典と開始位置）
+
+    差分同期の chunk_id はファイル内容のハッシュを含むため、ファイルが更新されると変わります。
+    """
+    chunk = doc.metadata.get("chunk_id")
+    if chunk:
+        return str(chunk)
+    source = doc.metadata.get("source", "")
+    start = doc.metadata.get("start_index")
+    return f"{source}:{start}" if start is not None else str(source)
+
+
+def cited_chunks(docs: Iterable[Document]) -> List[Tuple[str, str]]:
+    """検索したチャンクの (ID, 本文のハッシュ) をIDの順に並べたもの"""
+    return sorted({
+        (chunk_id(doc), hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()[:16])
+        for doc in docs
+    })
+
+
+class AnswerCache:
+    """質問・検索したチャンク・プロンプト・モデルをキーに回答を再利用する SQLite のキャッシュ"""
+
+    def __init__(
+        self,
+        path: Optional[Path] = DEFAULT_CACHE_PATH,
+        model: str = "",
+        prompt_version: str = "",
+        max_entries: int = 10_000,
+        ttl_seconds: float = 7 * 24 * 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            path: 保存先のファイル（None ならメモリ上だけで使う）
+            model: 回答を生成するモデル名
+            prompt_version: プロンプトのバージョン（prompt_version で作る）
+            max_entries: 保持する回答数の上限
+            ttl_seconds: 回答の有効期間（秒）
+        """
+        self.path = Path(path) if path is not None else None
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """最初に使うときにデータベースを開く（バッチの並行生成からも使えるよう、ロックで直列化）"""
+        if self._connection is None:
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(
+                str(self.path) if self.path is not None else ":memory:", check_same_thread=False
+            )
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def key(self, question: str, docs: Sequence[Document]) -> str:
+        """(正規化した質問, チャンクのIDと本文のハッシュ, プロンプトのバージョン, モデル) のハッシュ"""
+        digest = hashlib.sha256()
+        for part in (normalize_query(question), self.prompt_version, self.model):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        for chunk, content_hash in cited_chunks(docs):
+            digest.update(f"{chunk}\0{content_hash}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, question: str, docs: Sequence[Document]) -> Optional[str]:
+        """キャッシュ済みの回答を返す（なければ None）"""
+        key = self.key(question, docs)
+        now = self.clock()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT answer, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._delete(connection, [key])
+                    connection.commit()
+                self.misses += 1
+                return None
+            connection.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, question: str, docs: Sequence[Document], answer: str):
+        """回答を保存する（上限を超えたら最も長く使われていないものから捨てる）"""
+        key = self.key(question, docs)
+        now = self.clock()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_query(question), self.model, self.prompt_version, answer, now, now),
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO answer_chunks VALUES (?, ?)",
+                [(key, chunk) for chunk, _ in cited_chunks(docs)],
+            )
+            # 期限切れを捨ててから、件数の上限を超えた分を古い順に捨てる
+            expired = [
+                row[0] for row in connection.execute(
+                    "SELECT key FROM answers WHERE created < ?", (now - self.ttl_seconds,)
+                )
+            ]
+            overflow = [
+                row[0] for row in connection.execute(
+                    "SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+                    (self.max_entries,),
+                )
+            ]
+            self._delete(connection, set(expired) | set(overflow))
+            connection.commit()
+
+    def invalidate_chunks(self, chunk_ids: Iterable[str]) -> int:
+        """指定したチャンクを引用している回答を削除し、削除した件数を返す"""
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return 0
+        with self._lock:
+            connection = self._connect()
+            keys = set()
+            for chunk in chunk_ids:
+                keys.update(
+                    row[0] for row in connection.execute(
+                        "SELECT key FROM answer_chunks WHERE chunk_id = ?", (chunk,)
+                    )
+                )
+            self._delete(connection, keys)
+            connection.commit()
+            self.invalidated += len(keys)
+            return len(keys)
+
+    @staticmethod
+    def _delete(connection: sqlite3.Connection, keys: Iterable[str]):
+        rows = [(key,) for key in keys]
+        connection.executemany("DELETE FROM answers WHERE key = ?", rows)
+        connection.executemany("DELETE FROM answer_chunks WHERE key = ?", rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def stats(self) -> str:
+        """キャッシュの利用状況を表示用の文字列で返す"""
+        return (
+            f"回答キャッシュ: ヒット {self.hits}件 / ミス {self.misses}件 / "
+            f"無効化 {self.invalidated}件（保存済み {len(self)}件）"
+        )
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+大量の質問をまとめて処理するRAGのバッチモード（検索の共有と生成の並列化）
+
+rag_chain.invoke を質問ごとに呼ぶと、1問ごとに「クエリの埋め込み → 検索 → 回答生成」を順番に待ちます。
+数千問のオフラインQAでは、待ち時間のほとんどが埋め込みAPIと生成APIの往復です。
+BatchRAGPipeline は同じ処理を段階ごとにまとめて行います。
+
+1. 埋め込み: 重複を除いた全質問を1回の呼び出しで埋め込む
+2. 検索: 全質問のクエリ行列とチャンクの埋め込み行列の行列積で上位k件を求める
+   （ハイブリッドでは BM25Index の結果と HybridRetriever と同じ重み付きRRFで融合）
+3. 文脈の作成: 検索結果のチャンクの組み合わせが同じ質問は、文脈の文字列を1回だけ作って共有する
+4. 生成: LCEL の batch で、同時実行数を max_concurrency 件に抑えて回答を並行生成する
+
+段階ごとの所要時間と、全体のスループット（質問/秒）を返します。
+
+使用例:
+    bm25_retriever, vector_retriever = create_prefiltered_retrievers(chunks, embeddings, preprocess_func, k=8)
+    pipeline = BatchRAGPipeline(bm25_retriever, vector_retriever, prompt | llm | StrOutputParser(),
+                                format_docs, use_hybrid=True, max_concurrency=8)
+    result = pipeline.run(questions)
+    print(result.summary())
+"""
+
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable
+
+from hybrid_retriever import weighted_rrf
+from metadata_index import PrefilteredBM25Retriever, PrefilteredVectorRetriever
+
+
+class BatchRAGResult:
+    """バッチ処理の結果（質問と同じ順の回答と、段階ごとの所要時間）"""
+
+    def __init__(
+        self,
+        questions: List[str],
+        answers: List[Any],
+        contexts: List[str],
+        timings: Dict[str, float],
+        n_unique_questions: int,
+        n_unique_contexts: int,
+    ):
+        self.questions = questions
+        self.answers = answers
+        self.contexts = contexts
+        self.timings = timings
+        self.n_unique_questions = n_unique_questions
+        self.n_unique_contexts = n_unique_contexts
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.timings.values())
+
+    @property
+    def questions_per_second(self) -> float:
+        return len(self.questions) / self.total_seconds if self.total_seconds else float("inf")
+
+    @property
+    def errors(self) -> int:
+        return sum(isinstance(answer, Exception) for answer in self.answers)
+
+    def summary(self) -> str:
+        """所要時間とスループットを表示用の文字列で返す"""
+        stages = " / ".join(f"{name} {seconds:.2f}秒" for name, seconds in self.timings.items())
+        return (
+            f"{len(self.questions)}問（重複除外後 {self.n_unique_questions}問・文脈 {self.n_unique_contexts}種類）を"
+            f"{self.total_seconds:.2f}秒で処理: {self.questions_per_second:.2f}問/秒"
+            f"（{stages}、エラー {self.errors}件）"
+        )
+
+
+class BatchRAGPipeline:
+    """質問のリストをまとめて埋め込み・検索し、回答を並行生成するRAGパイプライン"""
+
+    def __init__(
+        self,
+        bm25_retriever: PrefilteredBM25Retriever,
+        vector_retriever: PrefilteredVectorRetriever,
+        generation_chain: Runnable,
+        format_docs: Callable[[List[Document]], str],
+        use_hybrid: bool = False,
+        weights: Sequence[float] = (0.6, 1.0),
+        c: int = 60,
+        max_concurrency: int = 8,
+    ):
+        """
+        Args:
+            bm25_retriever: チャンク番号を vector_retriever と共有するBM25（create_prefiltered_retrievers の戻り値）
+            vector_retriever: 埋め込み行列を持つベクトル検索（取得件数は vector_retriever.k）
+            generation_chain: {"context", "question"} を受け取って回答を返す Runnable（prompt | llm | parser）
+            format_docs: 検索結果のチャンクを文脈の文字列にする関数
+            use_hybrid: BM25 とベクトル検索を重み付きRRFで融合するか
+            weights: RRFの重み（BM25, ベクトル）
+            c: RRFの定数
+            max_concurrency: 同時に実行する生成リクエスト数の上限
+        """
+        self.bm25_retriever = bm25_retriever
+        self.vector_retriever = vector_retriever
+        self.generation_chain = generation_chain
+        self.format_docs = format_docs
+        self.use_hybrid = use_hybrid
+        self.weights = list(weights)
+        self.c = c
+        self.max_concurrency = max_concurrency
+
+    def embed_questions(self, questions: Sequence[str]) -> np.ndarray:
+        """全質問を1回の呼び出しで埋め込む"""
+        return np.asarray(self.vector_retriever.embeddings.embed_documents(list(questions)), dtype=np.float32)
+
+    def retrieve_batch(self, questions: Sequence[str], query_vectors: np.ndarray) -> List[Tuple[int, ...]]:
+        """
+        全質問の検索結果をチャンク番号の組で返す
+
+        ベクトル検索は全質問を1回の行列積で、BM25 は質問ごとに転置インデックスで検索します。
+        メタデータの条件（retriever.where）があれば、その候補だけを対象にします。
+        """
+        vector = self.vector_retriever
+        candidates = vector.metadata_index.candidates(vector.where) if vector.where else None
+        dense_ids, _ = vector.vector_store.search_batch(query_vectors, vector.k, candidates=candidates)
+        if not self.use_hybrid:
+            return [tuple(int(i) for i in row) for row in dense_ids]
+
+        bm25 = self.bm25_retriever
+        mask = bm25.metadata_index.bitmap(bm25.where) if bm25.where else None
+        bm25_candidates = bm25.metadata_index.candidates(bm25.where) if bm25.where else None
+        results: List[Tuple[int, ...]] = []
+        for question, dense_row in zip(questions, dense_ids):
+            bm25_row = [
+                doc_id for doc_id, _ in
+                bm25.bm25.search(bm25.preprocess_func(question), k=bm25.k, mask=mask, candidates=bm25_candidates)
+            ]
+            # HybridRetriever.fuse と同じく、最初に現れた順に通し番号を振ってから融合する
+            positions: Dict[int, int] = {}
+            rank_lists = []
+            for row in (bm25_row, dense_row):
+                rank_lists.append(np.array(
+                    [positions.setdefault(int(doc_id), len(positions)) for doc_id in row], dtype=np.int64
+                ))
+            items = list(positions)
+            order, _ = weighted_rrf(rank_lists, self.weights, self.c, len(items))
+            results.append(tuple(items[i] for i in order))
+        return results
+
+    def run(self, questions: Sequence[str], max_concurrency: Optional[int] = None) -> BatchRAGResult:
+        """質問のリストに回答する（回答は質問と同じ順、失敗した質問は例外オブジェクト）"""
+        questions = list(questions)
+        timings: Dict[str, float] = {}
+
+        # 同じ質問は1回だけ処理する
+        unique_questions = list(dict.fromkeys(questions))
+
+        start = time.perf_counter()
+        query_vectors = self.embed_questions(unique_questions)
+        timings["埋め込み"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        doc_sets = self.retrieve_batch(unique_questions, query_vectors)
+        timings["検索"] = time.perf_counter() - start
+
+        # チャンクの組み合わせが同じなら文脈の文字列を共有する
+        start = time.perf_counter()
+        documents = self.vector_retriever.documents
+        context_by_docs: Dict[Tuple[int, ...], str] = {}
+        for doc_set in doc_sets:
+            if doc_set not in context_by_docs:
+                context_by_docs[doc_set] = self.format_docs([documents[i] for i in doc_set])
+        contexts = [context_by_docs[doc_set] for doc_set in doc_sets]
+        timings["文脈の作成"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        unique_answers = self.generation_chain.batch(
+            [{"context": context, "question": question} for question, context in zip(unique_questions, contexts)],
+            config={"max_concurrency": max_concurrency or self.max_concurrency},
+            return_exceptions=True,
+        )
+        timings["生成"] = time.perf_counter() - start
+
+        answer_by_question = dict(zip(unique_questions, unique_answers))
+        context_by_question = dict(zip(unique_questions, contexts))
+        return BatchRAGResult(
+            questions=questions,
+            answers=[answer_by_question[question] for question in questions],
+            contexts=[context_by_question[question] for question in questions],
+            timings=timings,
+            n_unique_questions=len(unique_questions),
+            n_unique_contexts=len(context_by_docs),
+        )
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+ベクトル化BM25インデックス
+
+rank_bm25.BM25Okapi はクエリのたびに全文書をPythonのループで採点します。
+このモジュールでは、インデックスを一度だけ構築し、以下の形で保持します。
+
+- 語彙（トークン → 語ID）
+- 転置インデックス（語ごとの文書ID・出現回数をCSR形式で格納）
+- 事前計算したIDFと文書長正規化項
+
+検索時はクエリ語のポスティングだけをNumPyで採点し、argpartitionで上位k件を選ぶため、
+クエリ語を1つも含まない文書はコストに影響しません。
+スコアは BM25Okapi と同じ式（負のIDFを epsilon * 平均IDF に置き換える）で計算します。
+
+使用例:
+    index = BM25Index.from_tokens([simple_tokenizer(doc) for doc in documents])
+    results = index.search(simple_tokenizer(query), k=3)  # [(文書番号, スコア), ...]
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def restrict_postings(
+    ids: np.ndarray,
+    tfs: np.ndarray,
+    mask: np.ndarray,
+    candidates: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    ポスティング（文書IDの昇順）を条件に合う文書だけに絞る
+
+    候補（mask が True の文書番号の昇順配列）がポスティングより少なければ、候補ごとに二分探索し、
+    計算量を候補数に比例させます。それ以外はポスティングごとに mask を引きます。
+    """
+    if candidates is not None and len(candidates) < len(ids):
+        positions = np.minimum(np.searchsorted(ids, candidates), len(ids) - 1)
+        positions = positions[ids[positions] == candidates]
+        return ids[positions], tfs[positions]
+    keep = mask[ids]
+    return ids[keep], tfs[keep]
+
+
+class BM25Index:
+    """一度だけ構築して使い回すBM25（Okapi）インデックス"""
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ):
+        """
+        Args:
+            vocabulary: トークンから語IDへの対応表
+            indptr: 語IDごとのポスティング開始位置（長さ = 語彙数 + 1）
+            doc_ids: ポスティングの文書ID（語ごとに昇順）
+            term_freqs: ポスティングの出現回数
+            doc_lengths: 各文書のトークン数
+        """
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self._prepare()
+
+    @classmethod
+    def from_tokens(
+        cls,
+        corpus_tokens: Iterable[Sequence[str]],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ) -> "BM25Index":
+        """トークン列のリストからインデックスを構築"""
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        term_freqs: List[int] = []
+        doc_lengths: List[int] = []
+
+        for doc_id, tokens in enumerate(corpus_tokens):
+            doc_lengths.append(len(tokens))
+            for token, freq in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        term_arr = np.asarray(term_ids, dtype=np.int64)
+        doc_arr = np.asarray(doc_ids, dtype=np.int32)
+        tf_arr = np.asarray(term_freqs, dtype=np.float32)
+
+        # 語ID → 文書IDの順に並べ替えてCSR（行 = 語）を作る
+        order = np.lexsort((doc_arr, term_arr))
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_arr, minlength=len(vocabulary)), out=indptr[1:])
+
+        return cls(
+            vocabulary,
+            indptr,
+            doc_arr[order],
+            tf_arr[order],
+            np.asarray(doc_lengths, dtype=np.float32),
+            k1=k1,
+            b=b,
+            epsilon=epsilon,
+        )
+
+    @classmethod
+    def from_token_ids(
+        cls,
+        corpus_ids: Sequence[np.ndarray],
+        vocabulary: Dict[str, int],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ) -> "BM25Index":
+        """
+        語ID化済みのコーパス（japanese_tokenizer.tokenize_batch の出力など）からインデックスを構築
+
+        (語ID, 文書ID) の組を整数1つにまとめてソートし、連続する区間の長さで数えるため、
+        文書ごとの Counter を使わずにポスティングをCSRの順で作れます。
+        """
+        n_docs = len(corpus_ids)
+        doc_lengths = np.fromiter(map(len, corpus_ids), dtype=np.int64, count=n_docs)
+        # キー（語ID × 文書数 + 文書ID）は1つの配列の上でその場で計算・ソートし、
+        # 数億トークンのコーパスでも一時配列の数を抑える
+        keys = np.concatenate(corpus_ids).astype(np.int64) if n_docs else np.empty(0, dtype=np.int64)
+        keys *= max(n_docs, 1)
+        keys += np.repeat(np.arange(n_docs, dtype=np.int32), doc_lengths)
+        keys.sort()
+        # 同じキーが続く区間の先頭 = ポスティング1件、区間の長さ = 出現回数
+        is_start = np.ones(len(keys), dtype=bool)
+        np.not_equal(keys[1:], keys[:-1], out=is_start[1:])
+        starts = np.flatnonzero(is_start)
+        counts = np.diff(np.append(starts, len(keys)))
+        term_arr, doc_arr = np.divmod(keys[starts], max(n_docs, 1))
+        del keys
+
+        # コーパスに出現しない語（共有の語彙に含まれる他の文書の語）は除き、語IDを詰め直す
+        # （平均IDFを from_tokens と同じ語の集合で計算するため）
+        doc_freqs = np.bincount(term_arr, minlength=len(vocabulary))
+        if (doc_freqs == 0).any():
+            remap = np.cumsum(doc_freqs > 0) - 1
+            term_arr = remap[term_arr]
+            vocabulary = {term: int(remap[i]) for term, i in vocabulary.items() if doc_freqs[i]}
+            doc_freqs = doc_freqs[doc_freqs > 0]
+
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=indptr[1:])
+
+        return cls(
+            dict(vocabulary),
+            indptr,
+            doc_arr.astype(np.int32),
+            counts.astype(np.float32),
+            doc_lengths.astype(np.float32),
+            k1=k1,
+            b=b,
+            epsilon=epsilon,
+        )
+
+    def _prepare(self):
+        """IDFと文書長の正規化項を事前計算"""
+        n_docs = len(self.doc_lengths)
+        doc_freqs = self._document_frequencies().astype(np.float64)
+
+        idf = np.log(n_docs - doc_freqs + 0.5) - np.log(doc_freqs + 0.5)
+        if len(idf):
+            # BM25Okapiと同様、負のIDFは平均IDFのepsilon倍に置き換える
+            idf[idf < 0] = self.epsilon * idf.mean()
+        self.idf = idf
+
+        avgdl = float(np.mean(self.doc_lengths)) if n_docs else 0.0
+        self.avgdl = avgdl
+        self.length_norm = self.k1 * (
+            1 - self.b + self.b * np.asarray(self.doc_lengths, dtype=np.float64) / (avgdl or 1.0)
+        )
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def _document_frequencies(self) -> np.ndarray:
+        """語IDごとの文書頻度を返す"""
+        return np.diff(self.indptr)
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """語IDのポスティング（文書ID, 出現回数）を返す"""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[start:end], self.term_freqs[start:end]
+
+    def _score_candidates(
+        self,
+        query_tokens: Sequence[str],
+        mask: Optional[np.ndarray] = None,
+        candidates: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """クエリ語を含む文書だけを採点し、(文書ID, スコア)を返す（mask があれば該当文書のみ）"""
+        ids_list = []
+        weights_list = []
+        for token, count in Counter(query_tokens).items():
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            ids, tfs = self._postings(term_id)
+            if mask is not None:
+                # 条件に合う文書のポスティングだけを残してから採点する
+                ids, tfs = restrict_postings(ids, tfs, mask, candidates)
+            tfs = tfs.astype(np.float64)
+            # クエリ内で同じ語が繰り返された場合はBM25Okapiと同じく回数分加算
+            weights = count * self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.length_norm[ids])
+            ids_list.append(ids)
+            weights_list.append(weights)
+
+        if not ids_list:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        all_ids = np.concatenate(ids_list)
+        candidates, inverse = np.unique(all_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights_list), minlength=len(candidates))
+        return self._drop_deleted(candidates.astype(np.int64), scores)
+
+    def _drop_deleted(self, candidates: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """削除済み文書を候補から除く（削除をサポートするサブクラス用）"""
+        return candidates, scores
+
+    def get_scores(self, query_tokens: Sequence[str]) -> np.ndarray:
+        """全文書のスコアを返す（BM25Okapi.get_scores互換）"""
+        scores = np.zeros(len(self), dtype=np.float64)
+        candidates, candidate_scores = self._score_candidates(query_tokens)
+        scores[candidates] = candidate_scores
+        return scores
+
+    def search(
+        self,
+        query_tokens: Sequence[str],
+        k: Optional[int] = 10,
+        mask: Optional[np.ndarray] = None,
+        candidates: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        上位k件を (文書番号, スコア) のリストで返す
+
+        クエリ語を1つも含まない文書は結果に含めません。
+        k=None の場合は該当文書をすべて返します。
+        mask（文書数の真偽値配列）を渡すと、True の文書だけを採点します
+        （IDFなどの統計は全文書のまま）。candidates に mask が True の文書番号（昇順）を
+        渡すと、絞り込みが厳しい場合に候補数に比例した計算量で照合します。
+        """
+        candidates, scores = self._score_candidates(query_tokens, mask, candidates)
+        if k is not None and len(candidates) > k:
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+
+        # スコアの降順（同点は文書番号の昇順）に並べる
+        order = np.lexsort((candidates, -scores))
+        return [(int(candidates[i]), float(scores[i])) for i in order]
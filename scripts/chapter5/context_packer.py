@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+トークン数の上限つきで検索結果から文脈を組み立てるコンテキストパッカー
+
+format_docs は検索したチャンクを全文そのまま連結します。chunk_overlap=160 で分割していると、
+同じファイルの隣り合うチャンクは最大160文字ずつ同じ文を繰り返し、k=8 のハイブリッド検索では
+プロンプトのトークンがかなり無駄になります。ContextPacker は次の順で文脈を組み立てます。
+
+1. 同じ出典（metadata["source"]）のチャンクを開始位置（metadata["start_index"]）で並べ、
+   重なる・接するチャンクを1つの範囲にまとめる（重なった部分は1回だけ残す）
+   スプリッターはチャンクの前後の空白を取り除くため、間が max_gap 文字以下なら接しているとみなし、
+   改行でつなぐ
+   開始位置のないチャンクは、本文が同じものだけをまとめる
+2. まとめた範囲を、含まれるチャンクの最も高いスコア（融合スコア、なければ検索順）の順に並べる
+3. tiktoken で数えたトークン数が max_tokens に収まるまで【出典N】のブロックを追加する
+   （収まらない最初のブロックは、残りが min_block_tokens 以上なら途中で切って追加する）
+
+【出典N】の番号は組み立て後の順に振り直すため、回答の出典表示はそのまま使えます。
+
+使用例:
+    packer = ContextPacker(max_tokens=2000)
+    context = packer.format(result.documents, result.scores)
+    print(packer.stats())
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+
+
+def default_format_block(number: int, doc: Document) -> str:
+    """【出典N】付きのブロック（format_docs と同じ形式）"""
+    return f"【出典{number}】{doc.metadata.get('source', 'unknown')}\n内容: {doc.page_content}"
+
+
+def get_encoding(model: str) -> "tiktoken.Encoding":
+    """モデルのエンコーディング（tiktoken が知らないモデルは GPT-4o/GPT-5 系の o200k_base）"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def merge_chunks(
+    docs: Sequence[Document], scores: Optional[Sequence[float]] = None, max_gap: int = 2
+) -> List[Tuple[Document, float]]:
+    """
+    同じ出典の重なる・接するチャンクをまとめ、スコアの高い順に (文書, スコア) を返す
+
+    Args:
+        docs: 検索結果のチャンク（スコアの高い順）
+        scores: 各チャンクのスコア（None なら検索順を -順位 のスコアとみなす）
+        max_gap: 接しているとみなすチャンクの間の文字数（取り除かれた空白の分）
+    """
+    if scores is None:
+        scores = [-float(i) for i in range(len(docs))]
+
+    # 出典ごとに、開始位置のあるチャンクとないチャンクを分ける
+    spans: Dict[str, List[Tuple[int, Document, float]]] = {}
+    merged: List[Tuple[Document, float]] = []
+    seen: Dict[Tuple[str, str], int] = {}
+    for doc, score in zip(docs, scores):
+        source = str(doc.metadata.get("source", ""))
+        start = doc.metadata.get("start_index")
+        if start is not None:
+            spans.setdefault(source, []).append((int(start), doc, float(score)))
+            continue
+        # 開始位置がなければ、本文が同じチャンクだけをまとめる
+        key = (source, doc.page_content)
+        if key in seen:
+            i = seen[key]
+            merged[i] = (merged[i][0], max(merged[i][1], float(score)))
+        else:
+            seen[key] = len(merged)
+            merged.append((doc, float(score)))
+
+    for items in spans.values():
+        items.sort(key=lambda item: item[0])
+        current_start, current_doc, current_score = items[0]
+        text = current_doc.page_content
+        current_end = current_start + len(text)  # 元の文書での終了位置
+        for start, doc, score in items[1:]:
+            end = start + len(doc.page_content)
+            if start <= current_end:
+                # 重なった部分を除いて後ろに続ける
+                text += doc.page_content[current_end - start:]
+            elif start - current_end <= max_gap:
+                # 空白を挟んで接している
+                text += "\n" + doc.page_content
+            else:
+                merged.append((_span_document(current_doc, current_start, text), current_score))
+                current_start, current_doc, current_score, text = start, doc, score, doc.page_content
+                current_end = end
+                continue
+            current_end = max(current_end, end)
+            current_score = max(current_score, score)
+        merged.append((_span_document(current_doc, current_start, text), current_score))
+
+    # 安定ソートのため、同じスコアは元の出現順のまま
+    merged.sort(key=lambda item: -item[1])
+    return merged
+
+
+def _span_document(first: Document, start: int, text: str) -> Document:
+    """まとめた範囲の文書（メタデータは先頭のチャンクのもの）"""
+    if text == first.page_content:
+        return first
+    metadata = dict(first.metadata)
+    metadata["start_index"] = start
+    return Document(page_content=text, metadata=metadata)
+
+
+class ContextPacker:
+    """重なるチャンクをまとめ、トークン数の上限まで出典付きのブロックを詰める"""
+
+    def __init__(
+        self,
+        max_tokens: int = 2000,
+        model: str = "gpt-5-nano",
+        format_block: Callable[[int, Document], str] = default_format_block,
+        separator: str = "\n\n",
+        min_block_tokens: int = 64,
+    ):
+        """
+        Args:
+            max_tokens: 文脈全体のトークン数の上限
+            model: トークン数を数えるモデル名
+            format_block: (出典番号, 文書) からブロックの文字列を作る関数
+            separator: ブロックの区切り
+            min_block_tokens: 収まらないブロックを途中で切って入れるときの最小トークン数
+        """
+        self.max_tokens = max_tokens
+        self.encoding = get_encoding(model)
+        self.format_block = format_block
+        self.separator = separator
+        self.min_block_tokens = min_block_tokens
+        self._separator_tokens = len(self.encoding.encode_ordinary(separator))
+        self.calls = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.chunks = 0
+        self.blocks = 0
+
+    def _count(self, texts: Sequence[str]) -> List[int]:
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(list(texts))]
+
+    def _total(self, counts: Sequence[int]) -> int:
+        return sum(counts) + self._separator_tokens * max(len(counts) - 1, 0)
+
+    def pack(self, docs: Sequence[Document], scores: Optional[Sequence[float]] = None) -> List[str]:
+        """検索結果から、上限に収まる【出典N】のブロックのリストを作る"""
+        blocks: List[str] = []
+        used = 0
+        merged = merge_chunks(docs, scores)
+        counts = self._count([self.format_block(i + 1, doc) for i, (doc, _) in enumerate(merged)])
+        for (doc, _), count in zip(merged, counts):
+            cost = count + (self._separator_tokens if blocks else 0)
+            if used + cost <= self.max_tokens:
+                blocks.append(self.format_block(len(blocks) + 1, doc))
+                used += cost
+                continue
+            # 収まらない最初のブロックは、残りが十分あれば本文を途中で切って入れる
+            remaining = self.max_tokens - used - (self._separator_tokens if blocks else 0)
+            if remaining >= self.min_block_tokens:
+                header_tokens = count - len(self.encoding.encode_ordinary(doc.page_content))
+                keep = remaining - header_tokens - 1
+                if keep > 0:
+                    content = self.encoding.decode(
+                        self.encoding.encode_ordinary(doc.page_content)[:keep]
+                    ).rstrip("�")
+                    truncated = Document(page_content=content + "…", metadata=doc.metadata)
+                    blocks.append(self.format_block(len(blocks) + 1, truncated))
+            break
+
+        self.calls += 1
+        self.chunks += len(docs)
+        self.blocks += len(blocks)
+        self.tokens_before += self._total(
+            self._count([self.format_block(i + 1, doc) for i, doc in enumerate(docs)])
+        )
+        self.tokens_after += self._total(self._count(blocks))
+        return blocks
+
+    def format(self, docs: Sequence[Document], scores: Optional[Sequence[float]] = None) -> str:
+        """検索結果を上限に収まる出典付きの文脈の文字列にする"""
+        return self.separator.join(self.pack(docs, scores))
+
+    def stats(self) -> str:
+        """これまでに組み立てた文脈のトークン数の削減量を表示用の文字列で返す"""
+        if not self.calls:
+            return "コンテキストパッカー: 未使用"
+        saved = 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0
+        return (
+            f"コンテキストパッカー: チャンク {self.chunks}件 → ブロック {self.blocks}件 / "
+            f"文脈 {self.tokens_before}トークン → {self.tokens_after}トークン（{saved:.0%}削減、"
+            f"上限 {self.max_tokens}トークン/回）"
+        )
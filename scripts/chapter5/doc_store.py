@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+オフセット表付きの列指向ドキュメントストア
+
+チャンク本文とメタデータ（JSON）をそれぞれ1つの連結バイナリファイルに追記し、
+各レコードの開始位置を uint64 のオフセット表で管理します。
+読み込み時はファイルをメモリマップするだけなので、文書数に関係なく一瞬で開けます。
+本文やメタデータは参照されたレコードだけを切り出してデコードします。
+
+ファイル構成:
+    texts.bin / texts.idx      本文（UTF-8）とオフセット表
+    metadata.bin / metadata.idx メタデータ（JSON, UTF-8）とオフセット表
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+OFFSET_DTYPE = np.uint64
+
+
+class _OffsetColumn:
+    """可変長バイト列を追記専用で保持する1列分のファイル"""
+
+    def __init__(self, data_path: Path, index_path: Path):
+        self.data_path = data_path
+        self.index_path = index_path
+        if not self.index_path.exists():
+            self.data_path.write_bytes(b"")
+            np.zeros(1, dtype=OFFSET_DTYPE).tofile(self.index_path)
+        self._map()
+
+    def _map(self):
+        """オフセット表と本体をメモリマップし直す"""
+        self.offsets = np.memmap(self.index_path, dtype=OFFSET_DTYPE, mode="r")
+        size = int(self.offsets[-1])
+        # 空ファイルはメモリマップできないため、空の配列で代用する
+        self.data = (
+            np.memmap(self.data_path, dtype=np.uint8, mode="r", shape=(size,))
+            if size
+            else np.empty(0, dtype=np.uint8)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def truncate(self, n_records: int):
+        """n_records 件より後ろのレコード（中断した追記の残り）を切り捨てる"""
+        if len(self) <= n_records:
+            return
+        size = int(self.offsets[n_records])
+        with open(self.index_path, "r+b") as f:
+            f.truncate((n_records + 1) * np.dtype(OFFSET_DTYPE).itemsize)
+        with open(self.data_path, "r+b") as f:
+            f.truncate(size)
+        self._map()
+
+    def append(self, records: Iterable[bytes]):
+        """レコードを末尾に追記"""
+        position = int(self.offsets[-1])
+        new_offsets = []
+        with open(self.data_path, "r+b") as f:
+            # 前回の追記が中断していても、オフセット表の末尾から書き直す
+            f.seek(position)
+            for record in records:
+                f.write(record)
+                position += len(record)
+                new_offsets.append(position)
+            f.truncate()
+        with open(self.index_path, "ab") as f:
+            np.asarray(new_offsets, dtype=OFFSET_DTYPE).tofile(f)
+        self._map()
+
+    def get(self, i: int) -> bytes:
+        """i番目のレコードを切り出す"""
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.data[start:end].tobytes()
+
+
+class OffsetDocStore:
+    """本文とメタデータを連番IDで引けるドキュメントストア"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._texts = _OffsetColumn(self.path / "texts.bin", self.path / "texts.idx")
+        self._metadata = _OffsetColumn(self.path / "metadata.bin", self.path / "metadata.idx")
+        self.truncate(len(self))
+
+    def __len__(self) -> int:
+        return min(len(self._texts), len(self._metadata))
+
+    def truncate(self, n_docs: int):
+        """n_docs 件より後ろの文書を切り捨てる（中断した追記で本文とメタデータの列がずれないようにする）"""
+        self._texts.truncate(n_docs)
+        self._metadata.truncate(n_docs)
+
+    def append(self, texts: List[str], metadatas: List[Dict[str, Any]]) -> range:
+        """文書を追記し、割り当てたIDの範囲を返す"""
+        start = len(self)
+        # 前回の追記が片方の列だけで中断していれば、その分を捨ててから追記する
+        self.truncate(start)
+        self._texts.append(text.encode("utf-8") for text in texts)
+        self._metadata.append(
+            json.dumps(metadata, ensure_ascii=False).encode("utf-8") for metadata in metadatas
+        )
+        return range(start, len(self))
+
+    def get_text(self, doc_id: int) -> str:
+        """本文だけを取得"""
+        return self._texts.get(doc_id).decode("utf-8")
+
+    def get_metadata(self, doc_id: int) -> Dict[str, Any]:
+        """メタデータだけを取得"""
+        return json.loads(self._metadata.get(doc_id))
+
+    def get(self, doc_id: int) -> Tuple[str, Dict[str, Any]]:
+        """本文とメタデータを取得"""
+        return self.get_text(doc_id), self.get_metadata(doc_id)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+ストリーミング・並列のドキュメント読み込みパイプライン
+
+各デモの読み込み関数は、全ファイルを1件ずつ順番に読み込んで Document のリストを作ってから
+分割・埋め込みに進みます。ファイル数が増えると、読み込みの待ち時間と全文書分のメモリが
+そのまま積み上がります。
+
+このモジュールでは次のように処理をつなぎます。
+
+1. ファイル名だけを列挙（os.scandir、ファイルは開かない）
+2. スレッド（またはプロセス）プールで読み込み・解析し、終わった順ではなくファイル順に yield
+   （同時に処理中のファイル数は max_in_flight 件まで）
+3. 一定件数ごとに分割・埋め込み・ベクトルストアへの書き込みを行う
+
+メモリに載るのは「処理中のファイル＋1バッチ分のチャンク」だけなので、
+数百万ファイルでもパイプラインの深さに比例したメモリで取り込めます。
+
+使用例:
+    documents = stream_documents(list_files(data_dir, "*.txt"), load_company_document)
+    stats = ingest_stream(documents, text_splitter, embeddings, vectorstore)
+"""
+
+import fnmatch
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import TextSplitter
+
+from embedding_pipeline import ingest_documents
+
+
+def list_files(data_dir: Path, pattern: str = "*.txt") -> List[Path]:
+    """パターンに一致するファイルを名前順に列挙する（中身は読まない）"""
+    with os.scandir(data_dir) as entries:
+        names = sorted(
+            entry.name for entry in entries
+            if entry.is_file() and fnmatch.fnmatch(entry.name, pattern)
+        )
+    data_dir = Path(data_dir)
+    return [data_dir / name for name in names]
+
+
+def read_text_document(file_path: Path) -> Document:
+    """テキストファイルを1件読み込み、source・id メタデータ付きの Document にする"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    return Document(
+        page_content=content,
+        metadata={"source": file_path.name, "id": file_path.stem},
+    )
+
+
+def parallel_map(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    max_workers: int = 8,
+    max_in_flight: int = 64,
+    use_processes: bool = False,
+) -> Iterator[Tuple[Any, Future]]:
+    """
+    func を並列に実行し、(入力, Future) を入力の順に yield する
+
+    同時に実行中・待機中にする件数を max_in_flight に抑えるため、
+    items がジェネレータなら入力もその分しか読み進めません。
+    """
+    executor: Executor = (
+        ProcessPoolExecutor(max_workers=max_workers)
+        if use_processes
+        else ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="loader")
+    )
+    with executor:
+        pending: deque = deque()
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            # 先頭が終わるのを待ってから次を投入し、処理中の件数を一定に保つ
+            if len(pending) >= max_in_flight:
+                item_done, future = pending.popleft()
+                wait([future])
+                yield item_done, future
+        while pending:
+            item_done, future = pending.popleft()
+            wait([future])
+            yield item_done, future
+
+
+def stream_documents(
+    paths: Iterable[Path],
+    load_file: Callable[[Path], Optional[Document]],
+    max_workers: int = 8,
+    max_in_flight: int = 64,
+    use_processes: bool = False,
+) -> Iterator[Document]:
+    """
+    ファイルを並列に読み込み、ファイル順に Document を yield する
+
+    Args:
+        paths: 読み込むファイル（ジェネレータでもよい）
+        load_file: 1ファイルを読み込む関数（None を返したファイルは飛ばす）
+        max_workers: 並列数
+        max_in_flight: 同時に読み込み中・待機中にするファイル数の上限
+        use_processes: True ならプロセスプールで解析する（load_file はモジュールの関数であること）
+    """
+    for path, future in parallel_map(load_file, paths, max_workers, max_in_flight, use_processes):
+        try:
+            doc = future.result()
+        except Exception as e:
+            print(f"エラー: {path}の読み込みに失敗: {e}")
+            continue
+        if doc is not None:
+            yield doc
+
+
+def batched(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """イテラブルを batch_size 件ずつのリストに区切る"""
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def split_stream(
+    documents: Iterable[Document],
+    text_splitter: TextSplitter,
+    batch_size: int = 256,
+) -> Iterator[List[Document]]:
+    """文書を batch_size 件ずつ分割し、チャンクのリストを順に yield する"""
+    for batch in batched(documents, batch_size):
+        yield text_splitter.split_documents(batch)
+
+
+def ingest_stream(
+    documents: Iterable[Document],
+    text_splitter: TextSplitter,
+    embeddings: Embeddings,
+    vectorstore: Any,
+    batch_size: int = 256,
+    on_chunks: Optional[Callable[[List[Document]], None]] = None,
+    **ingest_kwargs,
+) -> Dict[str, float]:
+    """
+    文書のストリームを batch_size 件ずつ分割・埋め込みし、ベクトルストアへ書き込む
+
+    Args:
+        on_chunks: 書き込んだチャンクを受け取るコールバック（BM25インデックスの構築などに使う）
+
+    Returns:
+        文書数・チャンク数・所要時間の統計
+    """
+    start = time.perf_counter()
+    n_documents = n_chunks = 0
+    for batch in batched(documents, batch_size):
+        chunks = text_splitter.split_documents(batch)
+        if chunks:
+            ingest_documents(chunks, embeddings, vectorstore, **ingest_kwargs)
+        if on_chunks is not None:
+            on_chunks(chunks)
+        n_documents += len(batch)
+        n_chunks += len(chunks)
+    return {
+        "documents": n_documents,
+        "chunks": n_chunks,
+        "seconds": time.perf_counter() - start,
+    }
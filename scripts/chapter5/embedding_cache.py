@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+内容アドレス方式の埋め込みキャッシュ
+
+Chroma.from_documents などは呼び出すたびに同じチャンクを埋め込み直します。
+CachedEmbeddings は OpenAIEmbeddings などの Embeddings をラップし、
+(モデル名・次元数の指定, チャンク本文のハッシュ) をキーに埋め込みベクトルをディスクへ保存します。
+一度計算したチャンクは、再実行や別スクリプトからでもAPIを呼ばずに取得できます。
+
+保存形式（モデルと dimensions の指定ごとのディレクトリ）:
+    vectors.f32  float32 のベクトルを行方向に連結した生データ
+    keys.bin     各行に対応する本文ハッシュ（16バイト/行）
+    meta.json    モデル名と次元数
+    lock         追記時のファイルロック（複数のプロセスが同じキャッシュに書き込むため）
+
+使用例:
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    vectorstore = Chroma.from_documents(splits, embeddings)
+"""
+
+import hashlib
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows ではファイルロックなし（同時に追記するプロセスは1つにする）
+    fcntl = None
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / ".cache" / "embeddings"
+KEY_SIZE = 16
+
+
+def text_key(text: str) -> bytes:
+    """チャンク本文のハッシュ（キャッシュキー）"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+class CachedEmbeddings(Embeddings):
+    """埋め込み結果をディスクにキャッシュする Embeddings ラッパー"""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        cache_dir: Path = DEFAULT_CACHE_DIR,
+        model_name: Optional[str] = None,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", type(underlying).__name__)
+        # 同じモデルでも dimensions を指定すると別のベクトルになるため、キーに含める
+        self.dimensions: Optional[int] = getattr(underlying, "dimensions", None)
+        cache_name = self.model_name
+        if self.dimensions is not None:
+            cache_name = f"{cache_name}@{self.dimensions}d"
+        safe_name = re.sub(r"[^A-Za-z0-9@._-]", "_", cache_name)
+        self.path = Path(cache_dir) / safe_name
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._n_rows = 0  # メモリマップ済みの行数
+        self._load()
+
+    def _load(self):
+        """キー一覧とベクトルファイルを読み込む（ベクトルはメモリマップ）"""
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists():
+            return
+        self._dim = json.loads(meta_path.read_text(encoding="utf-8"))["dim"]
+
+        keys = (self.path / "keys.bin").read_bytes()
+        vector_bytes = (self.path / "vectors.f32").stat().st_size
+        # 書き込みが途中で止まった行は無視する
+        n_rows = min(len(keys) // KEY_SIZE, vector_bytes // (4 * self._dim))
+        self._rows = {keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(n_rows)}
+        self._map(n_rows)
+
+    def _map(self, n_rows: int):
+        self._n_rows = n_rows
+        if n_rows:
+            self._vectors = np.memmap(
+                self.path / "vectors.f32", dtype=np.float32, mode="r", shape=(n_rows, self._dim)
+            )
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray):
+        """
+        新しいベクトルをファイル末尾に追記
+
+        5-3-1 や第7章のエージェントなど、複数のプロセスが同じキャッシュに追記するため、
+        ファイルロックを取ってからディスク上の行数を読み直し、他のプロセスが追記した行も取り込みます。
+        """
+        with open(self.path / "lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                meta_path = self.path / "meta.json"
+                if meta_path.exists():
+                    self._dim = json.loads(meta_path.read_text(encoding="utf-8"))["dim"]
+                else:
+                    self._dim = vectors.shape[1]
+                    meta_path.write_text(
+                        json.dumps({
+                            "model": self.model_name,
+                            "dimensions": self.dimensions,
+                            "dim": self._dim,
+                        }),
+                        encoding="utf-8",
+                    )
+                n_rows = self._sync_rows()
+
+                # 他のプロセスが同じ本文を先に追記していれば書かない
+                new = [(key, i) for i, key in enumerate(keys) if key not in self._rows]
+                if new:
+                    with open(self.path / "vectors.f32", "ab") as f:
+                        vectors[[i for _, i in new]].astype(np.float32).tofile(f)
+                    with open(self.path / "keys.bin", "ab") as f:
+                        f.write(b"".join(key for key, _ in new))
+                    for offset, (key, _) in enumerate(new):
+                        self._rows[key] = n_rows + offset
+                    n_rows += len(new)
+                self._map(n_rows)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sync_rows(self) -> int:
+        """
+        ロック中に呼ぶ: ディスク上の行数を読み直し、他のプロセスが追記した行を取り込む
+
+        書き込みが途中で止まった行（キーとベクトルの片方だけある行）は切り詰めます。
+        ロック中は他に書き込むプロセスがないため、ディスク上の完全な行は消しません。
+        """
+        vectors_path = self.path / "vectors.f32"
+        keys_path = self.path / "keys.bin"
+        vector_bytes = vectors_path.stat().st_size if vectors_path.exists() else 0
+        key_bytes = keys_path.stat().st_size if keys_path.exists() else 0
+        n_rows = min(key_bytes // KEY_SIZE, vector_bytes // (4 * self._dim))
+        if vector_bytes != n_rows * 4 * self._dim:
+            with open(vectors_path, "ab") as f:
+                f.truncate(n_rows * 4 * self._dim)
+        if key_bytes != n_rows * KEY_SIZE:
+            with open(keys_path, "ab") as f:
+                f.truncate(n_rows * KEY_SIZE)
+
+        known = self._n_rows
+        if n_rows > known:
+            with open(keys_path, "rb") as f:
+                f.seek(known * KEY_SIZE)
+                data = f.read((n_rows - known) * KEY_SIZE)
+            for i in range(n_rows - known):
+                self._rows.setdefault(data[i * KEY_SIZE:(i + 1) * KEY_SIZE], known + i)
+        return n_rows
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """テキストを埋め込み、(件数, 次元) の float32 配列で返す"""
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            # キャッシュにない本文だけを重複なしで集める
+            missing: Dict[bytes, str] = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+            self.hits += len(texts) - sum(1 for key in keys if key in missing)
+            self.misses += len(missing)
+
+        if missing:
+            # API呼び出し中はロックを持たない（他スレッドの埋め込みを妨げない）
+            new_vectors = np.asarray(
+                self.underlying.embed_documents(list(missing.values())), dtype=np.float32
+            )
+            with self._lock:
+                new_keys = [key for key in missing if key not in self._rows]
+                if new_keys:
+                    positions = {key: i for i, key in enumerate(missing)}
+                    self._append(new_keys, new_vectors[[positions[key] for key in new_keys]])
+
+        with self._lock:
+            if not keys:
+                return np.empty((0, self._dim or 0), dtype=np.float32)
+            return np.asarray(self._vectors[[self._rows[key] for key in keys]])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # OpenAIEmbeddings では embed_query と embed_documents が同じベクトルを返すため、
+        # クエリも同じキャッシュを共有する
+        return self.embed_array([text])[0].tolist()
+
+    def stats(self) -> str:
+        """キャッシュの利用状況を表示用の文字列で返す"""
+        return f"埋め込みキャッシュ: ヒット {self.hits}件 / 新規計算 {self.misses}件（保存済み {len(self._rows)}件）"
+
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+トークン数を考慮したバッチ・並列埋め込みの取り込みパイプライン
+
+Chroma.from_documents はチャンク全体を1本の embed_documents 呼び出しで順番に埋め込むため、
+チャンク数が増えるとAPIの往復回数がそのまま取り込み時間になります。
+このモジュールでは次の3段階で取り込みます。
+
+1. tiktoken でチャンクのトークン数を数え、1リクエストの上限近くまでバッチに詰める
+2. 複数のバッチを並列に送信する（リクエスト数・トークン数のレート制限付き）
+3. 埋め込みが終わったバッチから順にベクトルストアへ書き込む
+
+使用例:
+    vectorstore = build_chroma(splits, CachedEmbeddings(OpenAIEmbeddings()), "rag_pipeline")
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import tiktoken
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+# OpenAI Embeddings API の1リクエストあたりの上限
+PROVIDER_MAX_TOKENS_PER_REQUEST = 300_000
+# OpenAIEmbeddings は chunk_size（既定1000件）ごとにリクエストを分割するため、件数もそれに合わせる
+DEFAULT_MAX_INPUTS_PER_REQUEST = 1000
+# モデル名の分からない Embeddings のトークン数を数えるモデル（OpenAIEmbeddings の既定）
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+
+def embedding_model(embeddings: Embeddings) -> str:
+    """Embeddings のモデル名（CachedEmbeddings はラップしている Embeddings のモデル）"""
+    for candidate in (embeddings, getattr(embeddings, "underlying", None)):
+        model = getattr(candidate, "model", None)
+        if isinstance(model, str) and model:
+            return model
+    return DEFAULT_EMBEDDING_MODEL
+
+
+def count_tokens(texts: Sequence[str], model: str = DEFAULT_EMBEDDING_MODEL) -> List[int]:
+    """各テキストのトークン数を数える"""
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(list(texts))]
+
+
+def pack_batches(
+    token_counts: Sequence[int],
+    max_tokens: int = int(PROVIDER_MAX_TOKENS_PER_REQUEST * 0.9),
+    max_inputs: int = DEFAULT_MAX_INPUTS_PER_REQUEST,
+) -> Iterator[List[int]]:
+    """
+    トークン数の上限と件数の上限を超えないようにチャンク番号をバッチに詰める
+
+    上限を1件で超えるチャンクは単独のバッチにします（分割はEmbeddings側に任せる）。
+    """
+    batch: List[int] = []
+    batch_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_inputs):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+class RateLimiter:
+    """1分あたりのリクエスト数・トークン数を制限するトークンバケット"""
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_budget = float(requests_per_minute or 0)
+        self._token_budget = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._request_budget = min(
+                self.requests_per_minute, self._request_budget + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._token_budget = min(
+                self.tokens_per_minute, self._token_budget + elapsed * self.tokens_per_minute / 60
+            )
+
+    def acquire(self, tokens: int):
+        """リクエスト1回分の枠が空くまで待つ"""
+        # 1回で上限を超えるリクエストは、バケットが満タンになった時点で通す
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                wait_seconds = 0.0
+                if self.requests_per_minute and self._request_budget < 1:
+                    wait_seconds = (1 - self._request_budget) * 60 / self.requests_per_minute
+                if self.tokens_per_minute and self._token_budget < tokens:
+                    wait_seconds = max(
+                        wait_seconds, (tokens - self._token_budget) * 60 / self.tokens_per_minute
+                    )
+                if wait_seconds == 0:
+                    if self.requests_per_minute:
+                        self._request_budget -= 1
+                    if self.tokens_per_minute:
+                        self._token_budget -= tokens
+                    return
+            time.sleep(wait_seconds)
+
+
+def add_embeddings_to_store(
+    vectorstore: Any,
+    documents: Sequence[Document],
+    vectors: Sequence[Sequence[float]],
+    ids: Sequence[str],
+):
+    """埋め込み済みのチャンクをベクトルストアに書き込む（再埋め込みはしない）"""
+    texts = [doc.page_content for doc in documents]
+    metadatas = [doc.metadata for doc in documents]
+    if hasattr(vectorstore, "add_embeddings"):
+        # FAISS などは埋め込み済みベクトルの追加APIを持つ
+        vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=list(ids))
+    else:
+        # Chroma は内部のコレクションへ直接書き込む
+        vectorstore._collection.upsert(
+            ids=list(ids),
+            embeddings=[list(map(float, vector)) for vector in vectors],
+            documents=texts,
+            metadatas=[metadata or None for metadata in metadatas],
+        )
+
+
+def ingest_documents(
+    documents: Sequence[Document],
+    embeddings: Embeddings,
+    vectorstore: Any,
+    ids: Optional[Sequence[str]] = None,
+    max_tokens_per_request: int = int(PROVIDER_MAX_TOKENS_PER_REQUEST * 0.9),
+    max_inputs_per_request: int = DEFAULT_MAX_INPUTS_PER_REQUEST,
+    concurrency: int = 4,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+    model: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    チャンクをバッチ化・並列化して埋め込み、完了したバッチから順にベクトルストアへ追加
+
+    トークン数は model（None なら embeddings のモデル）のエンコーディングで数えます。
+
+    Returns:
+        取り込み件数・バッチ数・トークン数・所要時間などの統計
+    """
+    start = time.perf_counter()
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in documents]
+    token_counts = count_tokens([doc.page_content for doc in documents], model=model or embedding_model(embeddings))
+    batches = list(pack_batches(token_counts, max_tokens_per_request, max_inputs_per_request))
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def embed_batch(batch: List[int]) -> List[List[float]]:
+        limiter.acquire(sum(token_counts[i] for i in batch))
+        return embeddings.embed_documents([documents[i].page_content for i in batch])
+
+    # 送信中のバッチ数を制限し、メモリ使用量をパイプラインの深さで抑える
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        queue = iter(batches)
+        for batch in queue:
+            pending[executor.submit(embed_batch, batch)] = batch
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = pending.pop(future)
+                add_embeddings_to_store(
+                    vectorstore,
+                    [documents[i] for i in batch],
+                    future.result(),
+                    [ids[i] for i in batch],
+                )
+                next_batch = next(queue, None)
+                if next_batch is not None:
+                    pending[executor.submit(embed_batch, next_batch)] = next_batch
+
+    elapsed = time.perf_counter() - start
+    return {
+        "chunks": len(documents),
+        "batches": len(batches),
+        "tokens": sum(token_counts),
+        "seconds": elapsed,
+        "chunks_per_second": len(documents) / elapsed if elapsed else 0.0,
+    }
+
+
+def build_chroma(
+    documents: Iterable[Document],
+    embeddings: Embeddings,
+    collection_name: str,
+    batch_size: int = 256,
+    **ingest_kwargs,
+) -> Chroma:
+    """
+    Chroma.from_documents の代わりにパイプラインでコレクションを構築
+
+    documents はジェネレータでもよく、batch_size 件ずつ取り出して取り込みます（全件をリストにしない）。
+    """
+    vectorstore = Chroma(collection_name=collection_name, embedding_function=embeddings)
+    stats = {"chunks": 0, "batches": 0, "tokens": 0, "seconds": 0.0}
+    iterator = iter(documents)
+    for batch in iter(lambda: list(islice(iterator, batch_size)), []):
+        for key, value in ingest_documents(batch, embeddings, vectorstore, **ingest_kwargs).items():
+            if key in stats:
+                stats[key] += value
+    print(
+        f"  - 埋め込み取り込み: {stats['chunks']}チャンク / {stats['batches']}バッチ / "
+        f"{stats['tokens']}トークン（{stats['seconds']:.2f}秒）"
+    )
+    return vectorstore
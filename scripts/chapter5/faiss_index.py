@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+"""
+FAISSのインデックス種別の選択と、目標recallに合わせた検索パラメータの自動調整
+
+FAISS.from_documents は常に IndexFlatL2（全件の厳密探索）を作ります。
+このモジュールでは index factory 文字列でインデックスの種類を選べるようにし、
+近似インデックスの検索パラメータ（IVFの nprobe・HNSWの efSearch）を
+厳密検索の結果（正解）と比べながら調整します。
+
+代表的な factory 文字列:
+    "Flat"            全件の厳密探索（FAISS.from_documents と同じ）
+    "IVF1024,Flat"    クラスタに分けて nprobe 個のクラスタだけを探索
+    "HNSW32"          グラフ探索（efSearch が大きいほど高精度・低速）
+    "IVF1024,PQ64"    IVF ＋ 直積量子化で圧縮（省メモリ・精度は若干低下）
+
+save_local / load_local の代わりに save_mmap / load_mmap を使うと、pickle を使わずに保存でき、
+読み込み時はインデックスと文書をメモリマップで開くだけになります（文書数に関係なく一瞬で開け、
+複数のプロセスが同じインデックスをページキャッシュ上で共有できます）。
+
+使用例:
+    vectorstore = faiss_from_documents(splits, embeddings, factory="HNSW32")
+    best, rows = tune_search_params(vectorstore.index, vectors, queries, k=10, target_recall=0.95)
+
+    save_mmap(vectorstore, "faiss_index")
+    vectorstore = load_mmap("faiss_index", embeddings)
+
+    results = max_marginal_relevance_search_batch(vectorstore, query_vectors, k=3, fetch_k=100)
+"""
+
+import json
+import os
+import shutil
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from doc_store import OffsetDocStore, _OffsetColumn
+from vector_store import ArrayLike, mmr_rerank
+
+MMAP_FORMAT_VERSION = 1
+
+
+def suggest_factories(n_vectors: int, dim: int) -> List[str]:
+    """文書数と次元数から、比較用の factory 文字列の候補を作る"""
+    # IVF のクラスタ数は √N の4倍程度、各クラスタに39件以上の学習データが入るよう上限を設ける
+    nlist = int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+    # PQ のサブベクトル数は次元数を割り切れるもの（1サブベクトル8〜24次元程度）
+    m = next((m for m in (64, 48, 32, 16, 8, 4, 2) if dim % m == 0 and dim // m >= 8), 1)
+    return ["Flat", f"IVF{nlist},Flat", "HNSW32", f"IVF{nlist},PQ{m}"]
+
+
+def build_index(
+    vectors: np.ndarray,
+    factory: str = "Flat",
+    metric: int = faiss.METRIC_L2,
+    add: bool = True,
+) -> faiss.Index:
+    """
+    factory 文字列からインデックスを作り、学習と追加まで行う
+
+    Raises:
+        RuntimeError: 学習に必要な件数（IVFのクラスタ数・PQのコード数）に満たない場合
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], factory, metric)
+    if not index.is_trained:
+        index.train(vectors)
+    try:
+        # IVF は reconstruct（MMR検索で使用）のために ID→位置の対応表を持たせる
+        faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Array)
+    except RuntimeError:
+        pass
+    if add:
+        index.add(vectors)
+    return index
+
+
+def faiss_from_documents(
+    documents: Sequence[Document],
+    embeddings: Embeddings,
+    factory: str = "Flat",
+) -> FAISS:
+    """FAISS.from_documents の代わりに、指定した種類のインデックスで FAISS ベクトルストアを作る"""
+    vectors = np.asarray(
+        embeddings.embed_documents([doc.page_content for doc in documents]), dtype=np.float32
+    )
+    try:
+        index = build_index(vectors, factory, add=False)
+    except RuntimeError as e:
+        # 文書が少なすぎて IVF・PQ の学習ができない場合は厳密探索にする
+        print(f"  - '{factory}' を学習できないため Flat を使用します（{str(e).split('Error: ')[-1].splitlines()[0]}）")
+        factory = "Flat"
+        index = build_index(vectors, factory, add=False)
+
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    vectorstore.add_embeddings(
+        list(zip([doc.page_content for doc in documents], vectors.tolist())),
+        metadatas=[doc.metadata for doc in documents],
+    )
+    print(f"  - インデックス: {factory}（{index_memory_bytes(index) / 1024:.1f}KB）")
+    return vectorstore
+
+
+def search_param_name(index: faiss.Index) -> Optional[str]:
+    """調整対象の検索パラメータ名（IVF: nprobe, HNSW: efSearch, それ以外: None）"""
+    try:
+        faiss.extract_index_ivf(index)
+        return "nprobe"
+    except RuntimeError:
+        pass
+    if isinstance(faiss.downcast_index(index), faiss.IndexHNSW):
+        return "efSearch"
+    return None
+
+
+def search_param_values(index: faiss.Index) -> List[int]:
+    """検索パラメータの候補（コストの小さい順）"""
+    name = search_param_name(index)
+    if name == "nprobe":
+        nlist = faiss.extract_index_ivf(index).nlist
+        return [v for v in (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024) if v < nlist] + [nlist]
+    if name == "efSearch":
+        return [16, 32, 64, 128, 256, 512, 1024]
+    return []
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """インデックスのサイズ（シリアライズ後のバイト数）"""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def recall_at_k(found: np.ndarray, ground_truth: np.ndarray) -> float:
+    """正解の上位k件のうち、見つかった件数の割合（クエリ平均）"""
+    k = ground_truth.shape[1]
+    hits = sum(len(set(row[:k]) & set(truth)) for row, truth in zip(found, ground_truth))
+    return hits / ground_truth.size
+
+
+def tune_search_params(
+    index: faiss.Index,
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    target_recall: float = 0.95,
+    values: Optional[Sequence[int]] = None,
+    metric: int = faiss.METRIC_L2,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    検索パラメータを小さい順に試し、目標の recall@k に届く最も低コストな設定を選ぶ
+
+    Args:
+        index: 調整するインデックス（学習・追加済み）
+        vectors: インデックスに追加した元のベクトル（正解の計算用）
+        queries: 評価用のクエリベクトル
+        k: recall を計算する上位件数
+        target_recall: 目標の recall@k
+        values: 試すパラメータ値（省略時はインデックスの種類から決める）
+
+    Returns:
+        (選んだ設定, 全設定の結果)  各設定は {"param", "value", "recall", "qps", "memory_bytes"}
+        目標に届かない場合は recall が最も高い設定を返す
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    _, ground_truth = faiss.knn(queries, vectors, k, metric=metric)
+
+    name = search_param_name(index)
+    values = list(values) if values is not None else search_param_values(index)
+    parameter_space = faiss.ParameterSpace()
+    memory_bytes = index_memory_bytes(index)
+
+    rows: List[Dict[str, Any]] = []
+    for value in values or [None]:
+        if name is not None:
+            parameter_space.set_index_parameter(index, name, value)
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "param": name,
+            "value": value,
+            "recall": recall_at_k(found, ground_truth),
+            "qps": len(queries) / elapsed if elapsed else float("inf"),
+            "memory_bytes": memory_bytes,
+        })
+
+    reached = [row for row in rows if row["recall"] >= target_recall]
+    best = reached[0] if reached else max(rows, key=lambda row: row["recall"])
+    if name is not None:
+        parameter_space.set_index_parameter(index, name, best["value"])
+    return best, rows
+
+
+def candidate_vectors(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    """
+    検索結果の位置（クエリ数, 候補数）のベクトルを（クエリ数, 候補数, 次元）の配列で取り出す
+
+    Flat インデックスはベクトル本体（メモリマップを含む）をそのまま配列として参照し、
+    それ以外は reconstruct_batch の1回の呼び出しで復元します。位置が -1 の候補は0ベクトルになります。
+    """
+    flat_ids = ids.reshape(-1)
+    valid = flat_ids >= 0
+    vectors = np.zeros((len(flat_ids), index.d), dtype=np.float32)
+    if isinstance(index, faiss.IndexFlat):
+        stored = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+        vectors[valid] = stored[flat_ids[valid]]
+    elif valid.any():
+        vectors[valid] = index.reconstruct_batch(flat_ids[valid])
+    return vectors.reshape(*ids.shape, index.d)
+
+
+def max_marginal_relevance_search_batch(
+    vectorstore: FAISS,
+    query_vectors: ArrayLike,
+    k: int = 4,
+    fetch_k: int = 20,
+    lambda_mult: float = 0.5,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    複数クエリの MMR 検索（FAISS.max_marginal_relevance_search_with_score_by_vector と同じ結果）
+
+    候補の検索は全クエリで1回、候補ベクトルの取り出しも1回にまとめ、
+    MMR は候補どうしの類似度行列を1回だけ計算して選びます（vector_store.mmr_rerank）。
+
+    Returns:
+        クエリごとの (Document, 距離スコア) のリスト（MMR で選んだ順）
+    """
+    queries = np.array(query_vectors, dtype=np.float32, ndmin=2)
+    distances, ids = vectorstore.index.search(queries, fetch_k)
+    valid = ids != -1
+    picked = mmr_rerank(queries, candidate_vectors(vectorstore.index, ids), k, lambda_mult, valid)
+
+    results: List[List[Tuple[Document, float]]] = []
+    for row, selection in enumerate(picked):
+        docs_and_scores = []
+        for position in selection[selection >= 0]:
+            doc_id = vectorstore.index_to_docstore_id[int(ids[row, position])]
+            doc = vectorstore.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"文書が見つかりません: {doc_id}")
+            docs_and_scores.append((doc, float(distances[row, position])))
+        results.append(docs_and_scores)
+    return results
+
+
+class OffsetDocstore(Docstore):
+    """
+    OffsetDocStore を LangChain の Docstore として使う読み取り専用のアダプタ
+
+    FAISS 上の位置（の文字列）をIDとして、参照された文書だけを切り出して返します。
+    元の文書IDは Document.id に入れて返します。
+    """
+
+    def __init__(self, path: Path):
+        self.store = OffsetDocStore(path)
+        self._ids = _OffsetColumn(Path(path) / "ids.bin", Path(path) / "ids.idx")
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def search(self, search: str) -> Union[str, Document]:
+        position = int(search) if str(search).isdigit() else -1
+        if not 0 <= position < len(self.store):
+            return f"ID {search} not found."
+        text, metadata = self.store.get(position)
+        return Document(id=self._ids.get(position).decode("utf-8"), page_content=text, metadata=metadata)
+
+
+class _PositionIds(Mapping):
+    """FAISS 上の位置 i を Docstore のID str(i) に対応付ける（辞書を作らない）"""
+
+    def __init__(self, n: int):
+        self.n = n
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < self.n:
+            raise KeyError(i)
+        return str(i)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.n))
+
+
+def _is_ivf(index: faiss.Index) -> bool:
+    try:
+        faiss.extract_index_ivf(index)
+        return True
+    except RuntimeError:
+        return False
+
+
+def save_mmap(vectorstore: FAISS, path: Union[str, Path], batch_size: int = 10000):
+    """
+    FAISS ベクトルストアを、メモリマップで開ける形式（pickle なし）で保存する
+
+    ファイル構成:
+        index.faiss   faiss.write_index の出力
+        docs/         FAISS 上の位置の順に並べた本文・メタデータ・元の文書ID（OffsetDocStore）
+        meta.json     形式のバージョン・件数・距離の種類
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    tmp_path.mkdir(parents=True)
+
+    index = vectorstore.index
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+    docstore = OffsetDocstore(tmp_path / "docs")
+    for start in range(0, index.ntotal, batch_size):
+        ids = [vectorstore.index_to_docstore_id[i] for i in range(start, min(start + batch_size, index.ntotal))]
+        docs = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+        docstore.store.append([doc.page_content for doc in docs], [doc.metadata for doc in docs])
+        docstore._ids.append(str(doc_id).encode("utf-8") for doc_id in ids)
+
+    (tmp_path / "meta.json").write_text(
+        json.dumps({
+            "format": MMAP_FORMAT_VERSION,
+            "ntotal": index.ntotal,
+            "ivf": _is_ivf(index),
+            "distance_strategy": vectorstore.distance_strategy.value,
+            "normalize_L2": vectorstore._normalize_L2,
+        }),
+        encoding="utf-8",
+    )
+    # 書き込みが終わってから置き換える（途中で止まっても古いインデックスが残る）
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def load_mmap(path: Union[str, Path], embeddings: Embeddings) -> FAISS:
+    """save_mmap() で保存したインデックスを、読み込まずにメモリマップで開く（読み取り専用）"""
+    path = Path(path)
+    meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+    if meta["format"] != MMAP_FORMAT_VERSION:
+        raise ValueError(f"対応していない形式です: {meta['format']}")
+
+    # IVF は転置リストを、それ以外（Flat・HNSW など）はベクトル本体をゼロコピーでマップする
+    flags = faiss.IO_FLAG_MMAP if meta["ivf"] else faiss.IO_FLAG_MMAP_IFC
+    index = faiss.read_index(str(path / "index.faiss"), flags | faiss.IO_FLAG_READ_ONLY)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=OffsetDocstore(path / "docs"),
+        index_to_docstore_id=_PositionIds(index.ntotal),
+        normalize_L2=meta["normalize_L2"],
+        distance_strategy=DistanceStrategy(meta["distance_strategy"]),
+    )
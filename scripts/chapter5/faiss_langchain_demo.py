@@ -6,18 +6,21 @@ FAISSを使用したRAGデモ（LangChainラッパ使用）
 LangChainのFAISSラッパを使用したベクトル検索の実装例
 """
 
+import argparse
 import os
 import sys
 from pathlib import Path
 from typing import List
 
+import numpy as np
+
 # LangChain関連のインポート
-from langchain_community.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from offset_splitter import OffsetTextSplitter
+
 
 def create_technical_documents() -> List[Document]:
     """技術文書のサンプルを作成"""
@@ -63,8 +66,15 @@ def create_technical_documents() -> List[Document]:
     ]
 
 
-def demonstrate_faiss_operations():
-    """FAISSの基本操作のデモンストレーション"""
+def demonstrate_faiss_operations(index_factory: str = "Flat"):
+    """
+    FAISSの基本操作のデモンストレーション
+
+    Args:
+        index_factory: FAISSの index factory 文字列（"Flat", "IVF1024,Flat", "HNSW32", "IVF1024,PQ64" など）
+    """
+    # faiss は任意の依存のため、main() でインストールを確認してから読み込む
+    from faiss_index import faiss_from_documents, load_mmap, save_mmap
 
     print("=== FAISSベクトルストアのデモ ===\n")
 
@@ -73,7 +83,8 @@ def demonstrate_faiss_operations():
     print(f"サンプル文書を{len(documents)}件作成しました。")
 
     # テキストの分割
-    text_splitter = RecursiveCharacterTextSplitter(
+    # RecursiveCharacterTextSplitter と同じ境界を、文字位置だけで求めるスプリッター
+    text_splitter = OffsetTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         separators=["\n\n", "\n", "。", "、", " ", ""]
@@ -84,27 +95,22 @@ def demonstrate_faiss_operations():
     embeddings = OpenAIEmbeddings()
 
     # FAISSベクトルストアの作成
-    print("\n1. FAISSベクトルストアを作成中...")
-    vectorstore = FAISS.from_documents(
-        documents=splits,
-        embedding=embeddings
-    )
+    # index_factory で近似インデックス（IVF・HNSW・PQ）も選べる
+    print(f"\n1. FAISSベクトルストアを作成中（{index_factory}）...")
+    vectorstore = faiss_from_documents(splits, embeddings, factory=index_factory)
     print(f"   → {len(splits)}個のドキュメントをインデックスに追加しました。")
 
     # インデックスの保存
     index_path = "faiss_index"
+    # save_local / load_local（pickle）の代わりに、メモリマップで開ける形式で保存する
     print(f"\n2. インデックスを '{index_path}' に保存中...")
-    vectorstore.save_local(index_path)
+    save_mmap(vectorstore, index_path)
     print(f"   → インデックスを保存しました。")
 
-    # インデックスの読み込み
+    # インデックスの読み込み（pickle を使わないため allow_dangerous_deserialization は不要）
     print(f"\n3. 保存したインデックスを読み込み中...")
-    loaded_vectorstore = FAISS.load_local(
-        index_path,
-        embeddings,
-        allow_dangerous_deserialization=True  # 信頼できるソースからのデータのみ許可
-    )
-    print(f"   → インデックスを読み込みました。")
+    loaded_vectorstore = load_mmap(index_path, embeddings)
+    print(f"   → インデックスをメモリマップで開きました（文書は検索結果に必要な分だけ読み込み）。")
 
     # 類似検索のデモ
     queries = [
@@ -147,13 +153,17 @@ def demonstrate_faiss_operations():
     print(f"   質問: {query}")
     print("   " + "-" * 50)
 
-    mmr_results = loaded_vectorstore.max_marginal_relevance_search(
-        query,
+    # 候補10件の検索・ベクトルの取り出し・類似度行列の計算をまとめて行うMMR（結果は max_marginal_relevance_search と同じ）
+    from faiss_index import max_marginal_relevance_search_batch
+
+    mmr_results = max_marginal_relevance_search_batch(
+        loaded_vectorstore,
+        [embeddings.embed_query(query)],
         k=3,
         fetch_k=10  # 初期候補として10件取得
-    )
+    )[0]
 
-    for i, doc in enumerate(mmr_results):
+    for i, (doc, _) in enumerate(mmr_results):
         source = doc.metadata.get('source', 'unknown')
         content = doc.page_content[:100] + "..."
         print(f"   【結果{i+1}】{source}")
@@ -166,11 +176,105 @@ def demonstrate_faiss_operations():
         print(f"\n→ インデックスファイルを削除しました。")
 
 
-def main():
+def demonstrate_index_tuning(
+    n_vectors: int = 10000,
+    dim: int = 128,
+    k: int = 10,
+    target_recall: float = 0.95,
+):
+    """
+    インデックスの種類ごとに検索パラメータを調整し、QPS・recall・メモリを比較する
+
+    APIを使わずに試せるよう、クラスタ構造を持つ疑似的なベクトルを使います。
+    """
+    from faiss_index import build_index, suggest_factories, tune_search_params
+
+    print(f"=== インデックス種別と検索パラメータの調整（{n_vectors}件・{dim}次元）===\n")
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(n_vectors // 100, 1), dim)) * 3
+    vectors = centers[rng.integers(0, len(centers), n_vectors)] + rng.standard_normal((n_vectors, dim))
+    queries = centers[rng.integers(0, len(centers), 200)] + rng.standard_normal((200, dim))
+    vectors, queries = vectors.astype(np.float32), queries.astype(np.float32)
+
+    for factory in suggest_factories(n_vectors, dim):
+        index = build_index(vectors, factory)
+        best, rows = tune_search_params(index, vectors, queries, k=k, target_recall=target_recall)
+        print(f"【{factory}】")
+        for row in rows:
+            setting = f"{row['param']}={row['value']}" if row["param"] else "（パラメータなし）"
+            print(
+                f"   {setting:<16} recall@{k}: {row['recall']:.3f}  "
+                f"QPS: {row['qps']:>9.0f}  メモリ: {row['memory_bytes'] / 1024 / 1024:.1f}MB"
+            )
+        status = "目標を達成" if best["recall"] >= target_recall else "目標に未達（最大recallの設定）"
+        setting = f"{best['param']}={best['value']}" if best["param"] else "（パラメータなし）"
+        print(f"   → 選択: {setting}（{status}）\n")
+
+
+def demonstrate_mmr_batch(
+    n_vectors: int = 20000,
+    dim: int = 128,
+    n_queries: int = 64,
+    k: int = 10,
+    fetch_k: int = 200,
+):
+    """
+    FAISS.max_marginal_relevance_search（1クエリずつ・Pythonのループ）とバッチMMRの速度を比較する
+
+    APIを使わずに試せるよう、疑似的なベクトルを使います。
+    """
+    import time
+
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import FakeEmbeddings
+
+    from faiss_index import build_index, max_marginal_relevance_search_batch
+
+    print(f"=== MMR検索の比較（{n_vectors}件・{dim}次元・{n_queries}クエリ・k={k}・fetch_k={fetch_k}）===\n")
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(n_vectors // 100, 1), dim)) * 3
+    vectors = centers[rng.integers(0, len(centers), n_vectors)] + rng.standard_normal((n_vectors, dim))
+    queries = centers[rng.integers(0, len(centers), n_queries)] + rng.standard_normal((n_queries, dim))
+    vectors, queries = vectors.astype(np.float32), queries.astype(np.float32)
+
+    vectorstore = FAISS(
+        embedding_function=FakeEmbeddings(size=dim),  # 検索はベクトルで行うため使われない
+        index=build_index(vectors, "Flat"),
+        docstore=InMemoryDocstore({str(i): Document(page_content=f"doc-{i}") for i in range(n_vectors)}),
+        index_to_docstore_id={i: str(i) for i in range(n_vectors)},
+    )
+
+    start = time.perf_counter()
+    expected = [
+        vectorstore.max_marginal_relevance_search_with_score_by_vector(query.tolist(), k=k, fetch_k=fetch_k)
+        for query in queries
+    ]
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = max_marginal_relevance_search_batch(vectorstore, queries, k=k, fetch_k=fetch_k)
+    batch_seconds = time.perf_counter() - start
+
+    matched = sum(
+        [doc.page_content for doc, _ in a] == [doc.page_content for doc, _ in e]
+        for a, e in zip(actual, expected)
+    )
+    print(f"   max_marginal_relevance_search : {loop_seconds * 1000 / n_queries:8.2f}ms/クエリ")
+    print(f"   バッチMMR                      : {batch_seconds * 1000 / n_queries:8.2f}ms/クエリ")
+    print(f"   → 選ばれた文書が一致したクエリ: {matched}/{n_queries}")
+
+
+def main(
+    index_factory: str = "Flat",
+    tune: bool = False,
+    target_recall: float = 0.95,
+    mmr_benchmark: bool = False,
+):
     """メインの実行関数"""
 
-    # OpenAI APIキーの確認
-    if not os.getenv("OPENAI_API_KEY"):
+    # OpenAI APIキーの確認（疑似ベクトルでの調整・比較だけなら不要）
+    if not (tune or mmr_benchmark) and not os.getenv("OPENAI_API_KEY"):
         print("エラー: OPENAI_API_KEY環境変数が設定されていません")
         sys.exit(1)
 
@@ -186,8 +290,37 @@ def main():
         sys.exit(1)
 
     # デモの実行
-    demonstrate_faiss_operations()
+    if tune:
+        demonstrate_index_tuning(target_recall=target_recall)
+    elif mmr_benchmark:
+        demonstrate_mmr_batch()
+    else:
+        demonstrate_faiss_operations(index_factory)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="FAISSを使用したRAGデモ")
+    parser.add_argument(
+        "--index-factory",
+        default="Flat",
+        help="FAISSの index factory 文字列（例: Flat, IVF1024,Flat, HNSW32, IVF1024,PQ64）",
+    )
+    parser.add_argument(
+        "--tune",
+        action="store_true",
+        help="疑似ベクトルでインデックス種別ごとの検索パラメータを調整して比較する（APIキー不要）",
+    )
+    parser.add_argument("--target-recall", type=float, default=0.95, help="調整時の目標 recall@k")
+    parser.add_argument(
+        "--mmr-benchmark",
+        action="store_true",
+        help="疑似ベクトルで1クエリずつのMMRとバッチMMRの速度を比較する（APIキー不要）",
+    )
+    args = parser.parse_args()
+
+    main(
+        args.index_factory,
+        tune=args.tune,
+        target_recall=args.target_recall,
+        mmr_benchmark=args.mmr_benchmark,
+    )
\ No newline at end of file
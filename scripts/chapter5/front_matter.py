@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+YAMLフロントマターの高速な解析と、ファイルハッシュをキーにした解析結果のキャッシュ
+
+社内規定文書の先頭には次のようなフロントマターが付いています。
+
+    ---
+    document_type: "勤怠規定"
+    chapter: "第3章"
+    ---
+
+yaml.safe_load は純Pythonの SafeLoader を使うため、文書数が多いと取り込み時間の無視できない割合を占めます。
+このモジュールでは次の順に解析します。
+
+1. キャッシュ: ファイル内容の SHA-256（差分インデックスのマニフェストと同じハッシュ）が同じなら解析しない
+2. 高速パス: 「key: value」だけの平坦なヘッダーは、YAMLと同じ型になる値に限って正規表現で解析
+3. それ以外: libyaml の CSafeLoader（なければ SafeLoader）で解析
+
+使用例:
+    cache = FrontMatterCache(FRONT_MATTER_CACHE_PATH)
+    metadata, body, sha256 = read_front_matter_file(path, cache)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import yaml
+
+# libyaml が使える環境では C 実装のローダーを使う
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# 高速パスで扱う行: 英数字のキー、コロン、値
+_FLAT_LINE = re.compile(r"([A-Za-z_][A-Za-z0-9_-]*):(?: +(.*?))? *")
+# 引用符で囲まれた値（エスケープや内側の引用符を含まないもの）
+_DOUBLE_QUOTED = re.compile(r'"([^"\\]*)"')
+_SINGLE_QUOTED = re.compile(r"'([^']*)'")
+# YAMLの10進整数（0始まりは8進数として解釈されるため除外）
+_DECIMAL_INT = re.compile(r"[-+]?(?:0|[1-9][0-9]*)")
+# 引用符なしの値の先頭に来ると特別な意味を持つ文字
+_INDICATORS = set("-?:,[]{}#&*!|>'\"%@`")
+_STR_TAG = "tag:yaml.org,2002:str"
+_INT_TAG = "tag:yaml.org,2002:int"
+_resolver = yaml.resolver.Resolver()
+
+
+def _parse_plain_value(value: str) -> Tuple[bool, Any]:
+    """高速パスで扱える値なら (True, 値) を、YAMLに任せるべき値なら (False, None) を返す"""
+    match = _DOUBLE_QUOTED.fullmatch(value) or _SINGLE_QUOTED.fullmatch(value)
+    if match:
+        return True, match.group(1)
+    if not value or value[0] in _INDICATORS or value.endswith(":") or ": " in value or " #" in value:
+        return False, None
+    # 引用符なしの値は、YAMLが文字列・整数と解釈するものだけを扱う（真偽値・日付などはYAMLへ）
+    tag = _resolver.resolve(yaml.ScalarNode, value, (True, False))
+    if tag == _STR_TAG:
+        return True, value
+    if tag == _INT_TAG and _DECIMAL_INT.fullmatch(value):
+        return True, int(value)
+    return False, None
+
+
+def parse_header(header: str) -> Dict[str, Any]:
+    """フロントマターの中身（--- の間）を辞書にする"""
+    # タブはYAMLでは位置によってエラーになるため、高速パスでは扱わない
+    if "\t" not in header:
+        metadata: Dict[str, Any] = {}
+        for line in header.split("\n"):
+            if not line.strip():
+                continue
+            match = _FLAT_LINE.fullmatch(line)
+            if not match:
+                break
+            # キーも YAML が文字列以外（on・yes・null など）と解釈するものは YAML に任せる
+            if _resolver.resolve(yaml.ScalarNode, match.group(1), (True, False)) != _STR_TAG:
+                break
+            ok, value = _parse_plain_value(match.group(2) or "")
+            if not ok:
+                break
+            metadata[match.group(1)] = value
+        else:
+            return metadata
+    # 入れ子・複数行・特殊な値を含むヘッダーはYAMLで解析する
+    return yaml.load(header, Loader=YAML_LOADER) or {}
+
+
+def split_front_matter(content: str) -> Tuple[Optional[str], str]:
+    """フロントマターを解析せずに (ヘッダー, 本文) に切り分ける（フロントマターがなければヘッダーは None）"""
+    if content.startswith("---"):
+        parts = content.split("---", 2)
+        return parts[1], parts[2].strip()
+    return None, content.strip()
+
+
+def parse_front_matter(content: str) -> Tuple[Dict[str, Any], str]:
+    """
+    本文の先頭のフロントマターを解析し、(メタデータ, 本文) を返す
+
+    フロントマターがなければメタデータは空の辞書になります。
+    """
+    header, body = split_front_matter(content)
+    return (parse_header(header) if header is not None else {}), body
+
+
+class FrontMatterCache:
+    """ファイル内容の SHA-256 をキーにしたフロントマター解析結果のキャッシュ（JSON）"""
+
+    def __init__(self, path: Optional[Path]):
+        """
+        Args:
+            path: 保存先のファイル（None ならメモリ上だけで使う）
+        """
+        self.path = Path(path) if path is not None else None
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if self.path is not None and self.path.exists():
+            self.entries = json.loads(self.path.read_text(encoding="utf-8"))
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            metadata = self.entries.get(sha256)
+            if metadata is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return dict(metadata)
+
+    def put(self, sha256: str, metadata: Dict[str, Any]):
+        # 日付などJSONで同じ値に戻らないメタデータはキャッシュしない
+        try:
+            if json.loads(json.dumps(metadata, ensure_ascii=False)) != metadata:
+                return
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            self.entries[sha256] = dict(metadata)
+            self._dirty = True
+
+    def retain(self, sha256s: Iterable[str]):
+        """指定したハッシュ以外（削除・更新されたファイルの古い版）のエントリを捨てる"""
+        keep = set(sha256s)
+        with self._lock:
+            stale = [key for key in self.entries if key not in keep]
+            for key in stale:
+                del self.entries[key]
+            self._dirty = self._dirty or bool(stale)
+
+    def save(self):
+        """変更があれば書き出す（一時ファイル経由で置き換え）"""
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(self.entries, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def stats(self) -> str:
+        """キャッシュの利用状況を表示用の文字列で返す"""
+        return f"フロントマターキャッシュ: ヒット {self.hits}件 / 新規解析 {self.misses}件"
+
+
+def read_front_matter_file(
+    file_path: Path,
+    cache: Optional[FrontMatterCache] = None,
+) -> Tuple[Dict[str, Any], str, str]:
+    """
+    ファイルを読み込んでフロントマターを解析し、(メタデータ, 本文, 内容のSHA-256) を返す
+
+    SHA-256 は差分インデックス（incremental_index.file_sha256）と同じ値です。
+    """
+    raw = Path(file_path).read_bytes()
+    sha256 = hashlib.sha256(raw).hexdigest()
+    # テキストモードで開いた場合と同じく改行を \n にそろえる
+    content = raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+    metadata = cache.get(sha256) if cache is not None else None
+    if metadata is not None:
+        _, body = split_front_matter(content)
+        return metadata, body, sha256
+
+    metadata, body = parse_front_matter(content)
+    if cache is not None:
+        cache.put(sha256, metadata)
+    return metadata, body, sha256
+
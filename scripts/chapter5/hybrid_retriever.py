@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+BM25とベクトル検索を並行実行するハイブリッド検索（重み付きRRF）
+
+EnsembleRetriever の invoke() は各 Retriever を順番に呼び出すため、
+ハイブリッド検索の待ち時間は BM25 とベクトル検索（埋め込みAPI＋近傍探索）の合計になります。
+HybridRetriever は各 Retriever をスレッドで同時に実行し、待ち時間を遅い方の検索だけに抑えます。
+
+- 融合は EnsembleRetriever と同じ重み付きRRF（weights・c の意味も同じ）
+  score(d) = Σ_i weights[i] / (rank_i(d) + c)   （rank は1始まり）
+- 重複は page_content（id_key 指定時はメタデータの値）でまとめ、同点は最初に現れた順
+- スコアの集計と並べ替えは NumPy でまとめて計算
+- 検索ごとに各ブランチと融合の所要時間を記録
+- 結果は各ブランチの順位リストを保持し、別の重み・c で融合し直せる（再検索なし）
+
+使用例:
+    hybrid = HybridRetriever(
+        retrievers=[bm25_retriever, dense_retriever],
+        weights=[0.6, 1.0],
+        c=60,
+        branch_names=["BM25", "ベクトル"],
+    )
+    result = hybrid.search("X-Pack monitoring の設定方法")
+    print(result.timing_summary())
+    bm25_heavy = result.refuse([0.9, 0.1])          # 再検索せずに重みだけ変える
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+# ブランチの同時実行に使うスレッドプール（検索のたびに作り直さない）
+_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-branch")
+
+
+def weighted_rrf(
+    rank_lists: Sequence[np.ndarray],
+    weights: Sequence[float],
+    c: int,
+    n_items: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    重み付きRRFで順位リストを融合する
+
+    Args:
+        rank_lists: ブランチごとの順位リスト（上位から並べた項目番号の配列）
+        weights: ブランチごとの重み
+        c: RRFの定数（大きいほど下位との差が小さくなる）
+        n_items: 項目番号の総数
+
+    Returns:
+        (スコアの高い順に並べた項目番号, 各項目のスコア)
+    """
+    if len(rank_lists) != len(weights):
+        raise ValueError("順位リストと重みの数が一致しません")
+    items = np.concatenate([np.asarray(ranks, dtype=np.int64) for ranks in rank_lists])
+    contributions = np.concatenate([
+        weight / (np.arange(1, len(ranks) + 1, dtype=np.float64) + c)
+        for ranks, weight in zip(rank_lists, weights)
+    ])
+    scores = np.bincount(items, weights=contributions, minlength=n_items)
+    # 同点は項目番号（= 最初に現れた順）で並べる
+    order = np.argsort(-scores, kind="stable")
+    return order, scores
+
+
+class HybridSearchResult:
+    """
+    ハイブリッド検索の結果（融合後の文書と所要時間）
+
+    各ブランチの順位リストを保持しているため、refuse() で別の重みや c で
+    融合し直せます（検索や埋め込みの呼び出しはやり直しません）。
+    """
+
+    def __init__(
+        self,
+        items: List[Document],
+        rank_lists: List[np.ndarray],
+        weights: Sequence[float],
+        c: int,
+        branch_names: List[str],
+        branch_seconds: List[float],
+        fusion_start: float,
+        started: float,
+    ):
+        self.items = items
+        self.rank_lists = rank_lists
+        self.weights = list(weights)
+        self.c = c
+        self.branch_names = branch_names
+        self.branch_seconds = branch_seconds
+
+        order, scores = weighted_rrf(rank_lists, self.weights, c, len(items))
+        self.documents = [items[i] for i in order]
+        self.scores = scores[order]
+        now = time.perf_counter()
+        self.fusion_seconds = now - fusion_start
+        self.total_seconds = now - started
+
+    def refuse(self, weights: Sequence[float], c: Optional[int] = None) -> List[Document]:
+        """保持している順位リストを別の重み・c で融合し直す"""
+        order, _ = weighted_rrf(self.rank_lists, weights, self.c if c is None else c, len(self.items))
+        return [self.items[i] for i in order]
+
+    def reciprocal_ranks(self, c: Optional[int] = None) -> np.ndarray:
+        """
+        ブランチごとの 1 / (rank + c) を並べた (ブランチ数, 文書数) の行列
+
+        重みの行列 W（設定数, ブランチ数）を掛けると、全設定の融合スコアが一度に求まります。
+        """
+        c = self.c if c is None else c
+        matrix = np.zeros((len(self.rank_lists), len(self.items)), dtype=np.float64)
+        for branch, ranks in enumerate(self.rank_lists):
+            matrix[branch, ranks] = 1.0 / (np.arange(1, len(ranks) + 1, dtype=np.float64) + c)
+        return matrix
+
+    def timings(self) -> Dict[str, float]:
+        """ブランチごと・融合・全体の所要時間（秒）"""
+        timings = dict(zip(self.branch_names, self.branch_seconds))
+        timings["融合"] = self.fusion_seconds
+        timings["合計"] = self.total_seconds
+        return timings
+
+    def timing_summary(self) -> str:
+        """所要時間を表示用の文字列で返す"""
+        branches = " / ".join(
+            f"{name} {seconds * 1000:.1f}ms"
+            for name, seconds in zip(self.branch_names, self.branch_seconds)
+        )
+        return (
+            f"検索時間: {branches} / 融合 {self.fusion_seconds * 1000:.2f}ms"
+            f"（合計 {self.total_seconds * 1000:.1f}ms）"
+        )
+
+
+def grid_search_weights(
+    results: Sequence[HybridSearchResult],
+    relevant: Sequence[Set[str]],
+    weight_grid: np.ndarray,
+    c_values: Sequence[int] = (60,),
+    k: int = 3,
+    label: Callable[[Document], str] = lambda doc: doc.metadata["source"],
+) -> List[Dict[str, Any]]:
+    """
+    保存済みの検索結果を使って、重みと c の組み合わせをまとめて評価する
+
+    Args:
+        results: 評価用クエリごとの HybridSearchResult
+        relevant: クエリごとの正解ラベルの集合（label(doc) の値）
+        weight_grid: 評価する重みの行列（設定数, ブランチ数）
+        c_values: 評価する c の候補
+        k: recall@k・MRR を計算する上位件数
+        label: 文書から正解判定用のラベルを取り出す関数
+
+    Returns:
+        設定ごとの {"weights", "c", "recall", "mrr"}（recall・MRR の高い順）
+    """
+    weight_grid = np.asarray(weight_grid, dtype=np.float64)
+    recall = np.zeros((len(c_values), len(weight_grid)))
+    mrr = np.zeros_like(recall)
+
+    for result, answers in zip(results, relevant):
+        if not answers:
+            continue
+        labels = [label(doc) for doc in result.items]
+        is_relevant = np.array([item_label in answers for item_label in labels], dtype=bool)
+        for ci, c in enumerate(c_values):
+            # 全設定のスコアを行列積1回で計算し、上位k件の順位を求める
+            scores = weight_grid @ result.reciprocal_ranks(c)
+            top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+            hits = is_relevant[top]
+            # 同じ正解ラベルのチャンクが複数入っても1件と数える（recall は1を超えない）
+            recall[ci] += [
+                len({labels[j] for j in top_row if is_relevant[j]}) / len(answers)
+                for top_row in top
+            ]
+            first = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, np.inf)
+            mrr[ci] += 1.0 / first
+
+    n_queries = max(len(results), 1)
+    rows = [
+        {
+            "weights": weight_grid[wi].tolist(),
+            "c": c,
+            "recall": float(recall[ci, wi] / n_queries),
+            "mrr": float(mrr[ci, wi] / n_queries),
+        }
+        for ci, c in enumerate(c_values)
+        for wi in range(len(weight_grid))
+    ]
+    rows.sort(key=lambda row: (-row["recall"], -row["mrr"]))
+    return rows
+
+
+class HybridRetriever(BaseRetriever):
+    """複数の Retriever を並行実行し、重み付きRRFで融合する Retriever"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    retrievers: List[BaseRetriever]
+    weights: List[float]
+    c: int = 60
+    id_key: Optional[str] = None
+    branch_names: Optional[List[str]] = None
+
+    def _names(self) -> List[str]:
+        return self.branch_names or [f"retriever_{i + 1}" for i in range(len(self.retrievers))]
+
+    def _key(self, doc: Document) -> str:
+        return doc.page_content if self.id_key is None else doc.metadata[self.id_key]
+
+    def fuse(
+        self,
+        doc_lists: List[List[Document]],
+        branch_seconds: List[float],
+        started: float,
+    ) -> HybridSearchResult:
+        """各ブランチの検索結果を重み付きRRFで融合する"""
+        fusion_start = time.perf_counter()
+        # 文書に通し番号を振り、ブランチごとの順位リストを番号の配列にする
+        positions: Dict[str, int] = {}
+        items: List[Document] = []
+        rank_lists = []
+        for docs in doc_lists:
+            ranks = []
+            for doc in docs:
+                key = self._key(doc)
+                if key not in positions:
+                    positions[key] = len(items)
+                    items.append(doc)
+                ranks.append(positions[key])
+            rank_lists.append(np.array(ranks, dtype=np.int64))
+
+        return HybridSearchResult(
+            items=items,
+            rank_lists=rank_lists,
+            weights=self.weights,
+            c=self.c,
+            branch_names=self._names(),
+            branch_seconds=branch_seconds,
+            fusion_start=fusion_start,
+            started=started,
+        )
+
+    def search(
+        self,
+        query: str,
+        run_manager: Optional[CallbackManagerForRetrieverRun] = None,
+    ) -> HybridSearchResult:
+        """全ブランチを同時に検索して融合し、所要時間付きの結果を返す"""
+        started = time.perf_counter()
+
+        def run_branch(i: int) -> Tuple[List[Document], float]:
+            branch_start = time.perf_counter()
+            config = {"callbacks": run_manager.get_child(tag=f"retriever_{i + 1}")} if run_manager else None
+            docs = self.retrievers[i].invoke(query, config=config)
+            return docs, time.perf_counter() - branch_start
+
+        futures = [_EXECUTOR.submit(run_branch, i) for i in range(len(self.retrievers))]
+        branch_results = [future.result() for future in futures]
+        return self.fuse(
+            [docs for docs, _ in branch_results],
+            [seconds for _, seconds in branch_results],
+            started,
+        )
+
+    async def asearch(
+        self,
+        query: str,
+        run_manager: Optional[AsyncCallbackManagerForRetrieverRun] = None,
+    ) -> HybridSearchResult:
+        """search() の非同期版（各ブランチの ainvoke を同時に待つ）"""
+        started = time.perf_counter()
+
+        async def run_branch(i: int) -> Tuple[List[Document], float]:
+            branch_start = time.perf_counter()
+            config = {"callbacks": run_manager.get_child(tag=f"retriever_{i + 1}")} if run_manager else None
+            docs = await self.retrievers[i].ainvoke(query, config=config)
+            return docs, time.perf_counter() - branch_start
+
+        branch_results = await asyncio.gather(*(run_branch(i) for i in range(len(self.retrievers))))
+        return self.fuse(
+            [docs for docs, _ in branch_results],
+            [seconds for _, seconds in branch_results],
+            started,
+        )
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.search(query, run_manager).documents
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return (await self.asearch(query, run_manager)).documents
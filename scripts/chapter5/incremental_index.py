@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+変更マニフェストによる差分インデックス更新
+
+load_company_documents() は実行のたびに全ファイルを読み込み・分割・埋め込みし直します。
+このモジュールでは、ファイルごとに以下をマニフェスト（JSON）へ記録し、
+変更のあったファイルのチャンクだけを Chroma と BM25 インデックスへ反映します。
+
+- ファイルのハッシュ（SHA-256）・更新時刻・サイズ
+- チャンクID（ベクトルストアのID）
+- 埋め込みID（埋め込みキャッシュのキー）
+- BM25インデックス上の文書ID
+
+更新時刻とサイズが変わっていないファイルはハッシュ計算も省略するため、
+同期にかかる時間は変更量にほぼ比例します。
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import TextSplitter
+
+from document_loader import parallel_map
+from embedding_cache import text_key
+from embedding_pipeline import ingest_documents
+from front_matter import FrontMatterCache
+from inverted_index import InvertedIndex
+
+# 削除済み文書がこの割合を超えたらBM25インデックスを作り直す
+COMPACT_DELETED_RATIO = 0.5
+
+
+def file_sha256(path: Path) -> str:
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CorpusManifest:
+    """ファイルごとのハッシュとチャンクIDを記録するマニフェスト"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        if self.path.exists():
+            self.files: Dict[str, Dict[str, Any]] = json.loads(
+                self.path.read_text(encoding="utf-8")
+            )["files"]
+        else:
+            self.files = {}
+
+    def save(self):
+        """マニフェストを書き出す（一時ファイル経由で置き換え）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps({"files": self.files}, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        os.replace(tmp_path, self.path)
+
+    def version(self) -> str:
+        """コーパス全体のバージョン（ファイル名とハッシュの組から計算）"""
+        digest = hashlib.sha256()
+        for name in sorted(self.files):
+            digest.update(f"{name}\0{self.files[name]['sha256']}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+
+class IncrementalIndexer:
+    """マニフェストを使って Chroma と BM25 インデックスを差分更新する"""
+
+    def __init__(
+        self,
+        data_dir: Path,
+        manifest: CorpusManifest,
+        load_file: Callable[[Path], Optional[Document]],
+        text_splitter: TextSplitter,
+        vectorstore: Any,
+        embeddings: Embeddings,
+        bm25_index: InvertedIndex,
+        preprocess_func: Callable[[str], List[str]],
+        pattern: str = "*.txt",
+        parse_cache: Optional[FrontMatterCache] = None,
+        on_chunks_deleted: Optional[Callable[[List[str]], Any]] = None,
+    ):
+        """
+        Args:
+            on_chunks_deleted: 更新・削除されたファイルの古いチャンクIDを受け取る関数
+                （回答キャッシュなど、チャンクを参照するものの無効化に使う）
+        """
+        self.data_dir = Path(data_dir)
+        self.manifest = manifest
+        self.load_file = load_file
+        self.text_splitter = text_splitter
+        self.vectorstore = vectorstore
+        self.embeddings = embeddings
+        self.bm25_index = bm25_index
+        self.preprocess_func = preprocess_func
+        self.pattern = pattern
+        self.parse_cache = parse_cache
+        self.on_chunks_deleted = on_chunks_deleted
+
+    def _changed_files(self) -> Dict[str, List]:
+        """追加・更新・削除・変更なしのファイルを振り分ける"""
+        result: Dict[str, List] = {"added": [], "updated": [], "deleted": [], "unchanged": []}
+        current = sorted(self.data_dir.glob(self.pattern))
+        names = {path.name for path in current}
+
+        for path in current:
+            stat = path.stat()
+            record = self.manifest.files.get(path.name)
+            if record and record["mtime"] == stat.st_mtime and record["size"] == stat.st_size:
+                result["unchanged"].append(path)
+                continue
+
+            sha256 = file_sha256(path)
+            if record and record["sha256"] == sha256:
+                # 内容が同じなら更新時刻だけ記録し直す
+                record.update(mtime=stat.st_mtime, size=stat.st_size)
+                result["unchanged"].append(path)
+            else:
+                result["updated" if record else "added"].append((path, sha256))
+
+        result["deleted"] = [name for name in self.manifest.files if name not in names]
+        return result
+
+    def _drop_orphaned_bm25(self):
+        """
+        マニフェストのどの記録からも参照されていないBM25の文書を削除済みにする
+
+        BM25インデックスへの追加はマニフェストの保存より前に行うため、その間で中断すると
+        どのファイルにも属さない文書が残ります。次の同期で同じファイルを追加し直すと
+        検索結果に同じチャンクが2件ずつ出るので、同期の最初に取り除きます。
+        """
+        live = ~self.bm25_index.deleted_mask()
+        for record in self.manifest.files.values():
+            live[record["bm25_ids"]] = False
+        self.bm25_index.delete_documents(np.flatnonzero(live))
+
+    def sync(self) -> Dict[str, Any]:
+        """変更のあったファイルのチャンクだけを追加・更新・削除する"""
+        start = time.perf_counter()
+        self._drop_orphaned_bm25()
+        changes = self._changed_files()
+
+        # 1. 追加・更新されたファイルを読み込む（スレッドプールで並列、結果はファイル順）
+        changed = dict(changes["added"] + changes["updated"])
+        docs: Dict[Path, Document] = {}
+        failed: List[str] = []
+        for path, future in parallel_map(self.load_file, changed):
+            doc = future.result()
+            if doc is None:
+                # 読み込めなかったファイルはマニフェストに記録せず（更新なら古い記録とチャンクを残し）、
+                # 次回の同期で読み込み直す
+                failed.append(path.name)
+            else:
+                docs[path] = doc
+
+        # 2. 更新・削除されたファイルの古いチャンクを削除
+        stale_names = [path.name for path in docs if path.name in self.manifest.files] + changes["deleted"]
+        stale_chunk_ids: List[str] = []
+        stale_bm25_ids: List[int] = []
+        for name in stale_names:
+            record = self.manifest.files[name]
+            stale_chunk_ids.extend(record["chunk_ids"])
+            stale_bm25_ids.extend(record["bm25_ids"])
+        if stale_chunk_ids:
+            self.vectorstore.delete(ids=stale_chunk_ids)
+            if self.on_chunks_deleted is not None:
+                self.on_chunks_deleted(stale_chunk_ids)
+        self.bm25_index.delete_documents(stale_bm25_ids)
+        for name in changes["deleted"]:
+            del self.manifest.files[name]
+
+        # 3. 読み込んだファイルを分割
+        new_chunks: List[Document] = []
+        new_ids: List[str] = []
+        file_chunks: Dict[str, Dict[str, Any]] = {}
+        for path, doc in docs.items():
+            sha256 = changed[path]
+            chunks = self.text_splitter.split_documents([doc])
+            chunk_ids = [f"{path.name}:{sha256[:12]}:{i}" for i in range(len(chunks))]
+            for chunk, chunk_id in zip(chunks, chunk_ids):
+                chunk.metadata["chunk_id"] = chunk_id
+            stat = path.stat()
+            file_chunks[path.name] = {
+                "sha256": sha256,
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "chunk_ids": chunk_ids,
+                "embedding_ids": [text_key(chunk.page_content).hex() for chunk in chunks],
+                "n_chunks": len(chunks),
+            }
+            new_chunks.extend(chunks)
+            new_ids.extend(chunk_ids)
+
+        # 4. 新しいチャンクだけを埋め込み・BM25インデックスへ追加
+        if new_chunks:
+            ingest_documents(new_chunks, self.embeddings, self.vectorstore, ids=new_ids)
+        bm25_ids = iter(
+            self.bm25_index.add_documents(
+                [self.preprocess_func(chunk.page_content) for chunk in new_chunks],
+                [chunk.page_content for chunk in new_chunks],
+                [chunk.metadata for chunk in new_chunks],
+            )
+        )
+        for name, record in file_chunks.items():
+            record["bm25_ids"] = [next(bm25_ids) for _ in range(record.pop("n_chunks"))]
+            self.manifest.files[name] = record
+        self.manifest.save()
+
+        # 5. 削除済みが多くなったらBM25インデックスを詰め直す
+        if len(self.bm25_index) and (
+            1 - self.bm25_index.live_count() / len(self.bm25_index) > COMPACT_DELETED_RATIO
+        ):
+            mapping = self.bm25_index.compact(self.preprocess_func)
+            for record in self.manifest.files.values():
+                record["bm25_ids"] = [int(mapping[i]) for i in record["bm25_ids"]]
+
+        self.manifest.save()
+        if self.parse_cache is not None:
+            # マニフェストに残っている版のファイルの解析結果だけを保持する
+            self.parse_cache.retain(record["sha256"] for record in self.manifest.files.values())
+            self.parse_cache.save()
+        added = {path.name for path, _ in changes["added"]}
+        return {
+            "added": len(added) - len(added.intersection(failed)),
+            "updated": len(changes["updated"]) - len(set(failed) - added),
+            "deleted": len(changes["deleted"]),
+            "unchanged": len(changes["unchanged"]),
+            "failed": failed,
+            "chunks_added": len(new_chunks),
+            "chunks_deleted": len(stale_chunk_ids),
+            "seconds": time.perf_counter() - start,
+        }
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+"""
+永続化・メモリマップ対応の転置インデックス（BM25）
+
+BM25Retriever.from_documents はプロセス起動のたびに全チャンクをトークナイズし、
+インデックスをメモリ上に作り直します。このモジュールはインデックスをディスクに保存し、
+次回以降はメモリマップで開くだけで検索できるようにします。
+
+- ポスティングの文書IDは語ごとに差分（delta）符号化し、最小の整数型で保存
+- 文書の追加はセグメント単位の追記で行い、既存セグメントは書き換えない
+- 本文とメタデータは OffsetDocStore に保存し、検索結果の分だけ読み出す
+- 削除は墓標（削除済みID一覧）の追記で行い、検索結果から除外する
+  （IDFなどの統計は compact() で作り直すまで削除前の値を使う）
+
+ディレクトリ構成:
+    meta.json       セグメント一覧・文書数などの管理情報
+    vocab.jsonl     語彙（1行1語, 行番号 = 語ID）
+    docs/           OffsetDocStore
+    doc_hashes.bin  チャンク本文のハッシュ（16バイト/文書）
+    deleted.bin     削除済みの文書ID（uint32）
+    seg_00000/      セグメント（indptr.npy, deltas.npy, tfs.npy, lengths.npy）
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from bm25_index import BM25Index
+from doc_store import OffsetDocStore
+
+HASH_SIZE = 16
+
+
+def content_hash(text: str) -> bytes:
+    """チャンク本文のハッシュ（追記・再構築の判定に使用）"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=HASH_SIZE).digest()
+
+
+def _smallest_uint(max_value: int) -> np.dtype:
+    """値を格納できる最小の符号なし整数型"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+class _Segment:
+    """追記1回分のポスティング（メモリマップで読み込み）"""
+
+    def __init__(self, path: Path, base: int):
+        self.base = base
+        self.indptr = np.load(path / "indptr.npy", mmap_mode="r")
+        self.deltas = np.load(path / "deltas.npy", mmap_mode="r")
+        self.tfs = np.load(path / "tfs.npy", mmap_mode="r")
+        self.lengths = np.load(path / "lengths.npy", mmap_mode="r")
+
+    @staticmethod
+    def write(path: Path, token_lists: Sequence[Sequence[str]], vocabulary: Dict[str, int]):
+        """セグメントをディスクに書き出す（新しい語は vocabulary に追加される）"""
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        term_freqs: List[int] = []
+        for doc_id, tokens in enumerate(token_lists):
+            for token, freq in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+
+        term_arr = np.asarray(term_ids, dtype=np.int64)
+        doc_arr = np.asarray(doc_ids, dtype=np.int64)
+        order = np.lexsort((doc_arr, term_arr))
+        term_arr, doc_arr = term_arr[order], doc_arr[order]
+        tf_arr = np.asarray(term_freqs, dtype=np.int64)[order]
+
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_arr, minlength=len(vocabulary)), out=indptr[1:])
+
+        # 語ごとに文書IDの差分を取る（各語の先頭は文書IDそのもの）
+        deltas = np.diff(doc_arr, prepend=0)
+        starts = indptr[:-1][np.diff(indptr) > 0]
+        deltas[starts] = doc_arr[starts]
+
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "indptr.npy", indptr)
+        np.save(path / "deltas.npy", deltas.astype(_smallest_uint(int(deltas.max(initial=0)))))
+        np.save(path / "tfs.npy", tf_arr.astype(_smallest_uint(int(tf_arr.max(initial=0)))))
+        np.save(
+            path / "lengths.npy",
+            np.asarray([len(tokens) for tokens in token_lists], dtype=np.uint32),
+        )
+
+    def document_frequencies(self, vocab_size: int) -> np.ndarray:
+        """このセグメントでの語ごとの文書頻度（語彙数に合わせて0埋め）"""
+        freqs = np.zeros(vocab_size, dtype=np.int64)
+        seg_freqs = np.diff(self.indptr)
+        freqs[: len(seg_freqs)] = seg_freqs
+        return freqs
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """語IDのポスティングを復号して (全体の文書ID, 出現回数) を返す"""
+        if term_id + 1 >= len(self.indptr):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        start, end = int(self.indptr[term_id]), int(self.indptr[term_id + 1])
+        doc_ids = np.cumsum(self.deltas[start:end], dtype=np.int64) + self.base
+        return doc_ids, np.asarray(self.tfs[start:end])
+
+
+class InvertedIndex:
+    """ディスク上の転置インデックスとドキュメントストア"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        else:
+            self.meta = {"format": 1, "n_docs": 0, "n_terms": 0, "segments": []}
+
+        self.vocabulary: Dict[str, int] = {}
+        vocab_path = self.path / "vocab.jsonl"
+        if vocab_path.exists():
+            # n_terms（記録済みの語数）より後ろの行は中断した追記の残りなので読まずに切り捨てる
+            n_terms = self.meta.get("n_terms")
+            position = 0
+            with open(vocab_path, "r+b") as f:
+                for line in f:
+                    if n_terms is not None and len(self.vocabulary) >= n_terms:
+                        f.truncate(position)
+                        break
+                    self.vocabulary.setdefault(json.loads(line), len(self.vocabulary))
+                    position += len(line)
+
+        self.docstore = OffsetDocStore(self.path / "docs")
+        self._drop_uncommitted()
+        self.segments = [
+            _Segment(self.path / seg["name"], seg["base"]) for seg in self.meta["segments"]
+        ]
+
+    def __len__(self) -> int:
+        return self.meta["n_docs"]
+
+    def _drop_uncommitted(self):
+        """
+        meta.json に記録される前に中断した追記の残りを切り捨てる
+
+        本文・メタデータ・ハッシュの追記は meta.json を置き換える前に行うため、
+        中断すると meta["n_docs"] より後ろに行が残ります。そのまま次の追記を行うと
+        文書IDと本文がずれるので、記録済みの文書数まで戻します。
+        """
+        n_docs = self.meta["n_docs"]
+        self.docstore.truncate(n_docs)
+        hash_path = self.path / "doc_hashes.bin"
+        if hash_path.exists() and hash_path.stat().st_size > n_docs * HASH_SIZE:
+            with open(hash_path, "r+b") as f:
+                f.truncate(n_docs * HASH_SIZE)
+
+    def doc_hashes(self) -> np.ndarray:
+        """登録済みチャンクの本文ハッシュ（文書数 × 16バイト）"""
+        hash_path = self.path / "doc_hashes.bin"
+        if not len(self) or not hash_path.exists():
+            return np.empty((0, HASH_SIZE), dtype=np.uint8)
+        return np.memmap(hash_path, dtype=np.uint8, mode="r", shape=(len(self), HASH_SIZE))
+
+    def deleted_mask(self) -> np.ndarray:
+        """削除済みの文書なら True となる配列"""
+        mask = np.zeros(len(self), dtype=bool)
+        deleted_path = self.path / "deleted.bin"
+        if deleted_path.exists():
+            mask[np.fromfile(deleted_path, dtype=np.uint32)] = True
+        return mask
+
+    def live_count(self) -> int:
+        """削除されていない文書数"""
+        return len(self) - int(self.deleted_mask().sum())
+
+    def delete_documents(self, doc_ids: Sequence[int]):
+        """文書を削除済みとして記録（ポスティングは書き換えない）"""
+        if len(doc_ids):
+            with open(self.path / "deleted.bin", "ab") as f:
+                np.asarray(doc_ids, dtype=np.uint32).tofile(f)
+
+    def compact(self, preprocess_func: Callable[[str], List[str]]) -> np.ndarray:
+        """
+        削除済み文書を取り除いてインデックスを作り直す
+
+        Returns:
+            旧文書IDから新文書IDへの対応表（削除済みは -1）
+        """
+        live = np.flatnonzero(~self.deleted_mask())
+        records = [self.docstore.get(int(doc_id)) for doc_id in live]
+
+        tmp_path = self.path.with_name(self.path.name + ".compact")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        compacted = InvertedIndex(tmp_path)
+        compacted.add_documents(
+            [preprocess_func(text) for text, _ in records],
+            [text for text, _ in records],
+            [metadata for _, metadata in records],
+        )
+
+        mapping = np.full(len(self), -1, dtype=np.int64)
+        mapping[live] = np.arange(len(live))
+        shutil.rmtree(self.path)
+        os.replace(tmp_path, self.path)
+        self.__init__(self.path)
+        return mapping
+
+    def doc_lengths(self) -> np.ndarray:
+        """全文書のトークン数"""
+        if not self.segments:
+            return np.empty(0, dtype=np.float32)
+        return np.concatenate([seg.lengths for seg in self.segments]).astype(np.float32)
+
+    def document_frequencies(self) -> np.ndarray:
+        """全セグメントを合算した語ごとの文書頻度"""
+        freqs = np.zeros(len(self.vocabulary), dtype=np.int64)
+        for seg in self.segments:
+            freqs += seg.document_frequencies(len(self.vocabulary))
+        return freqs
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """全セグメントを通した語IDのポスティング"""
+        parts = [seg.postings(term_id) for seg in self.segments]
+        parts = [part for part in parts if len(part[0])]
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return (
+            np.concatenate([ids for ids, _ in parts]),
+            np.concatenate([tfs for _, tfs in parts]),
+        )
+
+    def add_documents(
+        self,
+        token_lists: Sequence[Sequence[str]],
+        texts: Sequence[str],
+        metadatas: Sequence[Dict[str, Any]],
+    ) -> range:
+        """文書を新しいセグメントとして追記（既存セグメントは再構築しない）"""
+        if not token_lists:
+            return range(len(self), len(self))
+        try:
+            return self._append_segment(token_lists, texts, metadatas)
+        except BaseException:
+            # 語彙などメモリ上の状態も記録済みのところまで戻す
+            self.__init__(self.path)
+            raise
+
+    def _append_segment(
+        self,
+        token_lists: Sequence[Sequence[str]],
+        texts: Sequence[str],
+        metadatas: Sequence[Dict[str, Any]],
+    ) -> range:
+        base = len(self)
+        known_terms = len(self.vocabulary)
+        name = f"seg_{len(self.meta['segments']):05d}"
+        _Segment.write(self.path / name, token_lists, self.vocabulary)
+
+        # 新しく出現した語だけを語彙ファイルに追記
+        new_terms = list(self.vocabulary)[known_terms:]
+        with open(self.path / "vocab.jsonl", "a", encoding="utf-8") as f:
+            for term in new_terms:
+                f.write(json.dumps(term, ensure_ascii=False) + "\n")
+
+        self.docstore.append(list(texts), list(metadatas))
+        with open(self.path / "doc_hashes.bin", "ab") as f:
+            for text in texts:
+                f.write(content_hash(text))
+
+        # 管理情報は最後に置き換える（途中で中断した分は次に開いたときに切り捨てる）
+        self.meta["segments"].append({"name": name, "base": base})
+        self.meta["n_docs"] = base + len(token_lists)
+        self.meta["n_terms"] = len(self.vocabulary)
+        tmp_path = self.path / "meta.json.tmp"
+        tmp_path.write_text(json.dumps(self.meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, self.path / "meta.json")
+
+        self.segments.append(_Segment(self.path / name, base))
+        return range(base, self.meta["n_docs"])
+
+    def get_document(self, doc_id: int) -> Document:
+        """文書IDからDocumentを復元"""
+        text, metadata = self.docstore.get(doc_id)
+        return Document(page_content=text, metadata=metadata)
+
+
+class PersistentBM25Index(BM25Index):
+    """InvertedIndex のセグメントを直接参照するBM25インデックス"""
+
+    def __init__(self, index: InvertedIndex, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.inverted_index = index
+        self.vocabulary = index.vocabulary
+        self.doc_lengths = index.doc_lengths()
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.deleted = index.deleted_mask()
+        self._prepare()
+
+    def _document_frequencies(self) -> np.ndarray:
+        return self.inverted_index.document_frequencies()
+
+    def _drop_deleted(self, candidates: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        live = ~self.deleted[candidates]
+        return candidates[live], scores[live]
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.inverted_index.postings(term_id)
+
+
+class PersistentBM25Retriever(BaseRetriever):
+    """ディスク上の転置インデックスを使うBM25 Retriever（BM25Retrieverの代替）"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: Any
+    bm25: Any
+    preprocess_func: Callable[[str], List[str]]
+    k: int = 4
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: Sequence[Document],
+        index_dir: Path,
+        preprocess_func: Callable[[str], List[str]],
+        k: int = 4,
+    ) -> "PersistentBM25Retriever":
+        """
+        保存済みインデックスを開き、足りない文書だけを追記してRetrieverを作る
+
+        - 保存済みの文書が documents の先頭と一致する場合: 末尾の新しい文書だけ追記
+        - 一致しない場合（文書の変更・削除）: インデックスを作り直す
+        """
+        index = InvertedIndex(index_dir)
+        hashes = np.frombuffer(
+            b"".join(content_hash(doc.page_content) for doc in documents), dtype=np.uint8
+        ).reshape(-1, HASH_SIZE)
+
+        stored = index.doc_hashes()
+        if len(stored) > len(documents) or not np.array_equal(stored, hashes[: len(stored)]):
+            index = cls._recreate(index_dir)
+            stored = index.doc_hashes()
+
+        new_docs = list(documents[len(stored):])
+        if new_docs:
+            index.add_documents(
+                [preprocess_func(doc.page_content) for doc in new_docs],
+                [doc.page_content for doc in new_docs],
+                [doc.metadata for doc in new_docs],
+            )
+
+        return cls.from_index(index, preprocess_func, k=k)
+
+    @classmethod
+    def from_index(
+        cls,
+        index: InvertedIndex,
+        preprocess_func: Callable[[str], List[str]],
+        k: int = 4,
+    ) -> "PersistentBM25Retriever":
+        """構築済みのインデックスからRetrieverを作る（トークナイズは行わない）"""
+        return cls(index=index, bm25=PersistentBM25Index(index), preprocess_func=preprocess_func, k=k)
+
+    @staticmethod
+    def _recreate(index_dir: Path) -> InvertedIndex:
+        """インデックスディレクトリを空にして開き直す"""
+        shutil.rmtree(index_dir, ignore_errors=True)
+        return InvertedIndex(index_dir)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: Optional[CallbackManagerForRetrieverRun] = None
+    ) -> List[Document]:
+        results = self.bm25.search(self.preprocess_func(query), k=self.k)
+        return [self.index.get_document(doc_id) for doc_id, _ in results]
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+BM25用の軽量な日本語トークナイザー（1パスの正規表現と整数の語彙）
+
+5-5-1 の tokenize_for_bm25() は re.findall で英数字・日本語の連続部分を取り出した後、
+部分ごとに re.fullmatch で種類を判定し直し、日本語部分は1文字ずつスライスして bi-gram を作ります。
+このモジュールでは、英数字と日本語をそれぞれ別のグループにしたコンパイル済みの正規表現で
+1回だけ走査し、一致したグループで種類を判定します。
+
+- 英数字の連続          → そのまま1トークン
+- 日本語の連続（2文字以上）→ 1文字ずらした文字列との連結で文字 bi-gram をまとめて作る
+- 日本語の1文字だけの部分 → その1文字
+
+出力は tokenize_for_bm25() と同じトークン列です。
+encode() はトークンを文字列のリストにせず、語彙（トークン → 語ID）の整数配列として返し、
+tokenize_batch() は大きなコーパスをまとまりごとに語ID化します（use_processes=True でプロセスプールに分ける）。
+プロセスプールはテキストと結果の受け渡しのコストが大きく、サンプル文書12,000件では1プロセスの
+tokenize より遅かったため、既定では使いません。ベンチマークで両方を比べてから選んでください。
+
+使用例:
+    vocabulary = Vocabulary()
+    token_ids = tokenize_batch(texts, vocabulary)
+    index = BM25Index.from_token_ids(token_ids, vocabulary.ids)
+    results = index.search(tokenize(query), k=3)
+
+ベンチマーク（APIキー不要）:
+    uv run python japanese_tokenizer.py --repeat 2000
+"""
+
+import argparse
+import operator
+import re
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from document_loader import batched, parallel_map
+
+# 1: 英数字の連続 / 2: 日本語（漢字・ひらがな・カタカナ）の連続
+# どちらのグループに一致したかで種類が決まるため、部分ごとに判定し直す必要がない
+_RUN_PATTERN = re.compile(r"([A-Za-z0-9]+)|([一-龥ぁ-んァ-ンー]+)")
+
+
+def tokenize(text: str) -> List[str]:
+    """テキストをトークンのリストにする（tokenize_for_bm25 と同じ結果）"""
+    tokens: List[str] = []
+    append, extend = tokens.append, tokens.extend
+    for ascii_run, japanese_run in _RUN_PATTERN.findall(text):
+        if ascii_run:
+            append(ascii_run)
+        elif len(japanese_run) == 1:
+            append(japanese_run)
+        else:
+            # 1文字ずらした文字列と連結して bi-gram を作る（スライスの繰り返しを避ける）
+            extend(map(operator.add, japanese_run, japanese_run[1:]))
+    return tokens
+
+
+def reference_tokenize(text: str) -> List[str]:
+    """比較用: 5-5-1 の tokenize_for_bm25 と同じ実装"""
+    tokens: List[str] = []
+    for chunk in re.findall(r"[A-Za-z0-9]+|[一-龥ぁ-んァ-ンー]+", text):
+        if re.fullmatch(r"[A-Za-z0-9]+", chunk):
+            tokens.append(chunk)
+        else:
+            if len(chunk) == 1:
+                tokens.append(chunk)
+            else:
+                tokens.extend(chunk[i: i + 2] for i in range(len(chunk) - 1))
+    return tokens
+
+
+class Vocabulary:
+    """トークンから語IDへの対応表（語IDは初めて出現した順に 0, 1, 2, ...）"""
+
+    def __init__(self, terms: Iterable[str] = ()):
+        # 未知のトークンを引くと、その時点の語彙数を語IDとして登録する
+        self.ids: Dict[str, int] = defaultdict()
+        self.ids.default_factory = self.ids.__len__
+        for term in terms:
+            self.ids[term]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.ids
+
+    def terms(self) -> List[str]:
+        """語ID順のトークン一覧"""
+        return list(self.ids)
+
+    def add(self, tokens: Sequence[str]) -> np.ndarray:
+        """トークン列を語IDの配列にする（未知のトークンは新しく登録）"""
+        return np.fromiter(map(self.ids.__getitem__, tokens), dtype=np.int32, count=len(tokens))
+
+    def lookup(self, tokens: Sequence[str]) -> np.ndarray:
+        """トークン列を語IDの配列にする（未知のトークンは除く、検索クエリ用）"""
+        ids = self.ids
+        return np.asarray([ids[token] for token in tokens if token in ids], dtype=np.int32)
+
+
+def encode(text: str, vocabulary: Vocabulary, add: bool = True) -> np.ndarray:
+    """テキストをトークナイズして語IDの配列にする（add=False なら未知語を除く）"""
+    tokens = tokenize(text)
+    return vocabulary.add(tokens) if add else vocabulary.lookup(tokens)
+
+
+def _encode_batch(texts: Sequence[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    ワーカープロセス用: テキストのまとまりを局所的な語彙で語ID化する
+
+    Returns:
+        (局所語彙のトークン一覧, 全テキストの局所語IDを連結した配列, テキストごとのトークン数)
+    """
+    local = Vocabulary()
+    encoded = [local.add(tokenize(text)) for text in texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    ids = np.concatenate(encoded) if encoded else np.empty(0, dtype=np.int32)
+    return local.terms(), ids, lengths
+
+
+def tokenize_batch(
+    texts: Sequence[str],
+    vocabulary: Vocabulary,
+    batch_size: int = 2048,
+    max_workers: int = 4,
+    use_processes: bool = False,
+) -> List[np.ndarray]:
+    """
+    複数のテキストをまとめて語ID化する（新しいトークンは vocabulary に登録）
+
+    テキストを batch_size 件ずつワーカーに渡し、各ワーカーは局所的な語彙で語ID化します。
+    親プロセスは局所語彙を vocabulary の語IDへの変換表にして、配列1回の参照で付け替えます。
+    まとまりは先頭から順に取り込むため、語IDは1件ずつ encode() した場合と同じになります。
+
+    Args:
+        texts: テキストのリスト
+        vocabulary: 登録先の語彙
+        batch_size: 1回にワーカーへ渡すテキスト数
+        max_workers: 並列数
+        use_processes: プロセスプールを使うか（受け渡しのコストの方が大きいことが多いため既定は False）
+
+    Returns:
+        テキストごとの語IDの配列
+    """
+    batches = list(batched(texts, batch_size))
+    if use_processes and len(batches) > 1:
+        results = (
+            future.result()
+            for _, future in parallel_map(
+                _encode_batch, batches, max_workers=max_workers,
+                max_in_flight=2 * max_workers, use_processes=True,
+            )
+        )
+    else:
+        results = map(_encode_batch, batches)
+
+    token_ids: List[np.ndarray] = []
+    for local_terms, local_ids, lengths in results:
+        mapping = vocabulary.add(local_terms)
+        token_ids.extend(np.split(mapping[local_ids], np.cumsum(lengths)[:-1]))
+    return token_ids
+
+
+def benchmark_tokenizers(
+    texts: Sequence[str], max_workers: int = 4
+) -> List[Dict[str, float]]:
+    """
+    tokenize_for_bm25 と同じ実装・1パスの tokenize・語ID化のトークン/秒を比較する
+
+    Returns:
+        方式ごとの {"name", "seconds", "tokens_per_sec"}
+    """
+    def measure(name: str, func) -> Dict[str, float]:
+        start = time.perf_counter()
+        n_tokens = func()
+        seconds = time.perf_counter() - start
+        return {"name": name, "seconds": seconds, "tokens_per_sec": n_tokens / seconds}
+
+    expected = [reference_tokenize(text) for text in texts]
+    if [tokenize(text) for text in texts] != expected:
+        raise AssertionError("tokenize の結果が tokenize_for_bm25 と一致しません")
+
+    rows = [
+        measure("tokenize_for_bm25", lambda: sum(len(reference_tokenize(text)) for text in texts)),
+        measure("tokenize", lambda: sum(len(tokenize(text)) for text in texts)),
+    ]
+    vocabulary = Vocabulary()
+    rows.append(measure("encode", lambda: sum(len(encode(text, vocabulary)) for text in texts)))
+
+    for use_processes in (False, True):
+        batch_vocabulary = Vocabulary()
+        rows.append(measure(
+            f"tokenize_batch（{max_workers if use_processes else 1}プロセス）",
+            lambda: sum(map(len, tokenize_batch(
+                texts, batch_vocabulary, max_workers=max_workers, use_processes=use_processes
+            ))),
+        ))
+        if batch_vocabulary.terms() != vocabulary.terms():
+            raise AssertionError("tokenize_batch の語彙が encode と一致しません")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="日本語トークナイザーのベンチマーク")
+    parser.add_argument("--repeat", type=int, default=2000, help="サンプル文書を繰り返す回数")
+    parser.add_argument("--workers", type=int, default=4, help="tokenize_batch のプロセス数")
+    args = parser.parse_args()
+
+    data_dir = Path(__file__).parent / "hybrid_sample_data"
+    samples = [path.read_text(encoding="utf-8") for path in sorted(data_dir.glob("*.txt"))]
+    corpus = samples * args.repeat
+
+    print(f"=== 日本語トークナイザーのベンチマーク（{len(corpus)}文書）===")
+    for row in benchmark_tokenizers(corpus, args.workers):
+        print(
+            f"  {row['name']:<24} {row['seconds']:7.3f}秒  "
+            f"{row['tokens_per_sec'] / 1e6:6.2f}Mトークン/秒"
+        )
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+"""
+フロントマターのメタデータによる検索前の絞り込み（候補ビットマップ）
+
+load_company_documents() はフロントマターをメタデータにしますが、検索は常に全チャンクが対象です。
+「経費規定だけ」「2024年以降の改定だけ」のような条件付きの検索でも、
+BM25・ベクトル検索は条件に合わないチャンクまで採点してから捨てることになります。
+
+MetadataIndex はメタデータのキーと値ごとに、その値を持つチャンク番号の配列（ポスティング）を持ち、
+検索の前に条件に合うチャンクの真偽値配列（候補ビットマップ）を作ります。
+
+- BM25: 各クエリ語のポスティングから候補のチャンクだけを残して採点（BM25Index.search の mask・candidates、
+  候補がポスティングより少なければ候補ごとの二分探索）
+- ベクトル検索: 候補の行だけを取り出して行列積を計算（MatrixVectorStore.search_batch の candidates）
+
+どちらも計算量が候補数に比例するため、部署が多く条件が厳しいほど検索が速くなります。
+IDF などの統計は全チャンクのままなので、結果は「全件検索の順位から条件に合うものだけを残したもの」と同じです。
+
+条件の書き方は Chroma の where と同じ形です（キーを複数並べると AND、キーを持たないチャンクは常に対象外）。
+    {"document_type": "経費規定"}                         完全一致
+    {"document_type": {"$in": ["経費規定", "勤怠規定"]}}   いずれかに一致
+    {"revised": {"$gte": datetime.date(2024, 4, 1)}}     範囲（$gt / $gte / $lt / $lte）
+    {"chapter": {"$ne": "第1章"}}                         不一致
+
+フロントマターの日付（revised: 2024-04-01）は datetime.date になります。範囲の条件では日付と
+"2024-04-01" のような文字列を ISO 形式の文字列どうしで比べるため、どちらで指定しても構いません。
+キーのどの値とも比較できない値を指定すると TypeError になります（条件に合わないとはみなしません）。
+
+使用例:
+    bm25_retriever, vector_retriever = create_prefiltered_retrievers(
+        chunks, embeddings, preprocess_func, where={"document_type": "経費規定"}, k=8
+    )
+
+ベンチマーク（疑似コーパス・APIキー不要）:
+    uv run python metadata_index.py --n 200000 --departments 500
+"""
+
+import argparse
+import operator
+import time
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from bm25_index import BM25Index
+from front_matter import parse_header
+from quantized_store import create_vector_store
+from vector_store import MatrixVectorStore
+
+_RANGE_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$ne": operator.ne,
+}
+
+
+def _comparable(value: Any, operand: Any) -> Tuple[Any, Any]:
+    """日付と文字列の組は ISO 形式の文字列どうしにして比べる"""
+    if isinstance(operand, str) and hasattr(value, "isoformat"):
+        return value.isoformat(), operand
+    if isinstance(value, str) and hasattr(operand, "isoformat"):
+        return value, operand.isoformat()
+    return value, operand
+
+
+class MetadataIndex:
+    """メタデータのキー・値ごとのチャンク番号から、条件に合うチャンクの候補ビットマップを作る索引"""
+
+    def __init__(self, metadatas: Iterable[Dict[str, Any]] = (), max_cached_filters: int = 64):
+        """
+        Args:
+            metadatas: チャンクのメタデータ（並び順がチャンク番号になる）
+            max_cached_filters: 作ったビットマップを保持する条件の数
+        """
+        self.n_docs = 0
+        # キー → 値 → チャンク番号のリスト（追加中）/ 配列（検索時に変換）
+        self._postings: Dict[str, Dict[Any, Any]] = defaultdict(dict)
+        self.max_cached_filters = max_cached_filters
+        # 条件 → (ビットマップ, チャンク番号の配列)
+        self._bitmaps: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self.add(metadatas)
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def add(self, metadatas: Iterable[Dict[str, Any]]) -> range:
+        """チャンクのメタデータを追加し、割り当てたチャンク番号を返す"""
+        start = self.n_docs
+        for metadata in metadatas:
+            for key, value in metadata.items():
+                # リストなどハッシュできない値は索引に含めない
+                if isinstance(value, (str, int, float, bool)) or value is None or hasattr(value, "isoformat"):
+                    postings = self._postings[key].setdefault(value, [])
+                    if isinstance(postings, np.ndarray):
+                        postings = self._postings[key][value] = postings.tolist()
+                    postings.append(self.n_docs)
+            self.n_docs += 1
+        if self.n_docs > start:
+            self._bitmaps.clear()
+        return range(start, self.n_docs)
+
+    def keys(self) -> List[str]:
+        return list(self._postings)
+
+    def values(self, key: str) -> List[Any]:
+        """キーの値の一覧（出現するチャンク数の多い順）"""
+        values = self._postings.get(key, {})
+        return sorted(values, key=lambda value: -len(values[value]))
+
+    def _value_postings(self, key: str, value: Any) -> np.ndarray:
+        postings = self._postings[key][value]
+        if not isinstance(postings, np.ndarray):
+            postings = self._postings[key][value] = np.asarray(postings, dtype=np.int64)
+        return postings
+
+    def _matching_values(self, key: str, condition: Any) -> List[Any]:
+        """条件に合う値の一覧"""
+        values = self._postings.get(key, {})
+        if not isinstance(condition, dict):
+            return [condition] if condition in values else []
+
+        matched = list(values)
+        for op, operand in condition.items():
+            if op == "$eq":
+                matched = [value for value in matched if value == operand]
+            elif op in ("$in", "$nin"):
+                operands = set(operand)
+                matched = [value for value in matched if (value in operands) == (op == "$in")]
+            elif op in _RANGE_OPERATORS:
+                compare = _RANGE_OPERATORS[op]
+                kept = []
+                incomparable = 0
+                for value in matched:
+                    try:
+                        if compare(*_comparable(value, operand)):
+                            kept.append(value)
+                    except TypeError:
+                        # 型の混ざったキーでは、比較できない型の値（文字列と数値など）だけを除く
+                        incomparable += 1
+                if matched and incomparable == len(matched):
+                    types = sorted({type(value).__name__ for value in matched})
+                    raise TypeError(
+                        f"{key} の値（{', '.join(types)}）と {op} の値 {operand!r}"
+                        f"（{type(operand).__name__}）は比較できません"
+                    )
+                matched = kept
+            else:
+                raise ValueError(f"未対応の演算子です: {op}")
+        return matched
+
+    def _lookup(self, where: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        条件の (ビットマップ, チャンク番号の配列) を返す
+
+        同じ条件の結果は保持しておき、2回目以降は作り直しません。
+        """
+        cache_key = repr(sorted(where.items(), key=lambda item: item[0]))
+        cached = self._bitmaps.get(cache_key)
+        if cached is not None:
+            self._bitmaps.move_to_end(cache_key)
+            return cached
+
+        bitmap = np.ones(self.n_docs, dtype=bool)
+        for key, condition in where.items():
+            key_bitmap = np.zeros(self.n_docs, dtype=bool)
+            for value in self._matching_values(key, condition):
+                key_bitmap[self._value_postings(key, value)] = True
+            bitmap &= key_bitmap
+
+        cached = self._bitmaps[cache_key] = (bitmap, np.flatnonzero(bitmap))
+        while len(self._bitmaps) > self.max_cached_filters:
+            self._bitmaps.popitem(last=False)
+        return cached
+
+    def bitmap(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """条件に合うチャンクを True にした真偽値配列（長さ = チャンク数）"""
+        if not where:
+            return np.ones(self.n_docs, dtype=bool)
+        return self._lookup(where)[0]
+
+    def candidates(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """条件に合うチャンク番号の配列（昇順）"""
+        if not where:
+            return np.arange(self.n_docs)
+        return self._lookup(where)[1]
+
+    def selectivity(self, where: Optional[Dict[str, Any]]) -> float:
+        """条件に合うチャンクの割合"""
+        return float(self.bitmap(where).mean()) if self.n_docs else 0.0
+
+
+def parse_where(expressions: Sequence[str]) -> Dict[str, Any]:
+    """
+    コマンドラインの「キー=値」のリストを条件の辞書にする
+
+    値はフロントマターと同じ規則で解釈します（"第3章" は文字列、2024 は整数）。
+    同じキーを複数回指定すると、いずれかに一致する条件（$in）になります。
+    """
+    where: Dict[str, Any] = {}
+    for expression in expressions:
+        key, separator, raw_value = expression.partition("=")
+        if not separator or not key.strip():
+            raise ValueError(f"条件は「キー=値」の形で指定してください: {expression}")
+        key = key.strip()
+        value = parse_header(f"{key}: {raw_value.strip()}")[key]
+        if key not in where:
+            where[key] = value
+        else:
+            previous = where[key]
+            values = previous["$in"] if isinstance(previous, dict) else [previous]
+            where[key] = {"$in": values + [value]}
+    return where
+
+
+class PrefilteredBM25Retriever(BaseRetriever):
+    """候補ビットマップに含まれるチャンクだけを採点するBM25 Retriever"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    documents: List[Document]
+    bm25: Any
+    metadata_index: Any
+    preprocess_func: Callable[[str], List[str]]
+    where: Optional[Dict[str, Any]] = None
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.where:
+            mask, candidates = self.metadata_index.bitmap(self.where), self.metadata_index.candidates(self.where)
+        else:
+            mask = candidates = None
+        results = self.bm25.search(self.preprocess_func(query), k=self.k, mask=mask, candidates=candidates)
+        return [self.documents[doc_id] for doc_id, _ in results]
+
+
+class PrefilteredVectorRetriever(BaseRetriever):
+    """候補ビットマップに含まれるチャンクだけとコサイン類似度を計算するベクトル検索 Retriever"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    documents: List[Document]
+    vector_store: Any
+    metadata_index: Any
+    embeddings: Embeddings
+    where: Optional[Dict[str, Any]] = None
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.metadata_index.candidates(self.where) if self.where else None
+        results = self.vector_store.search(self.embeddings.embed_query(query), k=self.k, candidates=candidates)
+        return [self.documents[doc_id] for doc_id, _ in results]
+
+
+def create_prefiltered_retrievers(
+    documents: Sequence[Document],
+    embeddings: Embeddings,
+    preprocess_func: Callable[[str], List[str]],
+    where: Optional[Dict[str, Any]] = None,
+    k: int = 4,
+    vector_storage: str = "float32",
+    vector_store_dir: Optional[Path] = None,
+) -> Tuple[PrefilteredBM25Retriever, PrefilteredVectorRetriever]:
+    """
+    チャンクから MetadataIndex・BM25Index・ベクトルストアを作り、同じ条件で絞り込む2つの Retriever を返す
+
+    チャンク番号は3つの索引で共通です。埋め込みは embeddings.embed_documents で求めるため、
+    CachedEmbeddings を使えば取り込み時にキャッシュ済みのチャンクは再計算しません。
+
+    vector_storage に "int8" / "binary" を指定すると、MatrixVectorStore の代わりに
+    QuantizedVectorStore（メモリには圧縮コードだけを置く）を vector_store_dir に作ります。
+    """
+    documents = list(documents)
+    texts = [doc.page_content for doc in documents]
+    metadata_index = MetadataIndex(doc.metadata for doc in documents)
+    bm25 = BM25Index.from_tokens([preprocess_func(text) for text in texts])
+    vector_store = create_vector_store(
+        embeddings.embed_documents(texts) if texts else [], vector_storage, vector_store_dir
+    )
+    return (
+        PrefilteredBM25Retriever(
+            documents=documents, bm25=bm25, metadata_index=metadata_index,
+            preprocess_func=preprocess_func, where=where, k=k,
+        ),
+        PrefilteredVectorRetriever(
+            documents=documents, vector_store=vector_store, metadata_index=metadata_index,
+            embeddings=embeddings, where=where, k=k,
+        ),
+    )
+
+
+def benchmark_prefilter(
+    n_chunks: int = 200_000,
+    n_departments: int = 500,
+    n_queries: int = 50,
+    dim: int = 128,
+    k: int = 10,
+) -> List[Dict[str, float]]:
+    """
+    部署（department）のメタデータを付けた疑似コーパスで、絞り込みの厳しさごとの検索時間を計測する
+
+    部署はZipf分布で割り当てるため、チャンク数の多い部署・少ない部署が混在します。
+    条件なし（全件を採点して後から絞り込む場合と同じコスト）と、候補ビットマップで
+    事前に絞り込んだ場合の BM25・ベクトル検索の1クエリあたりの時間を比べます。
+
+    Returns:
+        条件ごとの {"filter", "selectivity", "bm25_ms", "vector_ms"}
+    """
+    # 疑似コーパスと疑似埋め込みはスケーリングベンチマークと共通
+    from japanese_tokenizer import Vocabulary, tokenize, tokenize_batch
+    from retrieval_benchmark import (
+        HashingEmbeddings,
+        generate_corpus,
+        generate_queries,
+        load_template_sentences,
+    )
+
+    rng = np.random.default_rng(0)
+    chunks = generate_corpus(n_chunks, load_template_sentences())
+    departments = np.minimum(rng.zipf(1.2, n_chunks), n_departments) - 1
+    index = MetadataIndex({"department": f"部署{d:04d}"} for d in departments)
+
+    queries = generate_queries(chunks, n_queries)
+    query_tokens = [tokenize(query) for query in queries]
+    vocabulary = Vocabulary()
+    bm25 = BM25Index.from_token_ids(tokenize_batch(chunks, vocabulary), vocabulary.ids)
+    embeddings = HashingEmbeddings(dim=dim)
+    store = MatrixVectorStore(embeddings.embed_array(chunks))
+    query_vectors = embeddings.embed_array(queries)
+
+    # 部署数の多い順に並べ、割合が 100% / 約10% / 約1% / 約0.1% に近い条件を選ぶ
+    values = index.values("department")
+    sizes = np.array([len(index.candidates({"department": value})) for value in values])
+    filters: List[Optional[Dict[str, Any]]] = [None]
+    for target in (0.1, 0.01, 0.001):
+        cumulative = np.cumsum(sizes[::-1]) / n_chunks  # 小さい部署から足していく
+        n_values = int(np.searchsorted(cumulative, target)) + 1
+        filters.append({"department": {"$in": values[::-1][:n_values]}})
+
+    rows = []
+    for where in filters:
+        start = time.perf_counter()
+        mask = index.bitmap(where) if where else None
+        candidates = index.candidates(where) if where else None
+        bitmap_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for tokens in query_tokens:
+            bm25.search(tokens, k, mask=mask, candidates=candidates)
+        bm25_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+        start = time.perf_counter()
+        for vector in query_vectors:
+            store.search(vector, k, candidates=candidates)
+        vector_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+        rows.append({
+            "filter": "条件なし" if where is None else f"{len(where['department']['$in'])}部署",
+            "selectivity": index.selectivity(where),
+            "bitmap_ms": bitmap_ms,
+            "bm25_ms": bm25_ms,
+            "vector_ms": vector_ms,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="メタデータによる事前絞り込みのベンチマーク")
+    parser.add_argument("--n", type=int, default=200_000, help="チャンク数")
+    parser.add_argument("--departments", type=int, default=500, help="部署数")
+    parser.add_argument("--queries", type=int, default=50, help="クエリ数")
+    args = parser.parse_args()
+
+    print(f"=== メタデータによる事前絞り込み（{args.n}チャンク・{args.departments}部署）===")
+    for row in benchmark_prefilter(args.n, args.departments, args.queries):
+        print(
+            f"  {row['filter']:<10} 候補 {row['selectivity'] * 100:6.2f}%  "
+            f"ビットマップ {row['bitmap_ms']:6.2f}ms  "
+            f"BM25 {row['bm25_ms']:7.3f}ms/クエリ  ベクトル {row['vector_ms']:7.3f}ms/クエリ"
+        )
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""
+文字位置（オフセット）で分割するテキストスプリッター
+
+RecursiveCharacterTextSplitter は区切り文字で分割した部分文字列を作り、
+長すぎる部分をさらに部分文字列にして再帰し、最後に連結・strip して新しい文字列を作ります。
+1つのチャンクになるまでに同じ文字が何度もコピーされます。
+
+OffsetTextSplitter は同じ手順を元の文字列への (開始位置, 終了位置) だけで行います。
+
+- 区切り文字の検索はコンパイル済みの正規表現に開始・終了位置を渡して行い、部分文字列を作らない
+- keep_separator=True（区切り文字を次の部分の先頭に付ける）では、連結した結果は元の文字列の連続した範囲になる
+  ため、結合は「最初の部分の開始位置から最後の部分の終了位置まで」で表せる
+- strip も前後の空白を読み飛ばして位置をずらすだけ
+- 文字列を作るのは split_text / split_documents で実際に必要になったときだけ
+
+チャンクの境界は RecursiveCharacterTextSplitter（keep_separator=True、区切り文字は正規表現でない文字列）と
+完全に一致するため、既存のインデックス・埋め込みキャッシュ・チャンクIDはそのまま使えます。
+複数の文書はプロセスプールで並列に分割できます（子プロセスから返すのは位置の配列だけ）。
+
+使用例:
+    splitter = OffsetTextSplitter(chunk_size=800, chunk_overlap=160,
+                                  separators=["\\n\\n", "\\n", "。", "、", " ", ""])
+    offsets = splitter.split_offsets(text)     # [(開始位置, 終了位置), ...]
+    chunks = splitter.split_documents(documents)
+
+ベンチマーク（APIキー不要）:
+    uv run python offset_splitter.py --repeat 2000
+"""
+
+import argparse
+import copy
+import re
+import time
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+
+from document_loader import batched, parallel_map
+
+Span = Tuple[int, int]
+
+
+class OffsetTextSplitter(TextSplitter):
+    """RecursiveCharacterTextSplitter と同じ境界のチャンクを、文字位置だけで求めるスプリッター"""
+
+    def __init__(
+        self,
+        separators: Optional[List[str]] = None,
+        chunk_size: int = 4000,
+        chunk_overlap: int = 200,
+        strip_whitespace: bool = True,
+        add_start_index: bool = False,
+        batch_size: int = 64,
+        max_workers: int = 4,
+        parallel_min_chars: int = 2_000_000,
+    ):
+        """
+        Args:
+            separators: 区切り文字（優先度の高い順、"" は1文字ずつ）
+            chunk_size: チャンクの最大文字数
+            chunk_overlap: 隣り合うチャンクの重なりの最大文字数
+            strip_whitespace: チャンクの前後の空白を取り除くか
+            add_start_index: メタデータに start_index（チャンクの開始位置）を付けるか
+            batch_size: 1回に子プロセスへ渡す文書数
+            max_workers: 並列数
+            parallel_min_chars: 合計文字数がこれ以上のときだけプロセスプールを使う
+        """
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            strip_whitespace=strip_whitespace,
+            add_start_index=add_start_index,
+        )
+        self._separators = separators or ["\n\n", "\n", " ", ""]
+        # "" は None（1文字ずつ分割）として持つ
+        self._patterns = tuple(re.compile(re.escape(s)) if s else None for s in self._separators)
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.parallel_min_chars = parallel_min_chars
+
+    def _pieces(self, text: str, start: int, end: int, pattern: Optional[re.Pattern]) -> List[Span]:
+        """範囲を区切り文字で分割する（区切り文字は次の部分の先頭に付ける）"""
+        if pattern is None:
+            return [(i, i + 1) for i in range(start, end)]
+        pieces: List[Span] = []
+        previous = start
+        for match in pattern.finditer(text, start, end):
+            if match.start() > previous:
+                pieces.append((previous, match.start()))
+            previous = match.start()
+        if end > previous:
+            pieces.append((previous, end))
+        return pieces
+
+    def _split(self, text: str, start: int, end: int, patterns: Sequence[Optional[re.Pattern]]) -> List[Span]:
+        """RecursiveCharacterTextSplitter._split_text と同じ手順を位置で行う"""
+        # 範囲内に現れる最初の区切り文字を選ぶ
+        pattern = patterns[-1]
+        remaining: Sequence[Optional[re.Pattern]] = ()
+        for i, candidate in enumerate(patterns):
+            if candidate is None:
+                pattern = None
+                break
+            if candidate.search(text, start, end):
+                pattern = candidate
+                remaining = patterns[i + 1:]
+                break
+
+        chunks: List[Span] = []
+        good: List[Span] = []
+        for piece in self._pieces(text, start, end, pattern):
+            if piece[1] - piece[0] < self._chunk_size:
+                good.append(piece)
+                continue
+            if good:
+                chunks.extend(self._merge(text, good))
+                good = []
+            if not remaining:
+                # これ以上分割できない部分はそのまま（strip もしない）
+                chunks.append(piece)
+            else:
+                chunks.extend(self._split(text, piece[0], piece[1], remaining))
+        if good:
+            chunks.extend(self._merge(text, good))
+        return chunks
+
+    def _merge(self, text: str, pieces: List[Span]) -> List[Span]:
+        """TextSplitter._merge_splits と同じ規則で、連続した部分を chunk_size 以下にまとめる"""
+        chunks: List[Span] = []
+        first = 0  # まとめ中の先頭の部分
+        total = 0
+        for i, (start, end) in enumerate(pieces):
+            length = end - start
+            if total + length > self._chunk_size:
+                if i > first:
+                    self._emit(text, pieces[first][0], pieces[i - 1][1], chunks)
+                    # 重なり（chunk_overlap）以下になるまで先頭の部分を外す
+                    while total > self._chunk_overlap or (
+                        total + length > self._chunk_size and total > 0
+                    ):
+                        total -= pieces[first][1] - pieces[first][0]
+                        first += 1
+            total += length
+        self._emit(text, pieces[first][0], pieces[-1][1], chunks)
+        return chunks
+
+    def _emit(self, text: str, start: int, end: int, chunks: List[Span]):
+        """前後の空白を除いた範囲を追加する（空になる場合は追加しない）"""
+        if self._strip_whitespace:
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+        if end > start:
+            chunks.append((start, end))
+
+    def split_offsets(self, text: str) -> List[Span]:
+        """テキストを分割し、各チャンクの (開始位置, 終了位置) を返す（文字列は作らない）"""
+        return self._split(text, 0, len(text), self._patterns)
+
+    def split_offsets_batch(
+        self, texts: Sequence[str], use_processes: Optional[bool] = None
+    ) -> List[List[Span]]:
+        """
+        複数のテキストをまとめて分割する
+
+        Args:
+            use_processes: プロセスプールを使うか（None なら合計文字数が parallel_min_chars 以上のときだけ）
+        """
+        if use_processes is None:
+            use_processes = (
+                len(texts) > self.batch_size and sum(map(len, texts)) >= self.parallel_min_chars
+            )
+        if not use_processes:
+            return [self.split_offsets(text) for text in texts]
+
+        offsets: List[List[Span]] = []
+        for _, future in parallel_map(
+            partial(_split_offsets_worker, self),
+            batched(texts, self.batch_size),
+            max_workers=self.max_workers,
+            max_in_flight=2 * self.max_workers,
+            use_processes=True,
+        ):
+            offsets.extend(future.result())
+        return offsets
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def create_documents(
+        self, texts: List[str], metadatas: Optional[List[Dict[Any, Any]]] = None
+    ) -> List[Document]:
+        """テキストを並列に分割し、チャンクの Document を作る（メタデータは文書ごとにコピー）"""
+        metadatas = metadatas or [{}] * len(texts)
+        documents = []
+        for text, metadata, offsets in zip(texts, metadatas, self.split_offsets_batch(texts)):
+            for start, end in offsets:
+                chunk_metadata = copy.deepcopy(metadata)
+                if self._add_start_index:
+                    chunk_metadata["start_index"] = start
+                documents.append(Document(page_content=text[start:end], metadata=chunk_metadata))
+        return documents
+
+
+def _split_offsets_worker(splitter: OffsetTextSplitter, texts: Sequence[str]) -> List[List[Span]]:
+    """子プロセス用: テキストのまとまりを分割し、位置だけを返す"""
+    return [splitter.split_offsets(text) for text in texts]
+
+
+def benchmark_splitters(
+    texts: Iterable[str],
+    chunk_size: int = 800,
+    chunk_overlap: int = 160,
+    separators: Optional[List[str]] = None,
+) -> List[Dict[str, float]]:
+    """
+    RecursiveCharacterTextSplitter と OffsetTextSplitter の分割時間を比較する（境界の一致も確認）
+
+    Returns:
+        方式ごとの {"name", "seconds", "chunks"}
+    """
+    texts = list(texts)
+    separators = separators or ["\n\n", "\n", "。", "、", " ", ""]
+    recursive = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=separators
+    )
+    offset = OffsetTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=separators
+    )
+
+    rows = []
+    start = time.perf_counter()
+    expected = [recursive.split_text(text) for text in texts]
+    rows.append({
+        "name": "RecursiveCharacterTextSplitter",
+        "seconds": time.perf_counter() - start,
+        "chunks": sum(map(len, expected)),
+    })
+
+    start = time.perf_counter()
+    offsets = offset.split_offsets_batch(texts, use_processes=False)
+    rows.append({
+        "name": "OffsetTextSplitter（位置のみ）",
+        "seconds": time.perf_counter() - start,
+        "chunks": sum(map(len, offsets)),
+    })
+
+    start = time.perf_counter()
+    actual = [offset.split_text(text) for text in texts]
+    rows.append({
+        "name": "OffsetTextSplitter（文字列）",
+        "seconds": time.perf_counter() - start,
+        "chunks": sum(map(len, actual)),
+    })
+    if actual != expected:
+        raise AssertionError("チャンクの境界が RecursiveCharacterTextSplitter と一致しません")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="オフセット方式のテキストスプリッターのベンチマーク")
+    parser.add_argument("--repeat", type=int, default=2000, help="サンプル文書を繰り返す回数")
+    args = parser.parse_args()
+
+    data_dir = Path(__file__).parent / "hybrid_sample_data"
+    samples = [path.read_text(encoding="utf-8") for path in sorted(data_dir.glob("*.txt"))]
+    corpora = {
+        # 通常の文書を多数分割する場合
+        "サンプル文書の繰り返し": samples * args.repeat,
+        # 区切り文字がなく、1文字ずつの分割まで再帰する最悪の場合
+        "区切り文字なし": [
+            re.sub(r"[\n。、 ]", "", sample) * (args.repeat // 4 or 1) for sample in samples
+        ],
+    }
+
+    for name, corpus in corpora.items():
+        print(f"=== {name}（{len(corpus)}文書・{sum(map(len, corpus))}文字）===")
+        for row in benchmark_splitters(corpus):
+            print(f"  {row['name']:<32} {row['seconds']:7.3f}秒  {row['chunks']}チャンク")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+永続化ディレクトリを使うベクトルストアのウォームスタート
+
+各デモは実行のたびに一時的な Chroma コレクションを作り、最後に delete_collection() します。
+環境変数 RAG_PERSIST_DIR を設定すると、コレクションをディスクに残し、
+コーパスが変わっていなければ次回起動時にそのまま開きます。
+
+- コレクション名にコーパスのバージョン（チャンク内容のハッシュ）を付けて管理
+- 構築が最後まで完了したコレクションだけを再利用（途中で中断したものは作り直す）
+- 古いバージョンのコレクションは新しいバージョンの構築後に削除
+- 起動から最初の検索までの時間を計測して表示
+
+使用例:
+    vectorstore, persistent = create_vectorstore(splits, embeddings, "faq_demo")
+    ...
+    if not persistent:
+        vectorstore.delete_collection()
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Tuple
+
+import chromadb
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from embedding_pipeline import build_chroma, ingest_documents
+
+PERSIST_DIR_ENV = "RAG_PERSIST_DIR"
+
+
+def persist_dir_from_env(name: str) -> Optional[Path]:
+    """RAG_PERSIST_DIR が設定されていれば、その下の name ディレクトリを返す"""
+    base = os.getenv(PERSIST_DIR_ENV)
+    return Path(base) / name if base else None
+
+
+def corpus_version(documents: Sequence[Document]) -> str:
+    """チャンクの本文とメタデータから計算するコーパスのバージョン"""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(json.dumps(doc.metadata, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def open_or_build_chroma(
+    documents: Sequence[Document],
+    embeddings: Embeddings,
+    collection_name: str,
+    persist_dir: Path,
+    **ingest_kwargs,
+) -> Tuple[Chroma, bool]:
+    """
+    バージョンが一致する構築済みコレクションがあれば開き、なければ構築する
+
+    Returns:
+        (ベクトルストア, 既存のコレクションを再利用したか)
+    """
+    version = corpus_version(documents)
+    versioned_name = f"{collection_name}-{version[:12]}"
+    client = chromadb.PersistentClient(path=str(persist_dir))
+    existing = {collection.name: collection for collection in client.list_collections()}
+
+    collection = existing.get(versioned_name)
+    if collection is not None and (collection.metadata or {}).get("complete"):
+        vectorstore = Chroma(client=client, collection_name=versioned_name, embedding_function=embeddings)
+        return vectorstore, True
+
+    # 中断した構築の残りがあれば削除してから作り直す
+    if collection is not None:
+        client.delete_collection(versioned_name)
+    vectorstore = Chroma(
+        client=client,
+        collection_name=versioned_name,
+        embedding_function=embeddings,
+        collection_metadata={"corpus_version": version},
+    )
+    ingest_documents(documents, embeddings, vectorstore, **ingest_kwargs)
+    vectorstore._collection.modify(metadata={"corpus_version": version, "complete": True})
+
+    # 同じ名前の古いバージョンを削除
+    for name in existing:
+        if name.startswith(f"{collection_name}-") and name != versioned_name:
+            client.delete_collection(name)
+    return vectorstore, False
+
+
+def create_vectorstore(
+    documents: Iterable[Document],
+    embeddings: Embeddings,
+    collection_name: str,
+) -> Tuple[Chroma, bool]:
+    """
+    RAG_PERSIST_DIR の有無に応じて、永続化モードか一時コレクションでベクトルストアを用意する
+
+    一時コレクションでは documents（ジェネレータでもよい）を少しずつ取り込みます。
+    永続化モードではコーパスのバージョンを先に計算するため、全件をリストにします。
+
+    Returns:
+        (ベクトルストア, 永続化モードか)  永続化モードでは delete_collection() しないこと
+    """
+    persist_dir = persist_dir_from_env(collection_name)
+    if persist_dir is None:
+        return build_chroma(documents, embeddings, collection_name=collection_name), False
+
+    vectorstore, reused = open_or_build_chroma(list(documents), embeddings, collection_name, persist_dir)
+    status = "既存のコレクションを再利用" if reused else "コレクションを構築して保存"
+    print(f"  - 永続化モード: {status}（{persist_dir}）")
+    return vectorstore, True
+
+
+def process_start_time() -> Optional[float]:
+    """
+    このプロセスの起動時刻（UNIX時間）
+
+    Linux の /proc/self/stat の starttime（システム起動からのクロック数）と
+    CLOCK_BOOTTIME（システム起動からの経過時間）の差からプロセスの経過時間を求め、現在時刻から引きます。
+    （/proc/stat の btime は秒単位に切り捨てられているため使わない）
+    /proc や CLOCK_BOOTTIME がない環境では None を返します。
+    """
+    try:
+        with open("/proc/self/stat", encoding="utf-8") as f:
+            # 2番目の項目（コマンド名）は空白や括弧を含みうるため、最後の ")" より後を分割する
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])  # 22番目の項目 starttime（起動からのクロック数）
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.time() - age
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupLatency:
+    """
+    プロセス起動から最初の検索結果が得られるまでの時間を計測
+
+    LangChain・Chroma などの重いライブラリの読み込みも含めるため、プロセスの起動時刻から計測します。
+    起動時刻が分からない環境では、このモジュールを読み込んだ時点から計測し、表示でそれを明示します。
+    """
+
+    def __init__(self):
+        started = process_start_time()
+        self.from_process_start = started is not None
+        self.started = started if started is not None else time.time()
+        self.reported = False
+
+    def report_first_query(self, mode: str):
+        """最初の検索の直後に1回だけ表示"""
+        if self.reported:
+            return
+        self.reported = True
+        origin = "プロセス起動" if self.from_process_start else "persistent_store の読み込み"
+        print(f"⏱ {origin}から最初の検索まで: {time.time() - self.started:.2f}秒（{mode}）")
+
+
+startup_latency = StartupLatency()
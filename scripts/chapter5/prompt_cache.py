@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+プロンプトキャッシュを効かせるプロンプトの並びと、キャッシュ済みトークンの集計
+
+OpenAI の API は、直前のリクエストと先頭から一致する部分（1024トークン以上）をキャッシュし、
+その部分の入力トークンを割引価格で課金します（usage.prompt_tokens_details.cached_tokens）。
+先頭に {context} や {question} のような毎回変わる部分があると、共有できる先頭部分がなくなります。
+
+- 固定の指示（回答ルール・出典の書き方）を system メッセージとして先頭に置き、
+  参考文書 → 質問の順に変わりやすいものほど後ろに置く
+  （同じ参考文書を使う質問が続くと、指示と参考文書までが共有できる先頭部分になる）
+- PromptCacheUsage を LLM のコールバックに渡すと、呼び出しごとの入力・キャッシュ済み・出力トークンを記録し、
+  キャッシュのヒット率と節約額を集計する
+
+使用例:
+    usage = PromptCacheUsage()
+    llm = ChatOpenAI(model="gpt-5-nano", callbacks=[usage], stream_usage=True)
+    chain = create_cache_friendly_prompt(RULES) | llm | StrOutputParser()
+    ...
+    print(usage.summary())
+"""
+
+import threading
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.prompts import ChatPromptTemplate
+
+# モデル価格（100万トークンあたりのドル、in_cached はキャッシュ済みの入力トークン）
+# chapter3/3-7-3_cost_monitor.py の MODEL_PRICES と同じ値（あちらは読み込むと API クライアントを作るため複製）
+MODEL_PRICES = {
+    "gpt-4o-mini": {"in": 0.15, "in_cached": 0.075, "out": 0.6},
+    "gpt-5-nano": {"in": 0.05, "in_cached": 0.005, "out": 0.4},
+}
+
+# 可変部分（参考文書 → 質問の順に後ろへ置く）
+VARIABLE_TEMPLATE = """=== 参考文書 ===
+{context}
+
+=== 質問 ===
+{question}"""
+
+
+def create_cache_friendly_prompt(instructions: str) -> ChatPromptTemplate:
+    """固定の指示を先頭の system メッセージに、参考文書と質問を最後の human メッセージに置くプロンプト"""
+    return ChatPromptTemplate.from_messages([
+        ("system", instructions),
+        ("human", VARIABLE_TEMPLATE),
+    ])
+
+
+class PromptCacheUsage(BaseCallbackHandler):
+    """LLM の呼び出しごとのトークン数（うちキャッシュ済みの入力）を記録し、コストと節約額を集計する"""
+
+    def __init__(self, model: str = "gpt-5-nano"):
+        """
+        Args:
+            model: 価格の計算に使うモデル名（MODEL_PRICES のキー）
+        """
+        self.model = model
+        self.calls: List[Dict[str, int]] = []
+        self._lock = threading.Lock()
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = self._usage(generation, response.llm_output)
+                if usage is not None:
+                    with self._lock:
+                        self.calls.append(usage)
+
+    @staticmethod
+    def _usage(generation: Any, llm_output: Optional[Dict[str, Any]]) -> Optional[Dict[str, int]]:
+        """生成結果から入力・キャッシュ済み・出力のトークン数を取り出す"""
+        message = getattr(generation, "message", None)
+        metadata = getattr(message, "usage_metadata", None)
+        if metadata:
+            return {
+                "prompt_tokens": metadata.get("input_tokens", 0),
+                "cached_tokens": (metadata.get("input_token_details") or {}).get("cache_read") or 0,
+                "completion_tokens": metadata.get("output_tokens", 0),
+            }
+        # usage_metadata がない場合は API の usage（prompt_tokens_details.cached_tokens）を使う
+        token_usage = (llm_output or {}).get("token_usage")
+        if not token_usage:
+            return None
+        return {
+            "prompt_tokens": token_usage.get("prompt_tokens", 0),
+            "cached_tokens": (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0,
+            "completion_tokens": token_usage.get("completion_tokens", 0),
+        }
+
+    def totals(self) -> Dict[str, float]:
+        """
+        トークン数・ヒット率・コスト・節約額の合計
+
+        prompt_tokens はキャッシュ済みのトークンを含むため、キャッシュ済みの分だけを割引価格で計算します。
+        """
+        with self._lock:
+            calls = list(self.calls)
+        prices = MODEL_PRICES[self.model]
+        prompt = sum(call["prompt_tokens"] for call in calls)
+        cached = sum(call["cached_tokens"] for call in calls)
+        completion = sum(call["completion_tokens"] for call in calls)
+        cost = ((prompt - cached) * prices["in"] + cached * prices["in_cached"]
+                + completion * prices["out"]) / 1_000_000
+        savings = cached * (prices["in"] - prices["in_cached"]) / 1_000_000
+        return {
+            "calls": len(calls),
+            "prompt_tokens": prompt,
+            "cached_tokens": cached,
+            "completion_tokens": completion,
+            "hit_ratio": cached / prompt if prompt else 0.0,
+            "cost": cost,
+            "savings": savings,
+        }
+
+    def summary(self) -> str:
+        """キャッシュのヒット率と節約額を表示用の文字列で返す"""
+        totals = self.totals()
+        if not totals["calls"]:
+            return "プロンプトキャッシュ: 使用量の記録はありません"
+        return (
+            f"プロンプトキャッシュ（{self.model}・{totals['calls']}回）: 入力 {totals['prompt_tokens']}トークン"
+            f"（うちキャッシュ済み {totals['cached_tokens']}トークン・ヒット率 {totals['hit_ratio']:.1%}） / "
+            f"出力 {totals['completion_tokens']}トークン / コスト ${totals['cost']:.6f}"
+            f"（キャッシュによる節約 ${totals['savings']:.6f}）"
+        )
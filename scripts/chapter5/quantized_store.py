@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+量子化した埋め込みによる省メモリなベクトル検索（ディスク上の float32 で再スコアリング）
+
+1536次元の float32 ベクトルは1件あたり6KB、100万チャンクで約6GBのメモリを使います。
+QuantizedVectorStore はメモリには圧縮したコードだけを置き、次の2段階で検索します。
+
+1. 圧縮コードで全件の近似スコアを計算し、上位 k × oversample 件の候補を選ぶ
+2. 候補だけをディスク上の正規化済み float32 ベクトル（メモリマップ）から読み、厳密なコサイン類似度で並べ直す
+
+圧縮方式:
+    "int8"    次元ごとの最大絶対値で int8 に量子化（1件 1536バイト、float32 の1/4）
+    "binary"  各次元の符号だけを1ビットで保持し、ハミング距離で近似（1件 192バイト、1/32）
+
+ファイル構成:
+    vectors.f32  正規化済みの float32 ベクトル（再スコアリング用、ディスクに置いたまま使う）
+    codes.bin    圧縮コード（起動時にメモリへ読み込む）
+    meta.json    圧縮方式・次元数・int8 のスケール
+
+使用例:
+    store = QuantizedVectorStore(".cache/quantized", mode="int8")
+    store.add(embeddings.embed_documents(texts))
+    results = store.search(embeddings.embed_query(query), k=4)
+
+    # metadata_index.create_prefiltered_retrievers などで MatrixVectorStore の代わりに使う
+    store = create_vector_store(embeddings.embed_documents(texts), storage="int8")
+
+ベンチマーク（疑似ベクトル、APIキー不要）:
+    uv run python quantized_store.py --n 100000 --dim 1536
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from vector_store import ArrayLike, MatrixVectorStore, normalize, top_k
+
+QUANTIZATION_MODES = ("int8", "binary")
+
+
+class QuantizedVectorStore:
+    """圧縮コードで候補を絞り、ディスク上の float32 ベクトルで再スコアリングする全件検索"""
+
+    def __init__(
+        self,
+        path: Path,
+        mode: str = "int8",
+        oversample: int = 10,
+        doc_block_size: int = 65536,
+    ):
+        """
+        Args:
+            path: 保存先ディレクトリ（既存のストアがあれば開く）
+            mode: 圧縮方式（"int8" または "binary"）
+            oversample: 再スコアリングする候補数の倍率（候補数 = k × oversample）
+            doc_block_size: 1回にスコアを計算する文書数
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"mode は {QUANTIZATION_MODES} のいずれかを指定してください")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.oversample = oversample
+        self.doc_block_size = doc_block_size
+
+        self.dim = 0
+        self.scale: Optional[np.ndarray] = None
+        self.codes = np.empty((0, 0), dtype=np.uint8)
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self._load()
+
+    def _load(self):
+        meta_path = self.path / "meta.json"
+        if not meta_path.exists():
+            return
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta["mode"] != self.mode:
+            raise ValueError(f"保存済みのストアは {meta['mode']} 形式です")
+        self.dim = meta["dim"]
+        if meta.get("scale") is not None:
+            self.scale = np.asarray(meta["scale"], dtype=np.float32)
+        code_width = self._code_width()
+        n_rows = min(
+            (self.path / "codes.bin").stat().st_size // code_width,
+            (self.path / "vectors.f32").stat().st_size // (4 * self.dim),
+        )
+        self.codes = np.fromfile(
+            self.path / "codes.bin", dtype=self._code_dtype(), count=n_rows * code_width
+        ).reshape(n_rows, code_width)
+        self._map(n_rows)
+
+    def _map(self, n_rows: int):
+        if n_rows:
+            self.vectors = np.memmap(
+                self.path / "vectors.f32", dtype=np.float32, mode="r", shape=(n_rows, self.dim)
+            )
+
+    def _code_dtype(self) -> type:
+        return np.int8 if self.mode == "int8" else np.uint8
+
+    def _code_width(self) -> int:
+        return self.dim if self.mode == "int8" else (self.dim + 7) // 8
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """メモリに置く圧縮コードのサイズ（バイト）"""
+        return self.codes.nbytes
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """正規化済みベクトルを圧縮コードに変換"""
+        if self.mode == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        return np.clip(np.rint(vectors / self.scale * 127), -127, 127).astype(np.int8)
+
+    def add(self, vectors: ArrayLike) -> range:
+        """ベクトルを正規化して追加し、割り当てた文書番号を返す"""
+        matrix = normalize(vectors)
+        if not len(self):
+            self.dim = matrix.shape[1]
+            if self.mode == "int8":
+                # 最初に追加したベクトルから次元ごとのスケールを決める（以降の追加ははみ出た分を丸める）
+                self.scale = np.maximum(np.abs(matrix).max(axis=0), 1e-6)
+            (self.path / "meta.json").write_text(
+                json.dumps({
+                    "mode": self.mode,
+                    "dim": self.dim,
+                    "scale": None if self.scale is None else self.scale.tolist(),
+                }),
+                encoding="utf-8",
+            )
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"次元数が一致しません: {matrix.shape[1]} != {self.dim}")
+
+        start = len(self)
+        codes = self.encode(matrix)
+        with open(self.path / "vectors.f32", "ab") as f:
+            f.truncate(start * 4 * self.dim)
+            matrix.tofile(f)
+        with open(self.path / "codes.bin", "ab") as f:
+            f.truncate(start * codes.shape[1])
+            codes.tofile(f)
+        self.codes = np.concatenate([self.codes, codes]) if start else codes
+        self._map(len(self))
+        return range(start, len(self))
+
+    def approximate_scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        正規化済みクエリに対する、圧縮コード上の近似スコア（クエリ数, 文書数）大きいほど近い
+
+        rows を指定すると、その文書番号の行だけのスコア（クエリ数, len(rows)）を返します。
+        """
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        if not len(codes):
+            # 空のストアにはスケールがまだない（MatrixVectorStore と同じく (クエリ数, 0) を返す）
+            return scores
+        if self.mode == "int8":
+            # x ≈ code × scale / 127 なので、スケールをクエリ側に掛けて内積を取る
+            scaled_queries = queries * (self.scale / 127)
+        else:
+            query_codes = np.packbits(queries > 0, axis=1)
+        for start in range(0, len(codes), self.doc_block_size):
+            block = codes[start:start + self.doc_block_size]
+            end = start + len(block)
+            if self.mode == "int8":
+                # ブロックごとに float32 へ戻し、全クエリ分を行列積1回で計算する
+                scores[:, start:end] = scaled_queries @ block.astype(np.float32).T
+            else:
+                # 符号が一致しないビット数（ハミング距離）が小さいほど近い
+                for row, query_code in enumerate(query_codes):
+                    scores[row, start:end] = -np.bitwise_count(block ^ query_code).sum(axis=1, dtype=np.int32)
+        return scores
+
+    def search_batch(
+        self,
+        queries: ArrayLike,
+        k: int = 4,
+        candidates: Optional[np.ndarray] = None,
+        query_block_size: int = 64,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        複数クエリの上位k件を検索（圧縮コードで候補を選び、float32 で再スコアリング）
+
+        Args:
+            candidates: 検索対象にする文書番号の配列（None なら全文書）。
+                MatrixVectorStore.search_batch と同じく、候補の行だけを採点します
+
+        Returns:
+            (文書番号, 類似度)  いずれも (クエリ数, k) の配列
+        """
+        rows = None if candidates is None else np.asarray(candidates, dtype=np.int64)
+        query_matrix = normalize(queries)
+        k = min(k, len(self) if rows is None else len(rows))
+        indices = np.empty((len(query_matrix), k), dtype=np.int64)
+        scores = np.empty((len(query_matrix), k), dtype=np.float32)
+        if k == 0:
+            return indices, scores
+        for block_start in range(0, len(query_matrix), query_block_size):
+            block = query_matrix[block_start:block_start + query_block_size]
+            shortlists, _ = top_k(self.approximate_scores(block, rows), k * self.oversample)
+            for offset, (query, shortlist) in enumerate(zip(block, shortlists)):
+                # 候補の行を番号順に読むと、ディスク上の読み込みが前から順になる
+                shortlist = np.sort(shortlist if rows is None else rows[shortlist])
+                exact = np.asarray(self.vectors[shortlist]) @ query
+                best, best_scores = top_k(exact[None, :], k)
+                indices[block_start + offset] = shortlist[best[0]]
+                scores[block_start + offset] = best_scores[0]
+        return indices, scores
+
+    def search(
+        self, query: Sequence[float], k: int = 4, candidates: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """1件のクエリで上位k件を検索し、(文書番号, 類似度) のリストを返す"""
+        indices, scores = self.search_batch([query], k, candidates=candidates)
+        return [(int(i), float(score)) for i, score in zip(indices[0], scores[0])]
+
+    @classmethod
+    def from_vectors(
+        cls, path: Path, vectors: ArrayLike, mode: str = "int8", oversample: int = 10
+    ) -> "QuantizedVectorStore":
+        """保存先の既存のストアを消してから、ベクトルを追加したストアを作る"""
+        for name in ("meta.json", "codes.bin", "vectors.f32"):
+            (Path(path) / name).unlink(missing_ok=True)
+        store = cls(path, mode=mode, oversample=oversample)
+        if len(vectors):
+            store.add(vectors)
+        return store
+
+
+def create_vector_store(
+    vectors: ArrayLike,
+    storage: str = "float32",
+    path: Optional[Path] = None,
+) -> Union[MatrixVectorStore, QuantizedVectorStore]:
+    """
+    埋め込み行列から全件検索用のストアを作る
+
+    Args:
+        vectors: 文書の埋め込み（文書数, 次元数）
+        storage: "float32"（MatrixVectorStore）または QUANTIZATION_MODES のいずれか
+        path: 量子化ストアの保存先（None なら一時ディレクトリ。ストアが使われなくなると削除）
+    """
+    if storage == "float32":
+        return MatrixVectorStore(vectors) if len(vectors) else MatrixVectorStore()
+    if storage not in QUANTIZATION_MODES:
+        raise ValueError(f"storage は float32 または {QUANTIZATION_MODES} のいずれかを指定してください")
+    if path is not None:
+        return QuantizedVectorStore.from_vectors(path, vectors, mode=storage)
+    tmp_dir = tempfile.TemporaryDirectory(prefix=f"quantized_{storage}_")
+    store = QuantizedVectorStore.from_vectors(Path(tmp_dir.name), vectors, mode=storage)
+    store._tmp_dir = tmp_dir  # ストアと同じ寿命で一時ディレクトリを残す
+    return store
+
+
+def benchmark_quantization(
+    path: Path,
+    n_vectors: int = 100_000,
+    dim: int = 1536,
+    n_queries: int = 100,
+    k: int = 10,
+    oversample: int = 10,
+) -> List[Dict[str, float]]:
+    """
+    疑似ベクトルで厳密検索（float32）と量子化ストアのメモリ・QPS・recall@k を比較する
+
+    Returns:
+        方式ごとの {"mode", "bytes_per_million", "qps", "recall"}
+    """
+    rng = np.random.default_rng(0)
+    # 埋め込みに近い分布にするため、クラスタの中心の周りにベクトルを散らす
+    centers = rng.standard_normal((max(n_vectors // 100, 1), dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, len(centers), n_vectors)]
+    vectors += rng.standard_normal((n_vectors, dim), dtype=np.float32)
+    queries = centers[rng.integers(0, len(centers), n_queries)]
+    queries += rng.standard_normal((n_queries, dim), dtype=np.float32)
+
+    exact_store = MatrixVectorStore(vectors)
+    start = time.perf_counter()
+    ground_truth, _ = exact_store.search_batch(queries, k)
+    exact_seconds = time.perf_counter() - start
+    rows = [{
+        "mode": "float32",
+        "bytes_per_million": exact_store.nbytes / n_vectors * 1_000_000,
+        "qps": n_queries / exact_seconds,
+        "recall": 1.0,
+    }]
+    del exact_store
+
+    for mode in QUANTIZATION_MODES:
+        store = QuantizedVectorStore.from_vectors(Path(path) / mode, vectors, mode=mode, oversample=oversample)
+        start = time.perf_counter()
+        found, _ = store.search_batch(queries, k)
+        seconds = time.perf_counter() - start
+        hits = sum(len(set(a) & set(b)) for a, b in zip(found, ground_truth))
+        rows.append({
+            "mode": mode,
+            "bytes_per_million": store.nbytes / n_vectors * 1_000_000,
+            "qps": n_queries / seconds,
+            "recall": hits / ground_truth.size,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="量子化ベクトルストアのベンチマーク")
+    parser.add_argument("--n", type=int, default=100_000, help="文書ベクトルの件数")
+    parser.add_argument("--dim", type=int, default=1536, help="次元数")
+    parser.add_argument("--queries", type=int, default=100, help="クエリ数")
+    parser.add_argument("--k", type=int, default=10, help="recall@k の k")
+    parser.add_argument("--oversample", type=int, default=10, help="再スコアリングする候補数の倍率")
+    args = parser.parse_args()
+
+    cache_dir = Path(__file__).parent / ".cache" / "quantized_benchmark"
+    print(f"=== 量子化ベクトルストアのベンチマーク（{args.n}件・{args.dim}次元）===")
+    for row in benchmark_quantization(
+        cache_dir, args.n, args.dim, args.queries, args.k, args.oversample
+    ):
+        print(
+            f"  {row['mode']:<8} メモリ: {row['bytes_per_million'] / 1024 ** 3:6.2f}GB/100万件  "
+            f"QPS: {row['qps']:8.1f}  recall@{args.k}: {row['recall']:.3f}"
+        )
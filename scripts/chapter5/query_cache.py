@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+検索結果のセマンティックキャッシュ（クエリの完全一致＋埋め込みの類似度）
+
+エージェントは1回の実行の中でも、実行をまたいでも、ほぼ同じ質問で何度も社内検索を呼びます。
+SemanticQueryCache は検索結果を次の順で再利用します。
+
+1. 正規化したクエリ（NFKC・大文字小文字・空白・末尾の句読点をそろえたもの）の完全一致
+2. クエリ埋め込みのコサイン類似度がしきい値以上のキャッシュ済みクエリ（言い回しの違い）
+
+- 件数の上限を超えたら、最も長く使われていないものから捨てる（LRU）
+- 保存から ttl_seconds を過ぎたものは使わない（TTL）
+- 検索対象のバージョン（コーパスのハッシュなど）が変わったら、すべて捨てる
+
+保存形式:
+    entries.json  バージョンとエントリ（正規化したクエリ・名前空間・結果・保存時刻）をLRUの順に並べたもの
+    vectors.npy   各エントリのクエリ埋め込み（正規化済み、entries.json と同じ順）
+
+使用例:
+    cache = SemanticQueryCache(embeddings, DEFAULT_CACHE_DIR / "corp_search", version=corpus_version)
+    results = cache.get(query, namespace="top_k=3")
+    if results is None:
+        results = search(query)
+        cache.put(query, results, namespace="top_k=3")
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from vector_store import normalize
+
+DEFAULT_CACHE_DIR = Path(__file__).parent / ".cache" / "query_cache"
+
+# 末尾の句読点・疑問符は意味を変えないものとして取り除く
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.。、，,．]+$")
+
+
+def normalize_query(query: str) -> str:
+    """表記ゆれ（全角半角・大文字小文字・空白・末尾の句読点）をそろえたクエリ"""
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = re.sub(r"\s+", " ", text).strip()
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+class SemanticQueryCache:
+    """正規化したクエリの完全一致と、クエリ埋め込みの類似度で検索結果を再利用するキャッシュ"""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        path: Optional[Path] = None,
+        version: str = "",
+        threshold: float = 0.95,
+        max_entries: int = 512,
+        ttl_seconds: float = 24 * 3600,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            embeddings: クエリの埋め込みに使うモデル（CachedEmbeddings なら同じクエリは再計算しない）
+            path: 保存先ディレクトリ（None ならメモリ上だけで使う）
+            version: 検索対象のバージョン（保存済みのものと異なれば、読み込んだエントリを捨てる）
+            threshold: 近いクエリとみなすコサイン類似度の下限
+            max_entries: 保持するエントリ数の上限
+            ttl_seconds: エントリの有効期間（秒）
+        """
+        self.embeddings = embeddings
+        self.path = Path(path) if path is not None else None
+        self.version = version
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+
+        # キー（名前空間 + 正規化したクエリ）→ エントリ。末尾ほど最近使われたもの
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None  # エントリ順に並べたクエリ埋め込み（遅延構築）
+        self._last: Optional[Tuple[str, np.ndarray]] = None  # 直前に埋め込んだ (クエリ, ベクトル)
+        self._load()
+
+    @staticmethod
+    def _key(normalized: str, namespace: str) -> str:
+        return f"{namespace}\0{normalized}"
+
+    def _load(self):
+        if self.path is None or not (self.path / "entries.json").exists():
+            return
+        data = json.loads((self.path / "entries.json").read_text(encoding="utf-8"))
+        if data["version"] != self.version:
+            # 検索対象が変わっているため、保存済みの結果は使わない
+            self.invalidations += 1
+            return
+        vectors = np.load(self.path / "vectors.npy")
+        for entry, vector in zip(data["entries"], vectors):
+            entry["vector"] = vector
+            self.entries[self._key(entry["query"], entry["namespace"])] = entry
+        self._drop_expired()
+
+    def save(self):
+        """エントリを書き出す（一時ファイル経由で置き換え）"""
+        if self.path is None:
+            return
+        with self._lock:
+            entries = list(self.entries.values())
+            self.path.mkdir(parents=True, exist_ok=True)
+            vectors = (
+                np.stack([entry["vector"] for entry in entries])
+                if entries else np.empty((0, 0), dtype=np.float32)
+            )
+            with open(self.path / "vectors.npy.tmp", "wb") as f:
+                np.save(f, vectors)
+            (self.path / "entries.json.tmp").write_text(
+                json.dumps({
+                    "version": self.version,
+                    "entries": [
+                        {key: value for key, value in entry.items() if key != "vector"}
+                        for entry in entries
+                    ],
+                }, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            # ベクトルを先に置き換える（entries.json の件数が多い状態にはならない）
+            os.replace(self.path / "vectors.npy.tmp", self.path / "vectors.npy")
+            os.replace(self.path / "entries.json.tmp", self.path / "entries.json")
+
+    def set_version(self, version: str):
+        """検索対象のバージョンを更新する（変わった場合はすべてのエントリを捨てる）"""
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            if self.entries:
+                self.entries.clear()
+                self._matrix = None
+                self.invalidations += 1
+
+    def _embed(self, query: str) -> np.ndarray:
+        """
+        クエリの正規化した埋め込み（直前と同じクエリなら再計算しない）
+
+        検索そのものと同じ元のクエリを埋め込むため、CachedEmbeddings を使えば
+        キャッシュの照合と検索で埋め込みAPIの呼び出しは1回で済みます。
+        """
+        last = self._last
+        if last is not None and last[0] == query:
+            return last[1]
+        vector = normalize(self.embeddings.embed_query(query))[0]
+        self._last = (query, vector)
+        return vector
+
+    def _drop_expired(self):
+        now = self.clock()
+        expired = [
+            key for key, entry in self.entries.items()
+            if now - entry["created"] > self.ttl_seconds
+        ]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self._matrix = None
+
+    def get(self, query: str, namespace: str = "") -> Optional[Any]:
+        """
+        キャッシュ済みの検索結果を返す（なければ None）
+
+        Args:
+            query: 検索クエリ
+            namespace: 検索条件（件数など）ごとの区別。異なる名前空間の結果は使わない
+        """
+        normalized = normalize_query(query)
+        key = self._key(normalized, namespace)
+        with self._lock:
+            self._drop_expired()
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["value"]
+            if not self.entries:
+                self.misses += 1
+                return None
+
+        # 完全一致しなければ、埋め込みが最も近いキャッシュ済みクエリを探す
+        vector = self._embed(query)
+        with self._lock:
+            if not self.entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix = np.stack([entry["vector"] for entry in self.entries.values()])
+            similarities = self._matrix @ vector
+            keys = list(self.entries)
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.threshold:
+                    break
+                entry = self.entries[keys[i]]
+                if entry["namespace"] == namespace:
+                    self.entries.move_to_end(keys[i])
+                    self._matrix = None
+                    self.semantic_hits += 1
+                    return entry["value"]
+            self.misses += 1
+            return None
+
+    def put(self, query: str, value: Any, namespace: str = ""):
+        """検索結果を保存する（value は JSON にできる値）"""
+        normalized = normalize_query(query)
+        vector = self._embed(query)
+        with self._lock:
+            self.entries[self._key(normalized, namespace)] = {
+                "query": normalized,
+                "namespace": namespace,
+                "value": value,
+                "created": self.clock(),
+                "vector": vector,
+            }
+            self.entries.move_to_end(self._key(normalized, namespace))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self) -> str:
+        """キャッシュの利用状況を表示用の文字列で返す"""
+        return (
+            f"クエリキャッシュ: 完全一致 {self.exact_hits}件 / 類似クエリ {self.semantic_hits}件 / "
+            f"ミス {self.misses}件（保存済み {len(self.entries)}件）"
+        )
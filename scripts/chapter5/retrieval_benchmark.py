@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+"""
+検索方式のスケーリングベンチマーク（BM25・ベクトル検索・ハイブリッド、10〜100万チャンク）
+
+各デモは数件〜10件の手書き文書で動かすため、文書数が増えたときの構築時間・メモリ・待ち時間はわかりません。
+このモジュールは hybrid_sample_data と company_docs の文を組み合わせて日本語の疑似コーパスを作り、
+文書数を変えながら次の方式を同じクエリで比較します（APIキー不要・乱数シード固定で再現可能）。
+
+- BM25: BM25Retriever（rank_bm25）と BM25Index（ベクトル化BM25）
+- ベクトル検索: 全件検索（MatrixVectorStore）・Chroma（HNSW）・FAISS（Flat / IVF / HNSW / IVF+PQ）
+- ハイブリッド: BM25Index と近似ベクトル検索の順位を重み付きRRFで融合（HybridRetriever と同じ式）
+
+埋め込みは HashingEmbeddings（トークンをハッシュで次元に割り当てる決定的な疑似埋め込み）を使います。
+語の重なる文書ほど類似度が高くなるため、ランダムなベクトルと違って検索結果に意味があります。
+
+計測する値:
+    構築時間   インデックスの構築（埋め込みの計算は除く、BM25はトークナイズを含む）
+    サイズ     インデックスのバイト数（Chroma は永続化ディレクトリのサイズ）
+    p50 / p99  1クエリずつ検索したときの待ち時間
+    QPS        全クエリをまとめて検索したときの1秒あたりのクエリ数（まとめて検索できない方式は逐次）
+    recall@k   同じ種類の厳密検索（BM25: 全文書の採点、ベクトル: 全件のコサイン類似度、
+               ハイブリッド: 両者の厳密な順位の融合）の上位k件のうち、見つかった割合
+               （k位と同点の文書はどれを返しても正解とする）
+
+使用例:
+    uv run python retrieval_benchmark.py
+    uv run python retrieval_benchmark.py --sizes 10 1000 100000 1000000 --max-chroma 100000
+"""
+
+import argparse
+import hashlib
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import chromadb
+import faiss
+import numpy as np
+from langchain_community.retrievers import BM25Retriever
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+
+from bm25_index import BM25Index
+from faiss_index import build_index, index_memory_bytes, search_param_name, suggest_factories
+from front_matter import split_front_matter
+from japanese_tokenizer import Vocabulary, tokenize, tokenize_batch
+from vector_store import MatrixVectorStore, normalize
+
+BASE_DIR = Path(__file__).parent
+TEMPLATE_DIRS = (BASE_DIR / "hybrid_sample_data", BASE_DIR / "company_docs")
+DEFAULT_WORK_DIR = BASE_DIR / ".cache" / "retrieval_benchmark"
+DEFAULT_SIZES = (10, 100, 1_000, 10_000, 100_000)
+
+# 近似インデックスの検索パラメータ（IVF: nprobe, HNSW: efSearch）
+DEFAULT_SEARCH_PARAMS = {"nprobe": 16, "efSearch": 64}
+
+# 文を区切る位置（句点の直後・改行）
+_SENTENCE_END = re.compile(r"(?<=。)|\n")
+_NUMBER = re.compile(r"[0-9]+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    トークンをハッシュで次元と符号に割り当てる決定的な疑似埋め込み（特徴ハッシング）
+
+    japanese_tokenizer.tokenize のトークンごとに、blake2b のハッシュで次元と ±1 を決めて
+    (1 + log 出現回数) を加算し、長さ1に正規化します。同じテキストは常に同じベクトルになり、
+    トークンの重なりが大きいテキストほどコサイン類似度が高くなります。
+    """
+
+    def __init__(self, dim: int = 128, seed: int = 0, block_size: int = 65536):
+        """
+        Args:
+            dim: 次元数
+            seed: ハッシュの鍵（変えると別の埋め込み空間になる）
+            block_size: 1回にまとめてベクトル化するテキスト数
+        """
+        self.dim = dim
+        self.block_size = block_size
+        self._key = seed.to_bytes(8, "little")
+        self.vocabulary = Vocabulary()
+        # 語IDごとの (次元, 符号)。語彙が増えたら新しい語の分だけ計算する
+        self._buckets = np.empty(0, dtype=np.int64)
+        self._signs = np.empty(0, dtype=np.float32)
+
+    def _update_buckets(self):
+        terms = self.vocabulary.terms()[len(self._buckets):]
+        if not terms:
+            return
+        digests = np.frombuffer(
+            b"".join(
+                hashlib.blake2b(term.encode("utf-8"), digest_size=8, key=self._key).digest()
+                for term in terms
+            ),
+            dtype=np.uint64,
+        )
+        self._buckets = np.concatenate([self._buckets, (digests % self.dim).astype(np.int64)])
+        signs = np.where((digests >> np.uint64(63)) == 1, -1.0, 1.0).astype(np.float32)
+        self._signs = np.concatenate([self._signs, signs])
+
+    def embed_array(self, texts: Sequence[str]) -> np.ndarray:
+        """テキストを (件数, 次元) の正規化済み float32 行列にする"""
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.block_size):
+            block = texts[start:start + self.block_size]
+            token_ids = tokenize_batch(block, self.vocabulary, use_processes=False)
+            self._update_buckets()
+
+            lengths = np.fromiter(map(len, token_ids), dtype=np.int64, count=len(token_ids))
+            ids = np.concatenate(token_ids).astype(np.int64) if len(block) else np.empty(0, dtype=np.int64)
+            rows = np.repeat(np.arange(len(block), dtype=np.int64), lengths)
+            # (テキスト, 語) ごとの出現回数を数え、1 + log(回数) を符号付きで次元に足し込む
+            keys, counts = np.unique(rows * len(self.vocabulary) + ids, return_counts=True)
+            key_rows, key_terms = np.divmod(keys, max(len(self.vocabulary), 1))
+            weights = (1.0 + np.log(counts)) * self._signs[key_terms]
+            block_vectors = np.bincount(
+                key_rows * self.dim + self._buckets[key_terms],
+                weights=weights,
+                minlength=len(block) * self.dim,
+            ).reshape(len(block), self.dim)
+            vectors[start:start + len(block)] = normalize(block_vectors)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+
+def load_template_sentences(template_dirs: Sequence[Path] = TEMPLATE_DIRS) -> List[str]:
+    """テンプレート文書（フロントマターを除いた本文）を文に分ける"""
+    sentences: List[str] = []
+    for template_dir in template_dirs:
+        for path in sorted(Path(template_dir).glob("*.txt")):
+            _, body = split_front_matter(path.read_text(encoding="utf-8"))
+            sentences.extend(
+                sentence.strip() for sentence in _SENTENCE_END.split(body)
+                if len(sentence.strip()) >= 8
+            )
+    return sentences
+
+
+def generate_corpus(
+    n_chunks: int,
+    sentences: Sequence[str],
+    seed: int = 0,
+    sentences_per_chunk: Tuple[int, int] = (3, 6),
+) -> List[str]:
+    """
+    テンプレートの文を組み合わせて疑似チャンクを作る
+
+    各チャンクは文をランダムに3〜6文並べ、数字を別の値に置き換え、
+    Zipf分布で選んだ管理番号（PRJ-00042 など）を付けます。管理番号は出現頻度に偏りがあるため、
+    BM25の語の文書頻度（ありふれた語〜ほぼ1件にしか出ない語）が実際のコーパスに近くなります。
+    """
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(sentences_per_chunk[0], sentences_per_chunk[1] + 1, n_chunks)
+    picks = rng.integers(0, len(sentences), int(counts.sum()))
+    projects = np.minimum(rng.zipf(1.3, n_chunks), max(n_chunks // 10, 10))
+    numbers = iter(rng.integers(1, 10_000, int(counts.sum()) * 4).tolist())
+
+    def replace_number(match: re.Match) -> str:
+        return str(next(numbers, match.group()))
+
+    chunks: List[str] = []
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    for i in range(n_chunks):
+        text = "".join(sentences[j] for j in picks[offsets[i]:offsets[i + 1]])
+        chunks.append(f"PRJ-{projects[i]:05d}\n{_NUMBER.sub(replace_number, text)}")
+    return chunks
+
+
+def generate_queries(chunks: Sequence[str], n_queries: int, seed: int = 1) -> List[str]:
+    """
+    チャンクの一部を切り出してクエリを作る
+
+    半分は本文の12〜30文字（言い回しに近い質問）、残りはそれに管理番号を付けたもの
+    （キーワードの完全一致が効く質問）です。
+    """
+    rng = np.random.default_rng(seed)
+    queries: List[str] = []
+    for i in rng.integers(0, len(chunks), n_queries):
+        project, body = chunks[i].split("\n", 1)
+        length = int(rng.integers(12, 31))
+        start = int(rng.integers(0, max(len(body) - length, 1)))
+        query = body[start:start + length]
+        queries.append(f"{project} {query}" if rng.random() < 0.5 else query)
+    return queries
+
+
+def _with_ties(order: np.ndarray, scores: np.ndarray, k: int, atol: float = 0.0) -> np.ndarray:
+    """
+    スコアの降順に並んだ文書番号から、上位k件と k位に同点の文書を返す
+
+    Args:
+        atol: 同点とみなすスコアの差（計算順序で誤差が出る float32 の類似度用）
+    """
+    if len(order) <= k:
+        return order
+    return order[scores >= scores[k - 1] - atol]
+
+
+def _recall(found: Sequence[Sequence[int]], ground_truth: Sequence[Sequence[int]], k: int) -> float:
+    """
+    正解の上位k件のうち、見つかった件数の割合（正解が0件のクエリは除く）
+
+    ground_truth には k位と同点の文書も含めてよい（どれを返しても正解として数える）。
+    """
+    hits = total = 0
+    for row, truth in zip(found, ground_truth):
+        expected = min(k, len(truth))
+        hits += min(len(set(map(int, row[:k])) & set(map(int, truth))), expected)
+        total += expected
+    return hits / total if total else 1.0
+
+
+def _fuse(
+    rank_lists: Sequence[np.ndarray], weights: Sequence[float], c: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    文書番号の順位リストを重み付きRRFで融合し、(スコアの降順の文書番号, スコア) を返す
+
+    hybrid_retriever.weighted_rrf と同じ式。文書番号を結果に現れたものだけに詰めてから数えるため、
+    コーパスの大きさに関係なく1クエリのコストは順位リストの長さだけで決まります。
+    """
+    items, inverse = np.unique(np.concatenate(rank_lists), return_inverse=True)
+    contributions = np.concatenate([
+        weight / (np.arange(1, len(ranks) + 1, dtype=np.float64) + c)
+        for ranks, weight in zip(rank_lists, weights)
+    ])
+    scores = np.bincount(inverse, weights=contributions, minlength=len(items))
+    order = np.argsort(-scores, kind="stable")
+    return items[order], scores[order]
+
+
+def _directory_bytes(path: Path) -> int:
+    return sum(file.stat().st_size for file in Path(path).rglob("*") if file.is_file())
+
+
+def _measure(
+    name: str,
+    search: Callable[[int], Sequence[int]],
+    n_queries: int,
+    ground_truth: Sequence[Sequence[int]],
+    k: int,
+    build_seconds: float,
+    nbytes: Optional[int],
+    search_batch: Optional[Callable[[], Sequence[Sequence[int]]]] = None,
+) -> Dict[str, float]:
+    """1クエリずつの待ち時間とまとめて検索したときのQPS・recall@k を計測して1行にまとめる"""
+    found: List[Sequence[int]] = []
+    latencies = np.empty(n_queries, dtype=np.float64)
+    for i in range(n_queries):
+        start = time.perf_counter()
+        found.append(search(i))
+        latencies[i] = time.perf_counter() - start
+
+    if search_batch is not None:
+        start = time.perf_counter()
+        search_batch()
+        batch_seconds = time.perf_counter() - start
+    else:
+        batch_seconds = float(latencies.sum())
+    p50, p99 = np.percentile(latencies * 1000, [50, 99])
+    return {
+        "name": name,
+        "build_seconds": build_seconds,
+        "bytes": nbytes,
+        "p50_ms": float(p50),
+        "p99_ms": float(p99),
+        "qps": n_queries / batch_seconds if batch_seconds else float("inf"),
+        "recall": _recall(found, ground_truth, k),
+    }
+
+
+def benchmark_size(
+    chunks: Sequence[str],
+    queries: Sequence[str],
+    embeddings: HashingEmbeddings,
+    work_dir: Path,
+    k: int = 10,
+    fetch_k: int = 50,
+    weights: Sequence[float] = (1.0, 1.0),
+    c: int = 60,
+    max_bm25_retriever: int = 100_000,
+    max_chroma: int = 100_000,
+    search_params: Optional[Dict[str, int]] = None,
+) -> List[Dict[str, float]]:
+    """
+    1つのコーパスで全方式を計測する
+
+    Args:
+        chunks: コーパス（チャンクのテキスト）
+        queries: クエリ
+        embeddings: 疑似埋め込み
+        work_dir: Chroma の永続化先
+        k: recall@k の k（各方式の取得件数）
+        fetch_k: ハイブリッド検索で各ブランチから取得する件数
+        weights: ハイブリッド検索の重み（BM25, ベクトル）
+        c: RRFの定数
+        max_bm25_retriever: BM25Retriever を計測する最大チャンク数（rank_bm25 は全文書をPythonで採点するため）
+        max_chroma: Chroma を計測する最大チャンク数
+        search_params: 近似インデックスの検索パラメータ
+
+    Returns:
+        方式ごとの {"name", "build_seconds", "bytes", "p50_ms", "p99_ms", "qps", "recall"}
+    """
+    search_params = {**DEFAULT_SEARCH_PARAMS, **(search_params or {})}
+    n_chunks, n_queries = len(chunks), len(queries)
+    k = min(k, n_chunks)
+    fetch_k = min(max(fetch_k, k), n_chunks)
+    rows: List[Dict[str, float]] = []
+
+    vectors = embeddings.embed_array(chunks)
+    query_vectors = embeddings.embed_array(queries)
+    query_tokens = [tokenize(query) for query in queries]
+
+    # --- BM25 ---
+    start = time.perf_counter()
+    vocabulary = Vocabulary()
+    bm25 = BM25Index.from_token_ids(tokenize_batch(chunks, vocabulary), vocabulary.ids)
+    bm25_seconds = time.perf_counter() - start
+    bm25_bytes = sum(array.nbytes for array in (bm25.indptr, bm25.doc_ids, bm25.term_freqs, bm25.doc_lengths))
+
+    # 厳密なBM25: 全文書を採点してスコアの降順に並べる（クエリ語を含まない文書は除く）
+    def exact_bm25(tokens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        scores = bm25.get_scores(tokens)
+        order = np.lexsort((np.arange(n_chunks), -scores))
+        order = order[scores[order] != 0]
+        return order, scores[order]
+
+    bm25_exact = [exact_bm25(tokens) for tokens in query_tokens]
+    bm25_truth = [_with_ties(order, scores, k) for order, scores in bm25_exact]
+    rows.append(_measure(
+        "BM25Index", lambda i: [doc for doc, _ in bm25.search(query_tokens[i], k)],
+        n_queries, bm25_truth, k, bm25_seconds, bm25_bytes,
+    ))
+
+    if n_chunks <= max_bm25_retriever:
+        start = time.perf_counter()
+        retriever = BM25Retriever.from_texts(
+            chunks, metadatas=[{"n": i} for i in range(n_chunks)], preprocess_func=tokenize, k=k
+        )
+        build_seconds = time.perf_counter() - start
+        rows.append(_measure(
+            "BM25Retriever（rank_bm25）",
+            lambda i: [doc.metadata["n"] for doc in retriever.invoke(queries[i])],
+            n_queries, bm25_truth, k, build_seconds, None,
+        ))
+        del retriever
+
+    # --- ベクトル検索 ---
+    start = time.perf_counter()
+    exact_store = MatrixVectorStore(vectors)
+    build_seconds = time.perf_counter() - start
+    # 内容が同じチャンクは類似度も同じになるため、k位と同点のものも正解に含める
+    dense_fetch, dense_scores = exact_store.search_batch(query_vectors, fetch_k)
+    dense_truth = [
+        _with_ties(order, scores, k, atol=1e-5) for order, scores in zip(dense_fetch, dense_scores)
+    ]
+    rows.append(_measure(
+        "全件検索（MatrixVectorStore）",
+        # ストアは既定引数で渡す（_measure が返ればラムダごと参照が外れ、下の del で解放できる）
+        lambda i, store=exact_store: store.search_batch(query_vectors[i:i + 1], k)[0][0],
+        n_queries, dense_truth, k, build_seconds, exact_store.nbytes,
+        search_batch=lambda store=exact_store: store.search_batch(query_vectors, k),
+    ))
+    del exact_store
+
+    if n_chunks <= max_chroma:
+        chroma_dir = Path(work_dir) / f"chroma_{n_chunks}"
+        shutil.rmtree(chroma_dir, ignore_errors=True)
+        client = chromadb.PersistentClient(path=str(chroma_dir))
+        start = time.perf_counter()
+        vectorstore = Chroma(
+            client=client,
+            collection_name="retrieval-benchmark",
+            embedding_function=embeddings,
+            collection_metadata={"hnsw:space": "cosine"},
+        )
+        batch_size = client.get_max_batch_size()
+        for offset in range(0, n_chunks, batch_size):
+            end = min(offset + batch_size, n_chunks)
+            vectorstore._collection.add(
+                ids=[str(i) for i in range(offset, end)],
+                embeddings=vectors[offset:end],
+                documents=list(chunks[offset:end]),
+            )
+        build_seconds = time.perf_counter() - start
+
+        def chroma_search(batch: np.ndarray) -> List[List[int]]:
+            result = vectorstore._collection.query(query_embeddings=batch, n_results=k, include=[])
+            return [list(map(int, ids)) for ids in result["ids"]]
+
+        rows.append(_measure(
+            "Chroma（HNSW）", lambda i: chroma_search(query_vectors[i:i + 1])[0],
+            n_queries, dense_truth, k, build_seconds, _directory_bytes(chroma_dir),
+            search_batch=lambda: chroma_search(query_vectors),
+        ))
+        vectorstore.delete_collection()
+        del vectorstore, client
+        shutil.rmtree(chroma_dir, ignore_errors=True)
+
+    # 正規化済みベクトルなので、内積の大きい順 = コサイン類似度の大きい順
+    parameter_space = faiss.ParameterSpace()
+    hnsw_index: Optional[faiss.Index] = None
+    hnsw_row: Dict[str, float] = {}
+    for factory in suggest_factories(n_chunks, embeddings.dim):
+        if "PQ" in factory and n_chunks < 256 * 39:
+            # PQ の符号帳（256個の重心）の学習には 256 × 39 件以上のベクトルが必要
+            continue
+        start = time.perf_counter()
+        try:
+            index = build_index(vectors, factory, metric=faiss.METRIC_INNER_PRODUCT)
+        except RuntimeError:
+            # 学習に必要な件数に満たない IVF・PQ は飛ばす
+            continue
+        build_seconds = time.perf_counter() - start
+        param = search_param_name(index)
+        if param is not None:
+            parameter_space.set_index_parameter(index, param, search_params[param])
+        name = f"FAISS {factory}" + (f"（{param}={search_params[param]}）" if param else "")
+        rows.append(_measure(
+            name, lambda i, index=index: index.search(query_vectors[i:i + 1], k)[1][0],
+            n_queries, dense_truth, k, build_seconds, index_memory_bytes(index),
+            search_batch=lambda index=index: index.search(query_vectors, k),
+        ))
+        if factory.startswith("HNSW"):
+            # ハイブリッド検索のベクトル側には HNSW を使う
+            hnsw_index, hnsw_row = index, rows[-1]
+
+    # --- ハイブリッド検索（重み付きRRF） ---
+    hybrid_truth = [
+        _with_ties(*_fuse([order[:fetch_k], dense], weights, c), k)
+        for (order, _), dense in zip(bm25_exact, dense_fetch)
+    ]
+
+    def hybrid_search(i: int) -> np.ndarray:
+        bm25_ranks = np.fromiter((doc for doc, _ in bm25.search(query_tokens[i], fetch_k)), dtype=np.int64)
+        dense_ranks = hnsw_index.search(query_vectors[i:i + 1], fetch_k)[1][0]
+        return _fuse([bm25_ranks, dense_ranks[dense_ranks >= 0]], weights, c)[0][:k]
+
+    if hnsw_index is not None:
+        # 構築時間・サイズは BM25Index と HNSW の合計
+        rows.append(_measure(
+            "ハイブリッド（BM25Index + HNSW32・RRF）", hybrid_search,
+            n_queries, hybrid_truth, k,
+            bm25_seconds + hnsw_row["build_seconds"], bm25_bytes + hnsw_row["bytes"],
+        ))
+    return rows
+
+
+def run_benchmark(
+    sizes: Sequence[int] = DEFAULT_SIZES,
+    n_queries: int = 100,
+    dim: int = 128,
+    seed: int = 0,
+    work_dir: Path = DEFAULT_WORK_DIR,
+    **kwargs,
+) -> Dict[int, List[Dict[str, float]]]:
+    """
+    チャンク数ごとに疑似コーパスを作って benchmark_size() を実行する
+
+    Returns:
+        チャンク数 → 方式ごとの計測結果
+    """
+    sentences = load_template_sentences()
+    results: Dict[int, List[Dict[str, float]]] = {}
+    for n_chunks in sizes:
+        chunks = generate_corpus(n_chunks, sentences, seed=seed)
+        queries = generate_queries(chunks, n_queries, seed=seed + 1)
+        # チャンク数ごとに埋め込みの語彙を作り直す（前のサイズの語彙を持ち越さない）
+        embeddings = HashingEmbeddings(dim=dim, seed=seed)
+        results[n_chunks] = benchmark_size(chunks, queries, embeddings, work_dir, **kwargs)
+    return results
+
+
+def _format_bytes(nbytes: Optional[float]) -> str:
+    if nbytes is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024 or unit == "GB":
+            return f"{nbytes:.0f}{unit}" if unit == "B" else f"{nbytes:.1f}{unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f}GB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="検索方式のスケーリングベンチマーク（疑似コーパス・APIキー不要）")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+        help="計測するチャンク数（例: 10 1000 100000 1000000）",
+    )
+    parser.add_argument("--queries", type=int, default=100, help="クエリ数")
+    parser.add_argument("--k", type=int, default=10, help="recall@k の k")
+    parser.add_argument("--dim", type=int, default=128, help="疑似埋め込みの次元数")
+    parser.add_argument("--seed", type=int, default=0, help="コーパス・クエリ・埋め込みの乱数シード")
+    parser.add_argument(
+        "--max-bm25-retriever", type=int, default=100_000,
+        help="BM25Retriever を計測する最大チャンク数",
+    )
+    parser.add_argument("--max-chroma", type=int, default=100_000, help="Chroma を計測する最大チャンク数")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_SEARCH_PARAMS["nprobe"], help="IVF の nprobe")
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_SEARCH_PARAMS["efSearch"], help="HNSW の efSearch")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        sizes=args.sizes,
+        n_queries=args.queries,
+        dim=args.dim,
+        seed=args.seed,
+        k=args.k,
+        max_bm25_retriever=args.max_bm25_retriever,
+        max_chroma=args.max_chroma,
+        search_params={"nprobe": args.nprobe, "efSearch": args.ef_search},
+    )
+    for n_chunks, rows in results.items():
+        print(f"\n=== {n_chunks:,}チャンク・{args.queries}クエリ・{args.dim}次元 ===")
+        print(
+            f"  {'方式':<40} {'構築':>8} {'サイズ':>9} {'p50':>9} {'p99':>9} "
+            f"{'QPS':>9} {f'recall@{args.k}':>10}"
+        )
+        for row in rows:
+            print(
+                f"  {row['name']:<40} {row['build_seconds']:7.2f}秒 {_format_bytes(row['bytes']):>9} "
+                f"{row['p50_ms']:7.2f}ms {row['p99_ms']:7.2f}ms {row['qps']:9.1f} {row['recall']:10.3f}"
+            )
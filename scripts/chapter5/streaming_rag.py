@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+RAGの回答のストリーミング（検索完了・最初のトークン・最後のトークンの時刻つき）
+
+rag_chain.invoke は回答の全文ができるまで何も返しません。チャット画面の体感速度は
+全体の所要時間ではなく、最初の文字が表示されるまでの時間（TTFT: time to first token）で決まります。
+
+StreamingRAG は文脈の作成（検索）と回答の生成を分け、文脈ができた時点で LLM へのリクエストを始めて、
+届いたトークンを順に返します。途中で次のイベントを発行します（時刻は質問を受け取ってからの経過秒数）。
+
+    retrieval_done  検索と文脈の作成が終わった（LLM へのリクエストを始める）
+    first_token     最初のトークンが届いた（TTFT）
+    token           トークン（first_token の直後にも最初のトークンを token として発行する）
+    last_token      最後のトークンが届いた（回答の完了）
+
+使用例:
+    streamer = StreamingRAG(context_runnable, prompt | llm | StrOutputParser())
+    for token in streamer.stream(question):
+        print(token, end="", flush=True)
+    print(streamer.last_timings.summary())
+"""
+
+import time
+from typing import Callable, Iterator, List, Optional
+
+from langchain_core.runnables import Runnable
+
+
+class StreamEvent:
+    """ストリーミング中のイベント（種類・経過秒数・トークン）"""
+
+    RETRIEVAL_DONE = "retrieval_done"
+    FIRST_TOKEN = "first_token"
+    TOKEN = "token"
+    LAST_TOKEN = "last_token"
+
+    def __init__(self, kind: str, elapsed: float, text: str = ""):
+        self.kind = kind
+        self.elapsed = elapsed
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"StreamEvent({self.kind!r}, {self.elapsed:.3f}, {self.text!r})"
+
+
+class StreamTimings:
+    """1回の質問の検索完了・最初のトークン・最後のトークンの時刻（質問を受け取ってからの秒数）"""
+
+    def __init__(self):
+        self.retrieval: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.tokens = 0
+
+    def record(self, event: StreamEvent):
+        if event.kind == StreamEvent.RETRIEVAL_DONE:
+            self.retrieval = event.elapsed
+        elif event.kind == StreamEvent.FIRST_TOKEN:
+            self.first_token = event.elapsed
+        elif event.kind == StreamEvent.TOKEN:
+            self.tokens += 1
+        elif event.kind == StreamEvent.LAST_TOKEN:
+            self.last_token = event.elapsed
+
+    def summary(self) -> str:
+        """時刻を表示用の文字列で返す"""
+        def ms(seconds: Optional[float]) -> str:
+            return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+        generation = (
+            ms(self.last_token - self.first_token)
+            if self.first_token is not None and self.last_token is not None else "-"
+        )
+        return (
+            f"検索完了 {ms(self.retrieval)} / 最初のトークン {ms(self.first_token)}（TTFT） / "
+            f"最後のトークン {ms(self.last_token)}（生成 {generation}・{self.tokens}チャンク）"
+        )
+
+
+class StreamingRAG:
+    """文脈ができしだい回答の生成を始め、トークンを届いた順に返すRAG"""
+
+    def __init__(
+        self,
+        context_runnable: Runnable,
+        generation_chain: Runnable,
+        on_event: Optional[Callable[[StreamEvent], None]] = None,
+    ):
+        """
+        Args:
+            context_runnable: 質問から文脈の文字列を作る Runnable（検索 → format_docs）
+            generation_chain: {"context", "question"} からトークンを返す Runnable（prompt | llm | parser）
+            on_event: イベントごとに呼ぶ関数（計測やログ用）
+        """
+        self.context_runnable = context_runnable
+        self.generation_chain = generation_chain
+        self.on_event = on_event
+        self.last_timings: Optional[StreamTimings] = None
+        self.history: List[StreamTimings] = []
+
+    def stream_events(self, question: str) -> Iterator[StreamEvent]:
+        """質問に回答し、検索完了・トークン・最初と最後のトークンのイベントを順に返す"""
+        timings = StreamTimings()
+        self.last_timings = timings
+        self.history.append(timings)
+        started = time.perf_counter()
+
+        def emit(kind: str, text: str = "") -> StreamEvent:
+            event = StreamEvent(kind, time.perf_counter() - started, text)
+            timings.record(event)
+            if self.on_event is not None:
+                self.on_event(event)
+            return event
+
+        context = self.context_runnable.invoke(question)
+        yield emit(StreamEvent.RETRIEVAL_DONE)
+
+        # 文脈ができた時点で LLM へのリクエストを始める
+        first = True
+        for token in self.generation_chain.stream({"context": context, "question": question}):
+            if not token:
+                continue
+            if first:
+                yield emit(StreamEvent.FIRST_TOKEN)
+                first = False
+            yield emit(StreamEvent.TOKEN, token)
+        yield emit(StreamEvent.LAST_TOKEN)
+
+    def stream(self, question: str) -> Iterator[str]:
+        """質問に回答し、トークンだけを届いた順に返す（時刻は last_timings に記録）"""
+        for event in self.stream_events(question):
+            if event.kind == StreamEvent.TOKEN:
+                yield event.text
+
+    def invoke(self, question: str) -> str:
+        """回答の全文を返す（rag_chain.invoke と同じ使い方で時刻も記録する）"""
+        return "".join(self.stream(question))
+
+    def summary(self) -> str:
+        """これまでの質問の TTFT と完了までの時間の平均を表示用の文字列で返す"""
+        completed = [t for t in self.history if t.first_token is not None and t.last_token is not None]
+        if not completed:
+            return "ストリーミング: 完了した回答はありません"
+        ttft = sum(t.first_token for t in completed) / len(completed)
+        total = sum(t.last_token for t in completed) / len(completed)
+        retrieval = sum(t.retrieval for t in completed) / len(completed)
+        return (
+            f"ストリーミング（{len(completed)}問の平均）: 検索完了 {retrieval * 1000:.0f}ms / "
+            f"TTFT {ttft * 1000:.0f}ms / 完了 {total * 1000:.0f}ms"
+        )
@@ -0,0 +1,42 @@
+"""
+hybrid_retriever.grid_search_weights のテスト
+
+実行方法:
+    uv run pytest test_hybrid_retriever.py
+"""
+
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from hybrid_retriever import HybridSearchResult, grid_search_weights
+
+
+def _result(sources, rank_lists):
+    now = time.perf_counter()
+    return HybridSearchResult(
+        items=[Document(page_content=f"chunk{i}", metadata={"source": s}) for i, s in enumerate(sources)],
+        rank_lists=[np.array(ranks, dtype=np.int64) for ranks in rank_lists],
+        weights=[1.0, 1.0],
+        c=60,
+        branch_names=["BM25", "ベクトル"],
+        branch_seconds=[0.0, 0.0],
+        fusion_start=now,
+        started=now,
+    )
+
+
+def test_recall_counts_distinct_relevant_labels():
+    # 上位3件のうち2件が同じ正解ファイル A のチャンク
+    result = _result(["A", "A", "B", "C"], [[0, 1, 2, 3], [0, 1, 3, 2]])
+    rows = grid_search_weights([result], [{"A"}], np.array([[1.0, 1.0], [1.0, 0.0]]), k=3)
+    for row in rows:
+        assert row["recall"] == 1.0
+        assert row["mrr"] == 1.0
+
+
+def test_recall_is_fraction_of_answers_found():
+    result = _result(["A", "A", "B", "C"], [[0, 1, 2, 3], [0, 1, 2, 3]])
+    rows = grid_search_weights([result], [{"A", "C"}], np.array([[1.0, 1.0]]), k=3)
+    assert rows[0]["recall"] == 0.5
@@ -0,0 +1,69 @@
+"""
+inverted_index.InvertedIndex・doc_store.OffsetDocStore の中断した追記のテスト
+
+実行方法:
+    uv run pytest test_inverted_index.py
+"""
+
+import numpy as np
+import pytest
+
+import inverted_index
+from doc_store import OffsetDocStore
+from inverted_index import InvertedIndex, content_hash
+
+
+def _add(index, text):
+    return index.add_documents([text.split("-")], [text], [{"source": text}])
+
+
+def _interrupted_add(index, text, monkeypatch):
+    """meta.json を置き換える直前で中断した追記"""
+    def fail(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(inverted_index.os, "replace", fail)
+        with pytest.raises(KeyboardInterrupt):
+            _add(index, text)
+
+
+def _check(index, texts):
+    assert len(index) == len(index.docstore) == len(texts)
+    for doc_id, text in enumerate(texts):
+        doc = index.get_document(doc_id)
+        assert doc.page_content == text and doc.metadata == {"source": text}
+    assert np.array_equal(
+        index.doc_hashes(),
+        np.frombuffer(b"".join(content_hash(text) for text in texts), dtype=np.uint8).reshape(-1, 16),
+    )
+
+
+def test_interrupted_add_is_dropped_on_reopen(tmp_path, monkeypatch):
+    _add(InvertedIndex(tmp_path), "doc0")
+    _interrupted_add(InvertedIndex(tmp_path), "doc1-lost", monkeypatch)
+
+    index = InvertedIndex(tmp_path)
+    assert _add(index, "doc2") == range(1, 2)
+    _check(index, ["doc0", "doc2"])
+    _check(InvertedIndex(tmp_path), ["doc0", "doc2"])
+    assert "lost" not in InvertedIndex(tmp_path).vocabulary
+
+
+def test_interrupted_add_is_dropped_in_same_process(tmp_path, monkeypatch):
+    index = InvertedIndex(tmp_path)
+    _add(index, "doc0")
+    _interrupted_add(index, "doc1-lost", monkeypatch)
+    _add(index, "doc2")
+    _check(index, ["doc0", "doc2"])
+
+
+def test_docstore_columns_stay_aligned(tmp_path):
+    store = OffsetDocStore(tmp_path)
+    store.append(["a"], [{"n": 0}])
+    # 本文の列だけに書き込んだところで中断した追記
+    store._texts.append([b"half"])
+
+    store = OffsetDocStore(tmp_path)
+    assert store.append(["b"], [{"n": 1}]) == range(1, 2)
+    assert [store.get(i) for i in range(len(store))] == [("a", {"n": 0}), ("b", {"n": 1})]
@@ -0,0 +1,37 @@
+"""
+metadata_index.MetadataIndex の範囲条件のテスト
+
+実行方法:
+    uv run pytest test_metadata_index.py
+"""
+
+import datetime
+
+import pytest
+
+from front_matter import parse_header
+from metadata_index import MetadataIndex, parse_where
+
+METADATAS = [
+    parse_header("revised: 2023-10-01\nchapter: 第1章"),
+    parse_header("revised: 2024-04-01\nchapter: 第2章"),
+    parse_header("revised: 2024-09-15\nchapter: 3"),
+]
+
+
+def test_date_range_with_date_or_string_operand():
+    index = MetadataIndex(METADATAS)
+    for operand in (datetime.date(2024, 4, 1), "2024-04-01"):
+        assert index.candidates({"revised": {"$gte": operand}}).tolist() == [1, 2]
+    assert index.candidates(parse_where(["revised=2024-04-01"])).tolist() == [1]
+
+
+def test_mixed_type_key_skips_incomparable_values():
+    index = MetadataIndex(METADATAS)
+    assert index.candidates({"chapter": {"$gte": "第2章"}}).tolist() == [1]
+
+
+def test_incomparable_operand_raises():
+    index = MetadataIndex(METADATAS)
+    with pytest.raises(TypeError):
+        index.candidates({"revised": {"$gte": 2024}})
@@ -0,0 +1,44 @@
+"""
+quantized_store.QuantizedVectorStore のテスト
+
+実行方法:
+    uv run pytest test_quantized_store.py
+"""
+
+import numpy as np
+import pytest
+
+from quantized_store import QuantizedVectorStore, create_vector_store
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_empty_store_returns_empty_results(tmp_path, mode):
+    store = QuantizedVectorStore(tmp_path / mode, mode=mode)
+    queries = np.ones((2, 8), dtype=np.float32)
+    assert store.approximate_scores(queries).shape == (2, 0)
+    indices, scores = store.search_batch(queries, k=4)
+    assert indices.shape == (2, 0) and scores.shape == (2, 0)
+    assert store.search([1.0] * 8) == []
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_search_finds_added_vector(tmp_path, mode):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 16)).astype(np.float32)
+    store = QuantizedVectorStore(tmp_path / mode, mode=mode)
+    store.add(vectors)
+    assert store.search(vectors[7], k=1)[0][0] == 7
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_candidates_restrict_search(tmp_path, mode):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 16)).astype(np.float32)
+    candidates = np.arange(0, 50, 3)
+    store = create_vector_store(vectors, mode, tmp_path)
+    exact = create_vector_store(vectors)
+    indices, _ = store.search_batch(vectors[:5], k=3, candidates=candidates)
+    expected, _ = exact.search_batch(vectors[:5], k=3, candidates=candidates)
+    assert np.isin(indices, candidates).all()
+    assert np.array_equal(indices, expected)
+    assert store.search(vectors[1], k=2, candidates=[]) == []
@@ -0,0 +1,28 @@
+"""
+vector_store.MatrixVectorStore のテスト
+
+実行方法:
+    uv run pytest test_vector_store.py
+"""
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from metadata_index import create_prefiltered_retrievers
+from vector_store import MatrixVectorStore
+
+
+@pytest.mark.parametrize("dim", [0, 8])
+def test_empty_store_returns_empty_results(dim):
+    store = MatrixVectorStore(dim=dim)
+    queries = np.ones((3, 8), dtype=np.float32)
+    indices, scores = store.search_batch(queries, k=4)
+    assert indices.shape == (3, 0) and scores.shape == (3, 0)
+    assert store.mmr_search_batch(queries, k=4)[0].shape == (3, 0)
+    assert store.search([1.0] * 8) == []
+
+
+def test_prefiltered_retrievers_without_chunks():
+    _, vector_retriever = create_prefiltered_retrievers([], DeterministicFakeEmbedding(size=8), str.split)
+    assert vector_retriever.invoke("有給休暇") == []
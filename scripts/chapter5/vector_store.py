@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+正規化済み埋め込み行列によるベクトル検索（全件・厳密）
+
+文書ごとにループして np.linalg.norm と np.dot を呼ぶ方法では、
+文書数に比例してPythonの呼び出し回数が増えます。
+MatrixVectorStore は埋め込みを登録時に1度だけ L2 正規化して行列に並べておき、
+コサイン類似度を「行列積1回 + argpartition による上位k件の抽出」で求めます。
+
+- 文書ベクトルは float32（省メモリにしたい場合は float16）の連続した行列で保持
+- クエリは1件でも複数件（バッチ）でも同じ行列積で処理
+- 行列積は文書・クエリをブロックに分けて計算し、一時配列の大きさを抑える
+  （float16 の場合はブロックごとに float32 へ戻して BLAS で計算）
+
+1536次元・100万件（float32 で約6GB）でも、全件の厳密検索をクエリあたり1回の行列積で行えます。
+
+MMR（Maximal Marginal Relevance）も同じ行列で計算します。
+候補どうしの類似度行列を1回の行列積で求め、選んだ文書との最大類似度を1件選ぶごとに
+np.maximum で更新するため、候補数（fetch_k）が数百件でも、複数クエリをまとめて処理できます。
+
+使用例:
+    store = MatrixVectorStore(embeddings.embed_documents(documents))
+    results = store.search(embeddings.embed_query(query), k=3)   # [(文書番号, 類似度), ...]
+    indices, scores = store.mmr_search_batch(query_vectors, k=3, fetch_k=100)
+"""
+
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+ArrayLike = Union[np.ndarray, Sequence[Sequence[float]]]
+
+
+def normalize(vectors: ArrayLike) -> np.ndarray:
+    """各行を L2 正規化した float32 の行列を返す（長さ0のベクトルは0のまま）"""
+    matrix = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    各行のスコアから上位k件を取り出す（同点は番号の小さい順）
+
+    Returns:
+        (上位k件の番号, そのスコア)  いずれも (行数, k) の配列
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(scores.dtype)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    # 候補k件だけを (スコア降順, 番号昇順) で並べる
+    order = np.lexsort((candidates, -candidate_scores), axis=1)
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return indices, np.take_along_axis(candidate_scores, order, axis=1)
+
+
+def mmr_select(
+    query_scores: np.ndarray,
+    pairwise: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.5,
+    valid: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    候補の中から MMR で k 件を選ぶ（複数クエリをまとめて処理）
+
+    選び方は langchain の maximal_marginal_relevance と同じです。
+    1件目はクエリに最も近い候補、2件目以降は
+    lambda_mult × クエリとの類似度 − (1 − lambda_mult) × 選択済みとの最大類似度
+    が最大の候補（同点は候補の番号が小さい方）を選びます。
+
+    Args:
+        query_scores: クエリと候補のコサイン類似度（クエリ数, 候補数）
+        pairwise: 候補どうしのコサイン類似度（クエリ数, 候補数, 候補数）
+        k: 選ぶ件数
+        lambda_mult: 1 に近いほど類似度、0 に近いほど多様性を重視
+        valid: 有効な候補なら True（候補数がクエリごとに異なる場合の穴埋め用）
+
+    Returns:
+        選んだ候補の番号（クエリ数, k）、有効な候補が足りない分は -1
+    """
+    n_queries, n_candidates = query_scores.shape
+    k = min(k, n_candidates)
+    selected = np.full((n_queries, k), -1, dtype=np.int64)
+    if k == 0:
+        return selected
+    available = np.ones_like(query_scores, dtype=bool) if valid is None else valid.copy()
+    rows = np.arange(n_queries)
+    # 選択済みの文書との最大類似度（1件選ぶごとに、その文書との類似度で更新する）
+    max_similarity = np.full(query_scores.shape, -np.inf, dtype=np.float64)
+
+    scores = query_scores.astype(np.float64)
+    for step in range(k):
+        if step:
+            scores = lambda_mult * query_scores - (1 - lambda_mult) * max_similarity
+        scores = np.where(available, scores, -np.inf)
+        picked = np.argmax(scores, axis=1)
+        ok = available[rows, picked]
+        selected[ok, step] = picked[ok]
+        available[rows[ok], picked[ok]] = False
+        max_similarity[ok] = np.maximum(max_similarity[ok], pairwise[rows[ok], picked[ok]])
+    return selected
+
+
+def mmr_rerank(
+    queries: ArrayLike,
+    candidates: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.5,
+    valid: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    クエリごとの候補ベクトルから MMR で k 件を選ぶ
+
+    Args:
+        queries: クエリベクトル（クエリ数, 次元）
+        candidates: 候補ベクトル（クエリ数, 候補数, 次元）正規化されていなくてよい
+        valid: 有効な候補なら True（クエリ数, 候補数）
+
+    Returns:
+        選んだ候補の番号（クエリ数, k）、足りない分は -1
+    """
+    query_matrix = normalize(queries)
+    n_queries, n_candidates, dim = candidates.shape
+    candidate_matrix = normalize(candidates.reshape(-1, dim)).reshape(n_queries, n_candidates, dim)
+    # クエリとの類似度と、候補どうしの類似度行列をそれぞれ1回の（バッチ）行列積で求める
+    query_scores = np.matmul(candidate_matrix, query_matrix[:, :, None])[:, :, 0]
+    pairwise = np.matmul(candidate_matrix, candidate_matrix.transpose(0, 2, 1))
+    return mmr_select(query_scores, pairwise, k, lambda_mult, valid)
+
+
+class MatrixVectorStore:
+    """正規化済みの埋め込み行列に対する全件コサイン類似度検索"""
+
+    def __init__(
+        self,
+        vectors: ArrayLike = (),
+        dtype: type = np.float32,
+        dim: int = 0,
+        doc_block_size: int = 65536,
+        query_block_size: int = 64,
+    ):
+        """
+        Args:
+            vectors: 文書の埋め込み（件数, 次元）
+            dtype: 保存する精度（np.float32 または np.float16）
+            dim: vectors が空のときの次元数
+            doc_block_size: 行列積1回あたりの文書数（float16 の変換単位）
+            query_block_size: 行列積1回あたりのクエリ数
+        """
+        if dtype not in (np.float32, np.float16):
+            raise ValueError("dtype は np.float32 か np.float16 を指定してください")
+        self.dtype = dtype
+        self.doc_block_size = doc_block_size
+        self.query_block_size = query_block_size
+        self.matrix = np.empty((0, dim), dtype=dtype)
+        if len(vectors):
+            self.add(vectors)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        """埋め込み行列のメモリ使用量（バイト）"""
+        return self.matrix.nbytes
+
+    def add(self, vectors: ArrayLike) -> range:
+        """文書ベクトルを正規化して追加し、割り当てた文書番号を返す"""
+        new_rows = normalize(vectors).astype(self.dtype, copy=False)
+        if len(self) and new_rows.shape[1] != self.dim:
+            raise ValueError(f"次元数が一致しません: {new_rows.shape[1]} != {self.dim}")
+        start = len(self)
+        self.matrix = np.ascontiguousarray(np.concatenate([self.matrix, new_rows])) if start else new_rows
+        return range(start, len(self))
+
+    def similarities(self, queries: ArrayLike) -> np.ndarray:
+        """全文書とのコサイン類似度（クエリ数, 文書数）"""
+        query_matrix = normalize(queries)
+        if not len(self):
+            # 空のストアは次元数が決まっていないことがある（dim=0）ため、行列積を行わない
+            return np.empty((len(query_matrix), 0), dtype=np.float32)
+        if self.dtype == np.float32:
+            return query_matrix @ self.matrix.T
+        scores = np.empty((len(query_matrix), len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.doc_block_size):
+            block = self.matrix[start:start + self.doc_block_size].astype(np.float32)
+            scores[:, start:start + len(block)] = query_matrix @ block.T
+        return scores
+
+    def search_batch(
+        self, queries: ArrayLike, k: int = 4, candidates: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        複数クエリの上位k件をまとめて検索
+
+        Args:
+            candidates: 検索対象にする文書番号の配列（None なら全文書）。
+                候補の行だけを取り出して行列積を計算するため、計算量は候補数に比例します
+
+        Returns:
+            (文書番号, 類似度)  いずれも (クエリ数, k) の配列
+        """
+        if candidates is not None:
+            candidates = np.asarray(candidates, dtype=np.int64)
+            subset = MatrixVectorStore(
+                dtype=self.dtype, dim=self.dim,
+                doc_block_size=self.doc_block_size, query_block_size=self.query_block_size,
+            )
+            subset.matrix = self.matrix[candidates]
+            indices, scores = subset.search_batch(queries, k)
+            return candidates[indices], scores
+
+        query_matrix = normalize(queries)
+        k = min(k, len(self))
+        indices = np.empty((len(query_matrix), k), dtype=np.int64)
+        scores = np.empty((len(query_matrix), k), dtype=np.float32)
+        # クエリをブロックに分け、(クエリ数, 文書数) の一時配列が大きくなりすぎないようにする
+        for start in range(0, len(query_matrix), self.query_block_size):
+            block = query_matrix[start:start + self.query_block_size]
+            block_indices, block_scores = top_k(self.similarities(block), k)
+            indices[start:start + len(block)] = block_indices
+            scores[start:start + len(block)] = block_scores
+        return indices, scores
+
+    def search(
+        self, query: Sequence[float], k: int = 4, candidates: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """1件のクエリで上位k件を検索し、(文書番号, 類似度) のリストを返す"""
+        indices, scores = self.search_batch([query], k, candidates)
+        return [(int(i), float(score)) for i, score in zip(indices[0], scores[0])]
+
+    def mmr_search_batch(
+        self,
+        queries: ArrayLike,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        複数クエリの MMR 検索（上位 fetch_k 件の候補から k 件を選ぶ）
+
+        候補のベクトルは正規化済みの行列から行を取り出すだけで、再計算しません。
+
+        Returns:
+            (文書番号, クエリとの類似度)  いずれも (クエリ数, k) の配列（MMR で選んだ順）
+        """
+        query_matrix = normalize(queries)
+        k = min(k, fetch_k, len(self))
+        indices = np.empty((len(query_matrix), k), dtype=np.int64)
+        scores = np.empty((len(query_matrix), k), dtype=np.float32)
+        for start in range(0, len(query_matrix), self.query_block_size):
+            block = query_matrix[start:start + self.query_block_size]
+            candidates, candidate_scores = top_k(self.similarities(block), fetch_k)
+            candidate_vectors = self.matrix[candidates].astype(np.float32)
+            query_scores = candidate_scores.astype(np.float32)
+            pairwise = np.matmul(candidate_vectors, candidate_vectors.transpose(0, 2, 1))
+            picked = mmr_select(query_scores, pairwise, k, lambda_mult)
+            indices[start:start + len(block)] = np.take_along_axis(candidates, picked, axis=1)
+            scores[start:start + len(block)] = np.take_along_axis(query_scores, picked, axis=1)
+        return indices, scores
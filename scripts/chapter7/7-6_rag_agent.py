@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import hashlib
 import json
 import os
 import sys
@@ -34,6 +35,11 @@ ROOT = Path(__file__).resolve().parent
 OUTPUT_DIR = ROOT / "outputs"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# 第5章の埋め込みキャッシュを共有し、一度埋め込んだチャンクは章をまたいで再計算しない
+sys.path.append(str(ROOT.parent / "chapter5"))
+from embedding_cache import CachedEmbeddings  # noqa: E402
+from query_cache import DEFAULT_CACHE_DIR, SemanticQueryCache  # noqa: E402
+
 # LangGraph の 1 ステップは「LLM 思考 + ツール実行」で2～3カウント進むため、
 # 社内+Web+GitHub を行き来する調査でも余裕があるよう 15 ステップ確保しておく。
 MAX_STEPS = 15
@@ -43,6 +49,9 @@ GRAPH_RECURSION_LIMIT = 80
 FETCH_TIMEOUT = 8
 MAX_DOC_LENGTH = 3200
 CONFIDENCE_SKIP_EXTERNAL = 0.85  # 社内データの類似度が十分高い場合は外部検索を抑制
+# corp_search の結果キャッシュ: 埋め込みのコサイン類似度がこれ以上の質問は同じ質問として結果を再利用する
+QUERY_CACHE_THRESHOLD = float(os.getenv("QUERY_CACHE_THRESHOLD", "0.95"))
+QUERY_CACHE_TTL_SECONDS = 24 * 3600
 
 warnings.filterwarnings("ignore", category=UserWarning, module="pydantic._migration")
 
@@ -127,7 +136,8 @@ class RAGAgentState(TypedDict):
     query: str
 
 vector_store: Optional[Chroma] = None
-embeddings: Optional[OpenAIEmbeddings] = None
+embeddings: Optional[CachedEmbeddings] = None
+query_cache: Optional[SemanticQueryCache] = None
 mcp_client: Optional[MultiServerMCPClient] = None
 github_tools_enabled: bool = False
 active_tool_list: List[Any] = [ ]
@@ -169,7 +179,7 @@ def run_async(coro):
 
 
 def initialize_rag() -> None:
-    global vector_store, embeddings
+    global vector_store, embeddings, query_cache
     if vector_store is not None and embeddings is not None:
         return
 
@@ -177,7 +187,7 @@ def initialize_rag() -> None:
 
     require_env("OPENAI_API_KEY")
 
-    embeddings = OpenAIEmbeddings()
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
 
     sample_docs = [
         {
@@ -218,7 +228,19 @@ def initialize_rag() -> None:
         metadatas=metadatas,
         collection_name="corp_knowledge",
     )
-    print(f"[Init] {len(texts)} チャンクをインデックス化完了")
+    print(f"[Init] {len(texts)} チャンクをインデックス化完了（{embeddings.stats()}）")
+
+    # コレクションの内容（チャンク・メタデータ・埋め込みモデル）が変わったらキャッシュ済みの検索結果を捨てる
+    collection_version = hashlib.sha256(
+        json.dumps([embeddings.model_name, texts, metadatas], ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    query_cache = SemanticQueryCache(
+        embeddings,
+        DEFAULT_CACHE_DIR / "corp_search",
+        version=collection_version,
+        threshold=QUERY_CACHE_THRESHOLD,
+        ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+    )
 
 
 @tool
@@ -226,7 +248,14 @@ def corp_search(query: str, top_k: int = 3) -> str:
     """社内データを検索し、JSON 文字列を返す"""
     # RAG初期化（初回のみChromaインデックス構築）
     initialize_rag()
-    assert vector_store is not None
+    assert vector_store is not None and query_cache is not None
+
+    # 同じ質問・言い回しだけが違う質問は、キャッシュ済みの検索結果を返す
+    namespace = f"top_k={top_k}"
+    cached = query_cache.get(query, namespace)
+    if cached is not None:
+        print(f"[Tool:CorpSearch] {len(cached)} 件の結果（{query_cache.stats()}）")
+        return json.dumps(cached, ensure_ascii=False)
 
     # ベクトル検索で類似チャンクを取得（距離スコア付き）
     results = vector_store.similarity_search_with_score(query, k=top_k)
@@ -244,6 +273,9 @@ def corp_search(query: str, top_k: int = 3) -> str:
             }
         )
 
+    query_cache.put(query, processed, namespace)
+    query_cache.save()
+
     print(f"[Tool:CorpSearch] {len(processed)} 件の結果")
     return json.dumps(processed, ensure_ascii=False)
 